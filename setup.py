@@ -30,6 +30,7 @@ def main():
         platforms=app.__platforms__,
         install_requires=app.__requires__,
         extras_require=app.__extra_requires__,
+        entry_points=app.__entry_points__,
     )
 
 
@@ -17,6 +17,13 @@ __classifiers__ = [
 __requires__ = ["requests", "filelock", "jsonpickle", "tzlocal", "python-json-logger", "tqdm"]
 
 __extra_requires__ = {
+    "async": ["aiohttp"],
+    "thumbnails": ["Pillow"],
+    "diff": ["Pillow", "numpy"],
+}
+
+__entry_points__ = {
+    "pytest11": ["tauk = tauk.listeners.pytest_plugin"],
 }
 
 
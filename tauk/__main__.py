@@ -1,16 +1,20 @@
 """Main entry point"""
 import argparse
+import json
 import logging
 import os.path
-import platform
 import sys
+import time
 import traceback
-import requests
 
 from pathlib import Path
 from tqdm import tqdm
 
+from tauk import cleanup, run_summary
+from tauk.assistant.installer import AssistantInstaller
+
 TAUK_HOME = os.path.join(Path.home(), '.tauk')
+verbose = False
 
 
 def print_verbose(line, exec_info=None):
@@ -20,90 +24,90 @@ def print_verbose(line, exec_info=None):
             traceback.print_exception(exec_info)
 
 
-def get_os_name():
-    return platform.system().lower()
+def install_assistant(api_token, ver, url=None):
+    installer = AssistantInstaller(api_token, ver, os.path.join(TAUK_HOME, 'binaries'), api_url=url)
+    print_verbose(f'Installing tauk-assistant {ver} using cache {installer.cache_dir}')
+    if installer.is_installed():
+        print(f'tauk-assistant {ver} is already installed at {installer.install_path}')
+        return
 
+    try:
+        with tqdm(unit='iB', unit_scale=True, unit_divisor=1024, miniters=1,
+                  desc=f'Downloading Binary: {installer.install_path}') as progress:
+            installer.install(progress)
+    except Exception as ex:
+        print(f'Failed to install tauk-assistant: {ex}. Please verify if your API token is correct')
+        print_verbose('Failed to install tauk-assistant', exec_info=ex)
+        sys.exit(1)
 
-def get_architecture_name():
-    machine = platform.machine().lower()
-    return 'amd64' if machine == 'x86_64' else machine
 
+def format_size(size):
+    for unit in ['B', 'KiB', 'MiB']:
+        if size < 1024:
+            return f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}GiB'
 
-def install_assistant(api_token, ver, url=None):
-    download_api_url = f'https://www.tauk.com/api/v1/assistant/binary' if url is None else url
-    download_api_url = f'{download_api_url}?version={ver}&os={get_os_name()}&arch={get_architecture_name()}'
-
-    print_verbose(f'Installing tauk-assistant from {download_api_url}')
-    binaries_home = os.path.join(TAUK_HOME, 'binaries')
-    assistant_tgz_path = os.path.join(binaries_home, 'tauk-assistant.tgz')
-    binary_path = os.path.join(binaries_home, f'tauk-assistant-{get_os_name()}-{get_architecture_name()}')
-    new_binary_path = binary_path.replace(f'-{get_os_name()}-{get_architecture_name()}', '')
-
-    if not os.path.exists(binaries_home):
-        os.makedirs(binaries_home)
-
-    header = {'Authorization': f'Bearer {api_token}'}
-    response = requests.get(download_api_url, headers=header)
-    if not response.ok:
-        print_verbose(f'[{response.status_code}] {response.text}')
-        print('Failed to download tauk-assistant. Please verify if your API token is correct')
-        sys.exit(1)
 
-    s3_download_url = response.json()['url']
+def print_files_in_tauk_home():
+    current_category = None
 
-    print_verbose(f'Downloading binary from S3: {s3_download_url}')
-    response = requests.get(s3_download_url, allow_redirects=True, timeout=180, stream=True)
-    total_size_bytes = int(response.headers.get('content-length', 0))
-    with tqdm.wrapattr(open(assistant_tgz_path, 'wb'), "write", unit='iB', unit_scale=True, unit_divisor=1024,
-                       miniters=1, desc=f'Downloading Binary: {new_binary_path}', total=total_size_bytes) as file:
-        for chunk in response.iter_content(chunk_size=4096):
-            file.write(chunk)
+    def print_file(category, path, size):
+        nonlocal current_category
+        if category != current_category:
+            current_category = category
+            print(f'{category}:')
+        print(f' {path}\t{size}')
 
-    print_verbose(f'Extracting tar file {assistant_tgz_path}')
-    import tarfile
-    with tarfile.open(assistant_tgz_path) as file:
-        file.extractall(binaries_home)
+    print_usage(cleanup.scan(TAUK_HOME, on_file=print_file))
 
-    try:
-        os.rename(binary_path, new_binary_path)
-        os.remove(assistant_tgz_path)
 
-        if get_os_name() == 'darwin':
-            exit_code = os.system(f'xattr -r -d com.apple.quarantine {new_binary_path}')
-            if exit_code != 0:
-                print('Failed to remove quarantine flag')
-    except Exception as ex:
-        print(f'Failed to extract tauk binary')
-        print_verbose(f'Failed to extract {binary_path}', exec_info=ex)
+def print_usage(report):
+    print('Usage:')
+    for category, usage in report.usage.items():
+        print(f' {category}\t{usage.files} files\t{format_size(usage.bytes)}')
 
 
-def print_files_in_tauk_home():
-    paths = list(Path(TAUK_HOME).rglob("*"))
-    logs = []
-    binaries = []
-    assistant = []
-    others = []
-    for path in paths:
-        if Path(path).name in ['.DS_Store', 'logs', 'binaries']:
-            continue
-        elif str(path).startswith(f'{os.path.join(TAUK_HOME, "logs")}'):
-            logs.append(path)
-        elif str(path).startswith(f'{os.path.join(TAUK_HOME, "binaries")}'):
-            binaries.append(path)
-        else:
-            others.append(path)
-
-    print('Logs:')
-    for log in logs:
-        print(f' {log}\t{log.stat().st_size}')
-
-    print('Binaries:')
-    for binary in binaries:
-        print(f' {binary}\t{binary.stat().st_size}')
-
-    print('Others:')
-    for other in others:
-        print(f' {other}\t{other.stat().st_size}')
+def cleanup_tauk_home(ttl_hours, dry_run, workers):
+    report = cleanup.scan(TAUK_HOME, ttl=ttl_hours * 60 * 60)
+    print_usage(report)
+
+    stale = report.stale_exec_dirs
+    print(f'Stale execution dirs: {len(stale)} of {len(report.exec_dirs)}')
+    for exec_dir in stale:
+        print(f' {exec_dir.path}\t{format_size(exec_dir.bytes)}\t{exec_dir.stale_reason}')
+
+    if dry_run or not stale:
+        return
+
+    cleanup.prune(report, workers=workers)
+    print(f'Deleted {len(report.deleted)} execution dirs, freed {format_size(report.freed_bytes)}')
+    for exec_dir in report.failed:
+        print(f'Failed to delete {exec_dir.path}')
+
+
+def format_measure(name, value):
+    return format_size(value) if name.endswith('_bytes') else f'{value:.1f}'
+
+
+def print_stats(directory, group_by, since_hours, as_json):
+    paths = run_summary.find_summaries(directory)
+    if not paths:
+        print(f'No run summaries found in {directory}')
+        return
+
+    since = int((time.time() - since_hours * 60 * 60) * 1000) if since_hours else None
+    report = run_summary.aggregate(paths, group_by, since).to_json()
+    if as_json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f'{report["tests"]} tests in {report["runs"]} runs from {report["files"]} files')
+    for group, measures in report['groups'].items():
+        print(f'{group_by}={group}\t{measures.pop("tests")} tests')
+        for name, stats in measures.items():
+            if stats:
+                print(f' {name}\t' + '\t'.join(f'{key} {format_measure(name, value)}' for key, value in stats.items()))
 
 
 if sys.argv[0].endswith("__main__.py"):
@@ -118,10 +122,29 @@ if sys.argv[0].endswith("__main__.py"):
                                   help='[Unstable] Version of assistant to download')
     assistant_parser.add_argument('-i', '--install', dest='install', action=argparse.BooleanOptionalAction,
                                   help='Install tauk assistant')
+    assistant_parser.add_argument('-u', '--url', dest='url', type=str, help=argparse.SUPPRESS)
 
     cleanup_parser = subparser.add_parser('cleanup')
     cleanup_parser.add_argument('-l', '--list', dest='list', action=argparse.BooleanOptionalAction,
                                 help='list all the files in tauk home directory')
+    cleanup_parser.add_argument('-p', '--prune', dest='prune', action=argparse.BooleanOptionalAction,
+                                help='delete execution dirs of runs which are no longer running')
+    cleanup_parser.add_argument('--ttl', dest='ttl', type=float, default=24, metavar='HOURS',
+                                help='execution dirs older than this are deleted even if their process is alive')
+    cleanup_parser.add_argument('--dry-run', dest='dry_run', action=argparse.BooleanOptionalAction,
+                                help='only print the execution dirs which would be deleted')
+    cleanup_parser.add_argument('-w', '--workers', dest='workers', type=int, default=8,
+                                help='number of parallel deletions')
+
+    stats_parser = subparser.add_parser('stats')
+    stats_parser.add_argument('-d', '--dir', dest='dir', type=str, default=run_summary.get_default_summary_dir(),
+                              help='directory of the run summaries')
+    stats_parser.add_argument('-g', '--group-by', dest='group_by', type=str, default='status',
+                              help='column to group the tests by, Ex: platform_name, browser_name, file_name')
+    stats_parser.add_argument('--since', dest='since', type=float, metavar='HOURS',
+                              help='only include tests started in the last HOURS')
+    stats_parser.add_argument('--json', dest='json', action=argparse.BooleanOptionalAction,
+                              help='print the aggregates as JSON')
 
     args = parser.parse_args()
 
@@ -130,11 +153,17 @@ if sys.argv[0].endswith("__main__.py"):
     if args.command == 'assistant':
         if args.install:
             # We tie an assistant version to every release
-            install_assistant(args.token, '0.2.5' if not args.version else args.version)
+            install_assistant(args.token, '0.2.5' if not args.version else args.version, args.url)
             sys.exit(0)
     elif args.command == 'cleanup':
         if args.list:
             print_files_in_tauk_home()
             sys.exit(0)
+        if args.prune:
+            cleanup_tauk_home(args.ttl, args.dry_run, args.workers)
+            sys.exit(0)
+    elif args.command == 'stats':
+        print_stats(args.dir, args.group_by, args.since, args.json)
+        sys.exit(0)
 
     print(parser.format_help())
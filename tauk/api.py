@@ -1,17 +1,25 @@
 import gzip
+import http.client
 import logging
 import os
 import platform
 import re
+import threading
+import time
 from datetime import datetime, timezone
 
 import requests
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 
 import tauk
+from tauk.attachments import compress_attachment, get_body_size, get_max_attachment_size
 from tauk.context.test_data import TestData
 from tauk.enums import AttachmentTypes
-from tauk.exceptions import TaukException
+from tauk.deadline import clamp_timeout
+from tauk.exceptions import TaukException, TaukCircuitOpenException
+from tauk.file_upload import is_file_body, send_file
+from tauk.retry import RetryPolicy, RetryBudget, CircuitBreaker, RetryingApi
 from tauk.utils import shortened_json, log_delay
 
 logger = logging.getLogger('tauk')
@@ -21,26 +29,125 @@ POST = 'POST'
 GET = 'GET'
 
 
-class TaukApi:
+def initialize_run_body(test_data: TestData, multi_process_run, run_id: str = None):
+    body = {
+        'language': test_data.language,
+        'tauk_client_version': test_data.tauk_client_version,
+        'start_timestamp': int(datetime.now(tz=timezone.utc).timestamp() * 1000),
+        'timezone': test_data.timezone,
+        'dst': test_data.dst,
+        'multi_process_run': multi_process_run,
+        'host_os_name': platform.system(),
+        'host_os_version': platform.platform(terse=True)
+    }
+
+    if run_id:
+        body['run_id'] = run_id
+    return body
+
+
+def warn_if_outdated(initialize_response):
+    latest_client_versions = initialize_response.get('latest_tauk_client_version', tauk.__version__)
+    if tauk.__version__ != 'develop' and re.search(r'\s*([\d.]+)', latest_client_versions)\
+            and latest_client_versions != tauk.__version__:
+        logger.warning(f'You are currently using Tauk [{tauk.__version__}]. '
+                       f'Consider updating to latest version [{latest_client_versions}] using '
+                       f'"pip install -U tauk"')
+
+
+class TaukApi(RetryingApi):
     run_id: str = None
 
-    def __init__(self, api_token, project_id, multi_process_run=False):
+    def __init__(self, api_token, project_id, multi_process_run=False, retry_policy: RetryPolicy = None,
+                 retry_budget: RetryBudget = None, circuit_breaker: CircuitBreaker = None, api_url=None):
         self._TAUK_API_URL = 'https://www.tauk.com/api/v1'
-        self._API_URL = os.environ.get('TAUK_API_URL', self._TAUK_API_URL)
+        self._API_URL = api_url if api_url else os.environ.get('TAUK_API_URL', self._TAUK_API_URL)
         self._api_token = api_token
         self._project_id = project_id
         self._multi_process_run = multi_process_run
+        super().__init__(retry_policy, retry_budget, circuit_breaker)
+        # Compressed size limits of attachments by their type, see TaukConfig.set_attachment_size_limit
+        self.attachment_size_limits: dict = {}
+        self._session: requests.Session | None = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                # Retries are done by request() so that they are status aware and share the run-wide budget
+                session = requests.Session()
+                # Threads wait for a pooled connection rather than opening and discarding extra ones
+                session.mount(self._API_URL, HTTPAdapter(pool_connections=4, pool_maxsize=16, pool_block=True,
+                                                         max_retries=0))
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
     def request(self, method, url, headers=None, data=None, timeout=request_timeout, **kwargs):
-        tauk_adapter = HTTPAdapter(max_retries=3)
         if not headers:
             headers = {}
         headers.update({'Authorization': f'Bearer {self._api_token}'})
-        with requests.Session() as session:
-            session.mount(self._TAUK_API_URL, tauk_adapter)
-
-            response = session.request(method, url, timeout=timeout, data=data, headers=headers, **kwargs)
-            return response
+        started = self._start_request()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check_circuit(method, url)
+
+            attempt_timeout = clamp_timeout(timeout)
+            try:
+                # Proxies are only supported by the session
+                if is_file_body(data) and not requests.utils.get_environ_proxies(url):
+                    # Verified like the session would, Ex: with a custom CA bundle
+                    verify = self._get_session().merge_environment_settings(url, {}, None, kwargs.get('verify'),
+                                                                            None)['verify']
+                    response = self._send_file(method, url, headers, data, attempt_timeout, verify)
+                else:
+                    if is_file_body(data):
+                        data.seek(0)
+                    response = self._get_session().request(method, url, timeout=attempt_timeout, data=data,
+                                                           headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                cut_short = isinstance(ex, requests.Timeout) and attempt_timeout != timeout
+                delay = self._retry_delay_after_error(attempt, started, cut_short)
+                if delay is None:
+                    raise
+                logger.warning(f'Request {method} {url} failed [{ex.__class__.__name__}], retrying in {delay:.2f}s')
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+
+            delay = self._retry_delay_after_response(attempt, started, response.status_code,
+                                                     response.headers.get('Retry-After'))
+            if delay is None:
+                return response
+            logger.warning(f'Request {method} {url} failed [{response.status_code}], retrying in {delay:.2f}s')
+            response.close()
+            time.sleep(delay)
+
+    @staticmethod
+    def _send_file(method, url, headers, file, timeout, verify):
+        try:
+            upload_response = send_file(method, url, headers, file, timeout, verify)
+        except TimeoutError as ex:
+            raise requests.Timeout(ex)
+        except (OSError, http.client.HTTPException) as ex:
+            raise requests.ConnectionError(ex)
+
+        response = requests.Response()
+        response.status_code = upload_response.status
+        response.reason = upload_response.reason
+        response.headers = CaseInsensitiveDict(upload_response.headers.items())
+        response._content = upload_response.body
+        response._content_consumed = True
+        response.url = url
+        return response
 
     def set_token(self, api_token, project_id):
         self._api_token = api_token
@@ -52,23 +159,14 @@ class TaukApi:
     def get_project_id(self):
         return self._project_id
 
+    @property
+    def api_url(self):
+        return self._API_URL
+
     @log_delay(action_name='Initialize Run', after=3)
     def initialize_run(self, test_data: TestData, run_id: str = None):
         url = f'{self._API_URL}/execution/{self._project_id}/initialize'
-        body = {
-            'language': test_data.language,
-            'tauk_client_version': test_data.tauk_client_version,
-            'start_timestamp': int(datetime.now(tz=timezone.utc).timestamp() * 1000),
-            'timezone': test_data.timezone,
-            'dst': test_data.dst,
-            'multi_process_run': self._multi_process_run,
-            'host_os_name': platform.system(),
-            'host_os_version': platform.platform(terse=True)
-        }
-
-        if run_id:
-            body['run_id'] = run_id
-
+        body = initialize_run_body(test_data, self._multi_process_run, run_id)
         logger.debug(f'Initializing run with: url[{url}], body[{body}]')
         response = self.request(POST, url, json=body)
         if not response.ok:
@@ -77,12 +175,7 @@ class TaukApi:
 
         logger.debug(f'Response: {response.text}')
         self.run_id = response.json()['run_id']
-        latest_client_versions = response.json().get('latest_tauk_client_version', tauk.__version__)
-        if tauk.__version__ != 'develop' and re.search(r'\s*([\d.]+)', latest_client_versions)\
-                and latest_client_versions != tauk.__version__:
-            logger.warning(f'You are currently using Tauk [{tauk.__version__}]. '
-                           f'Consider updating to latest version [{latest_client_versions}] using '
-                           f'"pip install -U tauk"')
+        warn_if_outdated(response.json())
         logger.info(f'Setting run ID for current execution as {self.run_id}')
         return self.run_id
 
@@ -128,15 +221,57 @@ class TaukApi:
 
         logger.debug(f'Uploading test: url[{url}], headers[{headers}], body[{shortened_json(test_data)}]')
 
-        data = bytes(test_data, 'utf-8')
-        response = self.request(POST, url, data=gzip.compress(data), headers=headers)
+        data = gzip.compress(bytes(test_data, 'utf-8'))
+        if self._spool_if_unavailable(data):
+            return {}
+        self.flush_spool()
+
+        try:
+            response = self.request(POST, url, data=data, headers=headers)
+        except (TaukCircuitOpenException, requests.ConnectionError, requests.Timeout):
+            if not self._spool_failed_upload(data):
+                raise
+            return {}
+
         if not response.ok:
             logger.error(f'Failed to upload test. Response[{response.status_code}]: {response.text}')
+            if self._spool_failed_upload(data, response.status_code):
+                return {}
             raise TaukException('failed to upload test results')
 
         logger.debug(f'Response: {response.text}')
         return response.json().get('result')
 
+    def flush_spool(self):
+        """Uploads the test results spooled for this run in the order they were written, stops at the first failure"""
+        if not self.spool or self.circuit_breaker.is_open:
+            return 0
+
+        url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/report/upload'
+        uploaded = 0
+        for name in self.spool.take(self.run_id):
+            # Claimed first since processes of a multiprocess run share the spool of the run
+            claimed_path = self.spool.claim(self.run_id, name)
+            if claimed_path is None:
+                continue
+
+            with open(claimed_path, 'rb') as file:
+                data = file.read()
+            try:
+                response = self.request(POST, url, data=data, headers={'Content-Encoding': 'gzip'})
+            except Exception as ex:
+                logger.debug('Failed to upload spooled test results', exc_info=ex)
+                response = None
+            if response is None or not response.ok:
+                self.spool.put_back(self.run_id, name)
+                break
+            os.remove(claimed_path)
+            uploaded += 1
+
+        if uploaded:
+            logger.info(f'Uploaded {uploaded} spooled test results')
+        return uploaded
+
     @log_delay(action_name='Upload Attachment', after=6)
     def upload_attachment(self, file_path, attachment_type: AttachmentTypes, test_id):
         if not test_id:
@@ -144,16 +279,22 @@ class TaukApi:
 
         url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/attachment/upload/{test_id}'
 
-        headers = {'Tauk-Attachment-Type': f'{attachment_type.value}'}
+        headers = {'Tauk-Attachment-Type': f'{attachment_type.value}', 'Content-Encoding': 'gzip'}
 
-        logger.debug(f'Uploading test attachment: url[{url}], headers[{headers}], file[{file_path}]')
-        with open(file_path, 'rb') as file:
-            response = self.request(POST, url, data=file, headers=headers)
-            if not response.ok:
-                logger.error(f'Failed to upload attachment. Response[{response.status_code}]: {response.text}')
-                raise TaukException('failed to upload attachment')
+        body = compress_attachment(file_path, attachment_type,
+                                   get_max_attachment_size(attachment_type, self.attachment_size_limits))
+        try:
+            logger.debug(f'Uploading test attachment: url[{url}], headers[{headers}], file[{file_path}],'
+                         f' compressed size[{get_body_size(body)}]')
+            response = self.request(POST, url, data=body, headers=headers)
+        finally:
+            if is_file_body(body):
+                body.close()
+        if not response.ok:
+            logger.error(f'Failed to upload attachment. Response[{response.status_code}]: {response.text}')
+            raise TaukException('failed to upload attachment')
 
-            logger.debug(f'Response: {response.text}')
+        logger.debug(f'Response: {response.text}')
 
     @log_delay(action_name='Finish Execution', after=6)
     def finish_execution(self, file_path=None):
@@ -1,17 +1,23 @@
 import logging
 import os
+import signal
 import time
 import requests
 import subprocess
 
 from pathlib import Path
 from tauk.assistant.config import AssistantConfig
+from tauk.assistant.lease import AssistantLease
+from tauk.deadline import clamp_timeout
 from tauk.enums import AttachmentTypes
 from tauk.exceptions import TaukException
-from tauk.utils import get_open_port
+from tauk.metrics import timed
+from tauk.utils import is_process_alive, reserve_open_port, release_port
 
 logger = logging.getLogger('tauk')
 
+REQUEST_TIMEOUT = (3, 10)  # (Connection timeout, Receive data timeout)
+
 
 class TaukAssistant:
 
@@ -21,9 +27,12 @@ class TaukAssistant:
         self._api_token = api_token
         self._execution_dir = execution_dir
         self._process: subprocess.Popen | None = None
-        self._assistant_port = 8285
+        self._assistant_pid: int | None = None
+        self._assistant_port: int | None = None
         self._version = ''
         self._connections = {}
+        self._lease = AssistantLease(execution_dir)
+        self._leased = False
 
     def _set_executable_path(self, config):
         if config.executable_path:
@@ -46,27 +55,114 @@ class TaukAssistant:
         except Exception as ex:
             raise TaukException('tauk-assistant executable not found') from ex
 
+    @property
+    def log_file(self):
+        return os.path.join(self._execution_dir, 'assistant.log')
+
     def is_running(self) -> bool:
-        return True if self._process and self._process.poll() is None else False
+        if self._process:
+            return self._process.poll() is None
+        return is_process_alive(self._assistant_pid)
 
     def kill(self):
-        self._process.kill()
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+        elif is_process_alive(self._assistant_pid):
+            os.kill(self._assistant_pid, signal.SIGTERM)
+
+    def start(self):
+        """Attach to the assistant already leased for this execution dir or launch a new one"""
+        with self._lease:
+            lease = self._lease.read()
+            holders = []
+            if lease and self._attach(lease.get('port'), lease.get('pid')):
+                holders = [pid for pid in lease.get('holders', []) if is_process_alive(pid)]
+                logger.info(f'[Assistant] Reusing assistant [{self._assistant_pid}] at port {self._assistant_port}'
+                            f' shared with processes {holders}')
+            else:
+                self.launch()
+
+            if os.getpid() not in holders:
+                holders.append(os.getpid())
+            self._lease.write(self._assistant_port, self._assistant_pid, holders)
+            self._leased = True
+
+    def stop(self):
+        """Release the lease on the assistant, the last lease holder shuts it down"""
+        if not self._leased:
+            return
+        self._leased = False
+
+        with self._lease:
+            lease = self._lease.read() or {}
+            # Without a lease there is nobody left to hand the assistant to, so the one we started is shut down
+            if lease and lease.get('pid') != self._assistant_pid:
+                # The assistant died and was replaced by another process, the lease belongs to the new one
+                logger.debug(f'[Assistant] Lease is held by assistant [{lease.get("pid")}], leaving it running')
+                return
+
+            holders = [pid for pid in lease.get('holders', []) if pid != os.getpid() and is_process_alive(pid)]
+            if holders:
+                logger.debug(f'[Assistant] Releasing lease, assistant is still used by processes {holders}')
+                self._lease.write(self._assistant_port, self._assistant_pid, holders)
+                return
+
+            logger.debug(f'[Assistant] Last lease released, shutting down assistant [{self._assistant_pid}]')
+            try:
+                if self.is_running():
+                    self.kill()
+            finally:
+                self._lease.delete()
+
+    def _attach(self, port, pid) -> bool:
+        if not port or not is_process_alive(pid):
+            return False
 
-    def launch(self):
+        try:
+            response = requests.get(f'http://localhost:{port}/version', timeout=3)
+            if response.status_code != 200:
+                return False
+            self._version = response.json()['version']
+        except Exception as ex:
+            logger.debug(f'[Assistant] Leased assistant at port {port} is not responding', exc_info=ex)
+            return False
+
+        self._assistant_port = port
+        self._assistant_pid = pid
+        return True
+
+    def launch(self, attempts=3):
         if self.is_running():
             raise TaukException(f'an instance of tauk assistant is already running at {self._assistant_port}')
 
-        port_range = range(self._assistant_port, self._assistant_port + self.config.max_instances)
-        self._assistant_port = get_open_port(port_range)
-        if not self._assistant_port:
-            raise TaukException('No free ports available in the range {range}')
+        port_range = range(8285, 8285 + self.config.max_instances)
+        for attempt in range(1, attempts + 1):
+            # Port stays reserved across processes until the assistant had the chance to bind to it
+            self._assistant_port = reserve_open_port(port_range)
+            if not self._assistant_port:
+                raise TaukException(f'No free ports available in the range {port_range}')
 
+            try:
+                self._launch_process()
+                return
+            except TaukException as ex:
+                if attempt == attempts:
+                    raise
+                logger.warning(f'[Assistant] Retrying launch [{attempt}/{attempts}] after failure: {ex}')
+            finally:
+                release_port(self._assistant_port)
+
+    def _launch_process(self):
         cmd = [self._executable_path,
                '-apiToken', self._api_token,
                '-executionDir', self._execution_dir,
                '-port', str(self._assistant_port)]
         logger.debug(f'[Assistant] Launching Tauk assistant app {" ".join(cmd)}')
-        self._process = subprocess.Popen(' '.join(cmd), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Output goes to a file instead of a pipe because the assistant can outlive the process launching it
+        with open(self.log_file, 'ab') as log_file:
+            self._process = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+        self._assistant_pid = self._process.pid
 
         # Wait for assistant to launch
         t1 = time.time()
@@ -78,9 +174,9 @@ class TaukAssistant:
                     return
             except Exception:
                 try:
-                    out, err = self._process.communicate(timeout=1)
-                    logger.error('[Assistant] STDOUT: %s', out)
-                    logger.error('[Assistant] STDERR: %s', err)
+                    self._process.wait(timeout=1)
+                    with open(self.log_file, 'r', errors='replace') as log_file:
+                        logger.error('[Assistant] OUTPUT: %s', log_file.read())
                     raise TaukException(f'failed to launch tauk assistant')
                 except subprocess.TimeoutExpired:
                     pass
@@ -88,28 +184,31 @@ class TaukAssistant:
         self.kill()
         raise TaukException('timed out trying to launch assistant app')
 
+    @timed(action_name='Assistant Register Browser')
     def register_browser(self, debugger_address):
         logger.debug(f'[Assistant] Registering browser {debugger_address}')
         url = f'http://localhost:{self._assistant_port}/cdp/browser/new/{debugger_address}'
-        response = requests.post(url)
+        response = requests.post(url, timeout=clamp_timeout(REQUEST_TIMEOUT))
         if response.status_code != 200:
             logger.error(f'[Assistant] Failed to register browser. Response: {response.text}')
             raise TaukException(f'failed to register browser {debugger_address}')
         self._connections[debugger_address] = None
 
+    @timed(action_name='Assistant Unregister Browser')
     def unregister_browser(self, debugger_address):
         logger.debug(f'[Assistant] Unregistering browser {debugger_address}')
         url = f'http://localhost:{self._assistant_port}/cdp/browser/new/{debugger_address}'
-        response = requests.delete(url)
+        response = requests.delete(url, timeout=clamp_timeout(REQUEST_TIMEOUT))
         if response.status_code != 200:
             logger.error(f'[Assistant] Failed to unregister browser. Response: {response.text}')
             raise TaukException(f'failed to unregister browser {debugger_address}')
 
+    @timed(action_name='Assistant Connect Page')
     def connect_page(self, debugger_address) -> str:
         logger.debug(f'[Assistant] Connecting to first page on {debugger_address}')
         url = f'http://localhost:{self._assistant_port}/cdp/browser/page/{debugger_address}/connect'
 
-        response = requests.post(url, json=self.config.cdp_config)
+        response = requests.post(url, json=self.config.cdp_config, timeout=clamp_timeout(REQUEST_TIMEOUT))
         if response.status_code != 200:
             logger.error(
                 f'[Assistant] Failed to connect to the page for {debugger_address}. Response: {response.text}')
@@ -119,12 +218,13 @@ class TaukAssistant:
         self._connections[debugger_address] = page_id
         return page_id
 
+    @timed(action_name='Assistant Close Page')
     def close_page(self, debugger_address):
         logger.debug(f'[Assistant] Closing page connection on {debugger_address}')
         # Set page to None because sometimes browser cane exit before calling close_page
         self._connections[debugger_address] = None
         url = f'http://localhost:{self._assistant_port}/cdp/browser/targets/{debugger_address}/close'
-        response = requests.post(url)
+        response = requests.post(url, timeout=clamp_timeout(REQUEST_TIMEOUT))
         if response.status_code != 200:
             logger.error(
                 f'[Assistant] Failed to close page connection for {debugger_address}. Response: {response.text}')
@@ -136,8 +236,12 @@ class TaukAssistant:
     def get_connected_page(self, debugger_address) -> str:
         return self._connections.get(debugger_address, None)
 
+    def get_attachments_dir(self, connected_page_id):
+        return os.path.join(self._execution_dir, 'assistant', connected_page_id)
+
+    @timed(action_name='Assistant Get Attachments')
     def get_attachments(self, connected_page_id):
-        attachment_path = os.path.join(self._execution_dir, 'assistant', connected_page_id)
+        attachment_path = self.get_attachments_dir(connected_page_id)
         assistant_attachments = next(os.walk(attachment_path), (None, None, []))[2]  # only files
         attachments = []
         for attachment in assistant_attachments:
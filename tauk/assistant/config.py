@@ -27,6 +27,7 @@ class AssistantConfig:
         }
 
         self._max_instances = 10
+        self._stream_attachments = False
 
     @property
     def executable_path(self):
@@ -78,5 +79,14 @@ class AssistantConfig:
             raise TaukException('max instance must be an integer value between 1 and 15')
         self._max_instances = no
 
+    @property
+    def stream_attachments(self):
+        return self._stream_attachments
+
+    @stream_attachments.setter
+    def stream_attachments(self, stream: bool):
+        # Upload CDP log files as soon as the assistant completes them instead of waiting for the test to end
+        self._stream_attachments = stream
+
     def __str__(self):
         return f'AssistantConfig: {self.cdp_config}'
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import tarfile
+
+import requests
+
+from tauk.exceptions import TaukException
+
+logger = logging.getLogger('tauk')
+
+ASSISTANT_BINARY_API_URL = 'https://www.tauk.com/api/v1/assistant/binary'
+CHUNK_SIZE = 1 << 20
+_MD5_ETAG = re.compile(r'^"?([0-9a-f]{32})"?$')
+
+
+def get_os_name():
+    return platform.system().lower()
+
+
+def get_architecture_name():
+    machine = platform.machine().lower()
+    return 'amd64' if machine == 'x86_64' else machine
+
+
+def file_digest(path, algorithm='sha256'):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AssistantInstaller:
+    """Downloads tauk-assistant into a cache keyed by version, OS and architecture and installs it from there"""
+
+    def __init__(self, api_token, version, binaries_home, api_url=None, os_name=None, arch=None) -> None:
+        self._api_token = api_token
+        self._version = version
+        self._binaries_home = binaries_home
+        self._api_url = api_url if api_url else ASSISTANT_BINARY_API_URL
+        self._os_name = os_name if os_name else get_os_name()
+        self._arch = arch if arch else get_architecture_name()
+
+    @property
+    def cache_dir(self):
+        return os.path.join(self._binaries_home, 'cache', self._version, f'{self._os_name}-{self._arch}')
+
+    @property
+    def cached_binary_path(self):
+        return os.path.join(self.cache_dir, 'tauk-assistant')
+
+    @property
+    def install_path(self):
+        return os.path.join(self._binaries_home, 'tauk-assistant')
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.cache_dir, 'manifest.json')
+
+    @property
+    def _archive_path(self):
+        return os.path.join(self.cache_dir, 'tauk-assistant.tgz.part')
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _is_cached(self, manifest) -> bool:
+        return manifest is not None and os.path.isfile(self.cached_binary_path) and \
+            file_digest(self.cached_binary_path) == manifest.get('sha256')
+
+    def is_installed(self) -> bool:
+        manifest = self._read_manifest()
+        return manifest is not None and os.path.isfile(self.install_path) and \
+            file_digest(self.install_path) == manifest.get('sha256')
+
+    def install(self, progress=None) -> str:
+        if self.is_installed():
+            logger.info(f'tauk-assistant {self._version} is already installed at {self.install_path}')
+            return self.install_path
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if not self._is_cached(self._read_manifest()):
+            download_url, checksums = self._get_download_details()
+            self._download(download_url, checksums, progress)
+            self._extract()
+
+        self._install_from_cache()
+        return self.install_path
+
+    def _get_download_details(self):
+        url = f'{self._api_url}?version={self._version}&os={self._os_name}&arch={self._arch}'
+        logger.debug(f'Requesting tauk-assistant download details from {url}')
+        response = requests.get(url, headers={'Authorization': f'Bearer {self._api_token}'}, timeout=(15, 30))
+        if not response.ok:
+            logger.debug(f'[{response.status_code}] {response.text}')
+            raise TaukException('failed to get tauk-assistant download url, verify if the API token is correct')
+
+        details = response.json()
+        checksums = {algorithm: details[algorithm] for algorithm in ['sha256', 'md5'] if details.get(algorithm)}
+        return details['url'], checksums
+
+    def _download(self, url, checksums, progress=None):
+        downloaded = os.path.getsize(self._archive_path) if os.path.exists(self._archive_path) else 0
+        headers = {'Range': f'bytes={downloaded}-'} if downloaded else {}
+
+        logger.debug(f'Downloading tauk-assistant from {url}, resuming from byte {downloaded}')
+        with requests.get(url, headers=headers, allow_redirects=True, timeout=(15, 180), stream=True) as response:
+            if response.status_code == 416:
+                # Partial file is already complete
+                logger.debug('Download was already complete')
+            elif response.status_code == 206:
+                self._write_response(response, 'ab', downloaded, progress)
+            elif response.ok:
+                self._write_response(response, 'wb', 0, progress)
+            else:
+                raise TaukException(f'failed to download tauk-assistant [{response.status_code}]')
+
+            # A plain md5 ETag is only present for objects which were not uploaded in multiple parts
+            etag = _MD5_ETAG.match(response.headers.get('ETag', ''))
+            if etag and 'md5' not in checksums:
+                checksums['md5'] = etag.group(1)
+
+        self._verify(checksums)
+
+    def _write_response(self, response, mode, offset, progress=None):
+        total_size = offset + int(response.headers.get('content-length', 0))
+        if progress:
+            progress.reset(total=total_size)
+            progress.update(offset)
+        with open(self._archive_path, mode) as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+                if progress:
+                    progress.update(len(chunk))
+
+    def _verify(self, checksums):
+        if not checksums:
+            logger.warning('No checksum available to verify the tauk-assistant download')
+            return
+
+        for algorithm, expected in checksums.items():
+            actual = file_digest(self._archive_path, algorithm)
+            if actual.lower() != expected.lower():
+                os.remove(self._archive_path)
+                raise TaukException(f'tauk-assistant download is corrupted, {algorithm} [{actual}] does not'
+                                    f' match [{expected}]')
+        logger.debug(f'Verified tauk-assistant download using {list(checksums.keys())}')
+
+    def _extract(self):
+        binary_name = f'tauk-assistant-{self._os_name}-{self._arch}'
+        logger.debug(f'Extracting {binary_name} from {self._archive_path}')
+        try:
+            archive = tarfile.open(self._archive_path)
+        except tarfile.TarError as ex:
+            # Start from scratch on the next attempt instead of resuming a broken download
+            os.remove(self._archive_path)
+            raise TaukException('downloaded tauk-assistant archive is invalid') from ex
+
+        with archive:
+            # Only the binary is extracted, so member paths in the archive can never escape the cache dir
+            member = next((m for m in archive.getmembers() if m.isfile() and os.path.basename(m.name) == binary_name),
+                          None)
+            if member is None:
+                raise TaukException(f'{binary_name} not found in the downloaded archive')
+
+            tmp_path = f'{self.cached_binary_path}.tmp'
+            with archive.extractfile(member) as source, open(tmp_path, 'wb') as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+        os.chmod(tmp_path, 0o755)
+        os.replace(tmp_path, self.cached_binary_path)
+        os.remove(self._archive_path)
+
+        manifest = {'version': self._version, 'os': self._os_name, 'arch': self._arch,
+                    'sha256': file_digest(self.cached_binary_path)}
+        with open(self._manifest_path, 'w') as file:
+            json.dump(manifest, file)
+
+    def _install_from_cache(self):
+        tmp_path = f'{self.install_path}.tmp'
+        shutil.copy2(self.cached_binary_path, tmp_path)
+        os.replace(tmp_path, self.install_path)
+
+        if self._os_name == 'darwin':
+            exit_code = os.system(f'xattr -r -d com.apple.quarantine {self.install_path}')
+            if exit_code != 0:
+                logger.warning('Failed to remove quarantine flag')
+        logger.info(f'Installed tauk-assistant {self._version} at {self.install_path}')
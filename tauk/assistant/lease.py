@@ -0,0 +1,53 @@
+import json
+import logging
+import os
+
+from filelock import FileLock
+
+logger = logging.getLogger('tauk')
+
+
+class AssistantLease:
+    """Refcounted lease on the assistant instance shared by all the processes of an execution"""
+
+    def __init__(self, execution_dir: str) -> None:
+        self._lease_file = os.path.join(execution_dir, 'assistant.lease')
+        self._lock = FileLock(f'{self._lease_file}.lock', timeout=30)
+
+    @property
+    def lease_file(self):
+        return self._lease_file
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._lock.release()
+
+    def exists(self) -> bool:
+        return os.path.exists(self._lease_file)
+
+    def read(self) -> dict | None:
+        if not self.exists():
+            return None
+
+        try:
+            with open(self._lease_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as ex:
+            logger.warning(f'[Assistant] Ignoring invalid lease file {self._lease_file}', exc_info=ex)
+            return None
+
+    def write(self, port: int, pid: int, holders: list):
+        lease = {'port': port, 'pid': pid, 'holders': holders}
+        tmp_file = f'{self._lease_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(lease, file)
+        os.replace(tmp_file, self._lease_file)
+        logger.debug(f'[Assistant] Updated lease {lease}')
+
+    def delete(self):
+        # Lock file is left behind on purpose, other processes might be waiting on it
+        if self.exists():
+            os.remove(self._lease_file)
@@ -0,0 +1,146 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger('tauk')
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class _Inotify:
+    """Minimal inotify binding over libc, only reports files which were closed after writing or moved in"""
+
+    def __init__(self, path: str) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f'inotify_add_watch failed for {path}')
+
+    def read(self, timeout: float) -> list:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self._fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class AttachmentWatcher:
+    """Reports files in a directory as soon as the writer is done with them.
+
+    Uses inotify on linux and falls back to polling elsewhere, where a file is considered
+    complete once its size and modification time did not change for `settle_time` seconds.
+    """
+
+    def __init__(self, path: str, on_complete, poll_interval=0.5, settle_time=2.0, use_inotify=True) -> None:
+        self._path = path
+        self._on_complete = on_complete
+        self._poll_interval = poll_interval
+        self._settle_time = settle_time
+        self._use_inotify = use_inotify and sys.platform.startswith('linux')
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._file_states = {}
+        # Files handed to on_complete which it didn't return for yet
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    def start(self):
+        os.makedirs(self._path, exist_ok=True)
+        inotify = None
+        if self._use_inotify:
+            try:
+                inotify = _Inotify(self._path)
+            except Exception as ex:
+                logger.debug(f'[Assistant] inotify is unavailable, polling {self._path} instead', exc_info=ex)
+
+        target = self._watch_inotify if inotify else self._watch_polling
+        self._thread = threading.Thread(target=target, args=(inotify,) if inotify else (),
+                                        name='TaukAttachmentWatcher', daemon=True)
+        self._thread.start()
+        logger.debug(f'[Assistant] Watching {self._path} for attachments using {"inotify" if inotify else "polling"}')
+
+    def stop(self, timeout=5) -> set:
+        """Returns the files on_complete is still processing when the watcher didn't stop in time, no other file is
+        reported once stopped"""
+        with self._in_flight_lock:
+            self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f'[Assistant] Timed out waiting for the attachments of {self._path} to be processed')
+            self._thread = None
+        with self._in_flight_lock:
+            return set(self._in_flight)
+
+    def _notify(self, file_path):
+        with self._in_flight_lock:
+            if self._stop_event.is_set():
+                return
+            self._in_flight.add(file_path)
+        try:
+            self._on_complete(file_path)
+        except Exception as ex:
+            logger.error(f'[Assistant] Failed to process attachment {file_path}', exc_info=ex)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.discard(file_path)
+
+    def _watch_inotify(self, inotify: _Inotify):
+        try:
+            while not self._stop_event.is_set():
+                for name in inotify.read(self._poll_interval):
+                    file_path = os.path.join(self._path, name)
+                    if os.path.isfile(file_path):
+                        self._notify(file_path)
+        finally:
+            inotify.close()
+
+    def _watch_polling(self):
+        while not self._stop_event.wait(self._poll_interval):
+            now = time.monotonic()
+            try:
+                entries = list(os.scandir(self._path))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                state = (stat.st_size, stat.st_mtime_ns)
+                previous = self._file_states.get(entry.path)
+                if previous is None or previous[0] != state:
+                    self._file_states[entry.path] = (state, now, False)
+                elif not previous[2] and now - previous[1] >= self._settle_time:
+                    self._file_states[entry.path] = (state, previous[1], True)
+                    self._notify(entry.path)
@@ -0,0 +1,310 @@
+import asyncio
+import gzip
+import http.client
+import json
+import logging
+import os
+from contextlib import suppress
+from datetime import datetime, timezone
+
+from tauk.api import initialize_run_body, warn_if_outdated
+from tauk.attachments import compress_attachment, get_body_size, get_max_attachment_size
+from tauk.context.test_data import TestData
+from tauk.enums import AttachmentTypes
+from tauk.deadline import clamp_timeout
+from tauk.exceptions import TaukException, TaukCircuitOpenException
+from tauk.file_upload import is_file_body, send_file
+from tauk.retry import RetryPolicy, RetryBudget, CircuitBreaker, RetryingApi
+from tauk.utils import shortened_json, log_delay, log_skipped_attachments
+
+logger = logging.getLogger('tauk')
+
+request_timeout = (15, 30)  # (Connection timeout, Receive data timeout)
+POST = 'POST'
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+        return aiohttp
+    except ImportError as ex:
+        raise TaukException('AsyncTaukApi requires aiohttp, install it with "pip install tauk[async]"') from ex
+
+
+class AsyncTaukApi(RetryingApi):
+    """asyncio counterpart of TaukApi, requests of a run share a pooled aiohttp session"""
+    run_id: str = None
+
+    def __init__(self, api_token, project_id, multi_process_run=False, max_connections=10,
+                 max_concurrent_uploads=4, retry_policy: RetryPolicy = None, retry_budget: RetryBudget = None,
+                 circuit_breaker: CircuitBreaker = None, api_url=None):
+        self._aiohttp = _import_aiohttp()
+        self._API_URL = api_url if api_url else os.environ.get('TAUK_API_URL', 'https://www.tauk.com/api/v1')
+        self._api_token = api_token
+        self._project_id = project_id
+        self._multi_process_run = multi_process_run
+        self._max_connections = max_connections
+        self._max_concurrent_uploads = max_concurrent_uploads
+        super().__init__(retry_policy, retry_budget, circuit_breaker)
+        self.attachment_size_limits: dict = {}
+        self._session = None
+        self._session_loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _get_session(self):
+        # A session is bound to the event loop it was created in, test frameworks may use a loop per test
+        loop = asyncio.get_running_loop()
+        if self._session is not None and self._session_loop is not loop:
+            self._discard_session()
+        if self._session is None or self._session.closed:
+            connector = self._aiohttp.TCPConnector(limit=self._max_connections)
+            self._session = self._aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    def _discard_session(self):
+        """Drops a session whose event loop is gone, it can't be awaited anymore so only its sockets are closed"""
+        session, self._session, self._session_loop = self._session, None, None
+        if session is None or session.closed:
+            return
+        connector = session.connector
+        session.detach()
+        # close() schedules the cleanup on the connector's loop, only release the sockets synchronously
+        with suppress(Exception):
+            connector._close()
+
+    def close_sync(self):
+        """Closes the session from outside an event loop, Ex: when Tauk is destroyed at exit"""
+        loop = self._session_loop
+        if self._session is not None and loop is not None and not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(self.close())
+        else:
+            self._discard_session()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    async def request(self, method, url, headers=None, data=None, timeout=request_timeout, **kwargs):
+        """Sends the request and returns a tuple of status code and response body"""
+        if not headers:
+            headers = {}
+        headers.update({'Authorization': f'Bearer {self._api_token}'})
+        started = self._start_request()
+        attempt = 0
+        while True:
+            attempt += 1
+            self._check_circuit(method, url)
+
+            connect_timeout, read_timeout = clamp_timeout(timeout)
+            client_timeout = self._aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+            try:
+                if is_file_body(data):
+                    status, text, retry_after = await self._send_file(method, url, headers, data,
+                                                                      (connect_timeout, read_timeout))
+                else:
+                    async with self._get_session().request(method, url, headers=headers, data=data,
+                                                           timeout=client_timeout, **kwargs) as response:
+                        status, text = response.status, await response.text()
+                        retry_after = response.headers.get('Retry-After')
+            except (self._aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                cut_short = isinstance(ex, asyncio.TimeoutError) and (connect_timeout, read_timeout) != timeout
+                delay = self._retry_delay_after_error(attempt, started, cut_short)
+                if delay is None:
+                    raise
+                logger.warning(f'Request {method} {url} failed [{ex.__class__.__name__}], retrying in {delay:.2f}s')
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+
+            delay = self._retry_delay_after_response(attempt, started, status, retry_after)
+            if delay is None:
+                return status, text
+            logger.warning(f'Request {method} {url} failed [{status}], retrying in {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+    async def _send_file(self, method, url, headers, file, timeout):
+        try:
+            # sendfile blocks the calling thread until the whole file is sent
+            response = await asyncio.to_thread(send_file, method, url, headers, file, timeout)
+        except TimeoutError as ex:
+            raise asyncio.TimeoutError() from ex
+        except (OSError, http.client.HTTPException) as ex:
+            raise self._aiohttp.ClientConnectionError(str(ex)) from ex
+        return response.status, response.body.decode('utf-8', errors='replace'), response.headers.get('Retry-After')
+
+    @staticmethod
+    def _is_ok(status):
+        return status < 400
+
+    @staticmethod
+    def _to_json(text):
+        return json.loads(text) if text else {}
+
+    def set_token(self, api_token, project_id):
+        self._api_token = api_token
+        self._project_id = project_id
+
+    def get_api_token(self):
+        return self._api_token
+
+    def get_project_id(self):
+        return self._project_id
+
+    @log_delay(action_name='Initialize Run', after=3)
+    async def initialize_run(self, test_data: TestData, run_id: str = None):
+        url = f'{self._API_URL}/execution/{self._project_id}/initialize'
+        body = initialize_run_body(test_data, self._multi_process_run, run_id)
+        logger.debug(f'Initializing run with: url[{url}], body[{body}]')
+        status, text = await self.request(POST, url, json=body)
+        if not self._is_ok(status):
+            logger.error(f'Failed to initialize Tauk execution. Response[{status}]: {text}')
+            raise TaukException('failed to initialize tauk execution')
+
+        logger.debug(f'Response: {text}')
+        response = self._to_json(text)
+        self.run_id = response['run_id']
+        warn_if_outdated(response)
+        logger.info(f'Setting run ID for current execution as {self.run_id}')
+        return self.run_id
+
+    @log_delay(action_name='Test Start', after=3)
+    async def test_start(self, test_name, file_name, start_time):
+        url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/report/test/start'
+        body = {
+            'test_name': test_name,
+            'file_name': file_name,
+            'start_time': start_time,
+        }
+
+        status, text = await self.request(POST, url, json=body)
+        logger.info(f'Response: {text}')
+        if not self._is_ok(status):
+            logger.error(f'Failed to register test start. Response[{status}]: {text}')
+            raise TaukException('failed to register test start')
+
+        return self._to_json(text).get('external_test_id')
+
+    @log_delay(action_name='Test Finish', after=3)
+    async def test_finish(self, test_name, file_name, start_time, end_time):
+        url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/report/test/finish'
+        body = {
+            'test_name': test_name,
+            'file_name': file_name,
+            'start_time': start_time,
+            'end_time': end_time,
+        }
+
+        status, text = await self.request(POST, url, json=body)
+        logger.info(f'Response: {text}')
+        if not self._is_ok(status):
+            logger.error(f'Failed to register test finish. Response[{status}]: {text}')
+            raise TaukException('failed to register test finish')
+
+        return self._to_json(text).get('external_test_id')
+
+    @log_delay(action_name='Upload Test Results', after=6)
+    async def upload(self, test_data):
+        url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/report/upload'
+        headers = {'Content-Encoding': 'gzip'}
+
+        logger.debug(f'Uploading test: url[{url}], headers[{headers}], body[{shortened_json(test_data)}]')
+
+        data = gzip.compress(bytes(test_data, 'utf-8'))
+        if self._spool_if_unavailable(data):
+            return {}
+
+        try:
+            status, text = await self.request(POST, url, data=data, headers=headers)
+        except (TaukCircuitOpenException, self._aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if not self._spool_failed_upload(data):
+                raise
+            return {}
+
+        if not self._is_ok(status):
+            logger.error(f'Failed to upload test. Response[{status}]: {text}')
+            if self._spool_failed_upload(data, status):
+                return {}
+            raise TaukException('failed to upload test results')
+
+        logger.debug(f'Response: {text}')
+        return self._to_json(text).get('result')
+
+    @log_delay(action_name='Upload Attachment', after=6)
+    async def upload_attachment(self, file_path, attachment_type: AttachmentTypes, test_id):
+        if not test_id:
+            raise TaukException(f'invalid test_id {test_id}')
+
+        url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/attachment/upload/{test_id}'
+
+        headers = {'Tauk-Attachment-Type': f'{attachment_type.value}', 'Content-Encoding': 'gzip'}
+
+        # Compression reads the whole file, keep it off the event loop
+        body = await asyncio.to_thread(compress_attachment, file_path, attachment_type,
+                                       get_max_attachment_size(attachment_type, self.attachment_size_limits))
+        try:
+            logger.debug(f'Uploading test attachment: url[{url}], headers[{headers}], file[{file_path}],'
+                         f' compressed size[{get_body_size(body)}]')
+            status, text = await self.request(POST, url, data=body, headers=headers)
+        finally:
+            if is_file_body(body):
+                body.close()
+        if not self._is_ok(status):
+            logger.error(f'Failed to upload attachment. Response[{status}]: {text}')
+            raise TaukException('failed to upload attachment')
+
+        logger.debug(f'Response: {text}')
+
+    async def upload_attachments(self, test_case):
+        """Uploads all the attachments of a test concurrently, failures are logged and don't stop other uploads"""
+        if len(test_case.attachments) == 0:
+            logger.debug('No attachments to upload')
+            return
+        elif not test_case.id:
+            log_skipped_attachments(test_case)
+            return
+
+        semaphore = asyncio.Semaphore(self._max_concurrent_uploads)
+
+        async def upload(file_path, attachment_type):
+            async with semaphore:
+                try:
+                    await self.upload_attachment(file_path, attachment_type, test_case.id)
+                    # Attachments written by Tauk are deleted after a successful upload
+                    if AttachmentTypes.is_generated_attachment(attachment_type) and os.path.exists(file_path):
+                        logger.debug(f'Deleting generated attachment {file_path}')
+                        os.remove(file_path)
+                except Exception as ex:
+                    logger.error(f'Failed to upload attachment {attachment_type}: {file_path}', exc_info=ex)
+
+        await asyncio.gather(*[upload(file_path, attachment_type)
+                               for file_path, attachment_type in test_case.attachments
+                               if file_path not in test_case.streamed_attachments])
+
+    @log_delay(action_name='Finish Execution', after=6)
+    async def finish_execution(self, file_path=None):
+        end_ts = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+        url = f'{self._API_URL}/execution/{self._project_id}/{self.run_id}/finish/{end_ts}'
+
+        if not file_path:
+            logger.debug(f'Sending execution finish: url[{url}]')
+            status, text = await self.request(POST, url)
+        else:
+            headers = {'Content-Encoding': 'gzip'}
+            logger.debug(f'Sending execution finish: url[{url}], headers[{headers}], file[{file_path}]')
+            with open(file_path, 'rb') as file:
+                body = gzip.compress(file.read())
+            status, text = await self.request(POST, url, data=body, headers=headers)
+
+        if not self._is_ok(status):
+            logger.error(f'Failed to upload execution error logs. Response[{status}]: {text}')
+            raise TaukException('failed to upload execution error logs')
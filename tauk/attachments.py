@@ -0,0 +1,152 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+
+from tauk.enums import AttachmentTypes
+from tauk.exceptions import TaukException
+
+logger = logging.getLogger('tauk')
+
+MAX_ATTACHMENT_SIZE = 1 << 20  # 1 MB, applies to the compressed size
+# Default limits of the attachment types which are expected to be larger
+MAX_ATTACHMENT_SIZES = {
+    AttachmentTypes.NETWORK_HAR: 50 << 20,
+    AttachmentTypes.SCREEN_RECORDING: 50 << 20,
+}
+# Compressed attachments above this size are staged in a temporary file, which is uploaded from with sendfile
+LARGE_ATTACHMENT_SIZE = 1 << 20
+_READ_CHUNK_SIZE = 1 << 16
+
+
+def get_max_attachment_size(attachment_type: AttachmentTypes, size_limits=None):
+    if size_limits and attachment_type in size_limits:
+        return size_limits[attachment_type]
+    return MAX_ATTACHMENT_SIZES.get(attachment_type, MAX_ATTACHMENT_SIZE)
+
+
+def compress_file(file_path, max_size=MAX_ATTACHMENT_SIZE, staging_size=LARGE_ATTACHMENT_SIZE):
+    """Gzip a file while reading it, returns None as soon as the output grows beyond `max_size`.
+
+    The output is returned as bytes, or as a temporary file opened at its start once it is over `staging_size`"""
+    # Large files are compressed for speed rather than size
+    compress_level = 1 if os.path.getsize(file_path) > staging_size * 4 else 6
+    staged = tempfile.SpooledTemporaryFile(max_size=staging_size)
+    try:
+        with open(file_path, 'rb') as file, \
+                gzip.GzipFile(fileobj=staged, mode='wb', compresslevel=compress_level) as gz:
+            while chunk := file.read(_READ_CHUNK_SIZE):
+                gz.write(chunk)
+                if staged.tell() > max_size:
+                    break
+        size = staged.tell()
+    except BaseException:
+        staged.close()
+        raise
+
+    if size > max_size:
+        staged.close()
+        return None
+    staged.seek(0)
+    if size > staging_size:
+        return staged
+    with staged:
+        return staged.read()
+
+
+def compress_attachment(file_path, attachment_type: AttachmentTypes, max_size=None):
+    """Gzip compressed attachment, as bytes or as a temporary file for large attachments"""
+    if max_size is None:
+        max_size = get_max_attachment_size(attachment_type)
+    compressed = compress_file(file_path, max_size)
+    if compressed is not None:
+        return compressed
+
+    if not AttachmentTypes.is_assistant_attachment(attachment_type):
+        raise TaukException(f'compressed attachment [{file_path}] cannot be greater than {max_size} bytes')
+
+    logger.warning(f'Attachment [{file_path}] exceeds {max_size} bytes after compression, trimming it')
+    with open(file_path, 'rb') as file:
+        return shrink_log(file.read(), max_size)
+
+
+def get_body_size(body):
+    if isinstance(body, bytes):
+        return len(body)
+    return os.fstat(body.fileno()).st_size
+
+
+def _parse_log_entries(data: bytes):
+    try:
+        entries = json.loads(data)
+        if isinstance(entries, list):
+            return entries, True
+    except ValueError:
+        pass
+    return data.decode('utf-8', errors='replace').splitlines(), False
+
+
+def _entry_key(entry):
+    if isinstance(entry, dict):
+        message = entry.get('message', entry.get('text'))
+        if message is not None:
+            return f'{entry.get("level", "")}:{message}'
+        return json.dumps(entry, sort_keys=True)
+    return entry
+
+
+def _dedup_entries(entries, structured):
+    """Keep the first occurrence of each message along with the number of times it was repeated"""
+    unique = {}
+    for entry in entries:
+        key = _entry_key(entry)
+        if key in unique:
+            unique[key][1] += 1
+        else:
+            unique[key] = [entry, 1]
+
+    output = []
+    for entry, count in unique.values():
+        if count > 1:
+            if structured and isinstance(entry, dict):
+                entry = {**entry, 'tauk_repeat_count': count}
+            elif not structured:
+                entry = f'{entry} [repeated {count} times]'
+        output.append(entry)
+    return output
+
+
+def _encode_entries(entries, structured) -> bytes:
+    if structured:
+        return json.dumps(entries).encode('utf-8')
+    return '\n'.join(entries).encode('utf-8')
+
+
+def shrink_log(data: bytes, max_size=MAX_ATTACHMENT_SIZE) -> bytes:
+    """Deduplicate and sample the head and tail of a log until it fits in `max_size` once compressed"""
+    entries, structured = _parse_log_entries(data)
+    entries = _dedup_entries(entries, structured)
+
+    keep = len(entries)
+    while True:
+        if keep >= len(entries):
+            sampled = entries
+        else:
+            head = (keep + 1) // 2
+            tail = keep - head
+            omitted = len(entries) - keep
+            marker = f'[tauk] {omitted} log entries were omitted to fit the attachment size limit'
+            sampled = entries[:head] + [{'message': marker} if structured else marker] + \
+                (entries[-tail:] if tail else [])
+
+        compressed = gzip.compress(_encode_entries(sampled, structured), compresslevel=6)
+        if len(compressed) <= max_size:
+            logger.debug(f'Trimmed log to {len(sampled)} of {len(entries)} entries [{len(compressed)} bytes]')
+            return compressed
+        if keep == 0:
+            raise TaukException(f'unable to trim log below {max_size} bytes')
+
+        # Scale by how far off we are, but always make progress
+        keep = min(keep - 1, int(keep * max_size / len(compressed) * 0.9))
+        keep = max(keep, 0)
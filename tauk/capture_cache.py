@@ -0,0 +1,140 @@
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+from tauk import metrics
+from tauk.context.current_test import get_current_test
+
+logger = logging.getLogger('tauk')
+
+# Commands which don't change what is on the screen, Ex: the captures themselves and the screen recorder
+READ_ONLY_COMMANDS = {'screenshot', 'getPageSource', 'getCurrentContext', 'getContexts', 'getLog',
+                      'getAvailableLogTypes', 'getSession', 'getStatus', 'getTimeouts', 'getCurrentUrl', 'getTitle'}
+MAX_SESSIONS = 16
+SESSION_ATTR = '_tauk_capture_session'
+
+
+class _SessionCaptures:
+    def __init__(self, session_id) -> None:
+        self.session_id = session_id
+        # Bumped by every command which may have changed the screen, captures of an older generation are stale
+        self.generation = 0
+        self.tracked = False
+        self.quit = False
+        self.capturing = 0
+        self.captures = {}
+        # The test case the driver was last registered by, used when no test using the driver is current at quit
+        self.test_case = None
+        self.lock = threading.RLock()
+
+
+def _quitting_test(driver, session):
+    current = get_current_test()
+    if current is not None and current.test_case.driver_instance is driver:
+        return current.test_case
+    return session.test_case() if session.test_case else None
+
+
+class CaptureCache:
+    """Captures of a driver session, shared by every test using the driver, so the screenshot and view hierarchy
+    captured when the driver is quit aren't captured again at the end of the test"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS) -> None:
+        self._max_sessions = max_sessions
+        # Only for drivers which don't take attributes, the others keep their session for as long as they live
+        self._sessions: OrderedDict[object, _SessionCaptures] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_session(self, driver) -> _SessionCaptures:
+        session_id = getattr(driver, 'session_id', None)
+        with self._lock:
+            session = getattr(driver, SESSION_ATTR, None)
+            if session is not None and session.session_id == session_id:
+                return session
+            session = _SessionCaptures(session_id)
+            try:
+                setattr(driver, SESSION_ATTR, session)
+                return session
+            except AttributeError:
+                pass
+
+            key = session_id or id(driver)
+            session = self._sessions.setdefault(key, session)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def track(self, driver):
+        """Wraps driver.execute, which every WebDriver command goes through, to follow the capture generation"""
+        session = self._get_session(driver)
+        execute = getattr(driver, 'execute', None)
+        if execute is None:
+            # Without it there is no telling whether the screen changed, so only captures taken at quit are reused
+            return session
+        if hasattr(execute, SESSION_ATTR):
+            # Never wrapped twice, a new session of the driver is only swapped into the existing wrapper
+            setattr(execute, SESSION_ATTR, session)
+            session.tracked = True
+            return session
+
+        def tracked_execute(driver_command, *args, **kwargs):
+            current = getattr(tracked_execute, SESSION_ATTR)
+            # Once quit, not even the quit command itself may discard the captures taken right before it
+            if driver_command not in READ_ONLY_COMMANDS and not current.capturing and not current.quit:
+                current.generation += 1
+                current.captures.clear()
+            return execute(driver_command, *args, **kwargs)
+
+        setattr(tracked_execute, SESSION_ATTR, session)
+        driver.execute = tracked_execute
+        session.tracked = True
+        return session
+
+    def register(self, driver, test_case, before_quit):
+        """Makes test_case the current test of the driver session. driver.quit is wrapped only once, the wrapper calls
+        before_quit(driver, test_case) with the test running when the driver is quit"""
+        session = self.track(driver)
+        session.test_case = weakref.ref(test_case)
+        quit = driver.quit
+        if hasattr(quit, SESSION_ATTR):
+            setattr(quit, SESSION_ATTR, session)
+            return
+
+        def tauk_quit(*args, **kwargs):
+            current = getattr(tauk_quit, SESSION_ATTR)
+            before_quit(driver, _quitting_test(driver, current))
+            # The captures taken so far are the last ones of the session
+            current.quit = True
+            return quit(*args, **kwargs)
+
+        logger.debug('Attaching tauk callback to driver.quit()')
+        setattr(tauk_quit, SESSION_ATTR, session)
+        driver.quit = tauk_quit
+
+    def capture(self, driver, artifact, func):
+        """Returns the artifact captured by func, or the one captured earlier if the screen can't have changed since"""
+        session = self._get_session(driver)
+        # Concurrent captures of the session wait for the first one instead of repeating it
+        with session.lock:
+            cached = session.captures.get(artifact)
+            if cached is not None and (session.quit or (session.tracked and cached[0] == session.generation)):
+                metrics.registry.increment('capture_cache.hits')
+                return cached[1]
+
+            generation = session.generation
+            session.capturing += 1
+            try:
+                value = func()
+            finally:
+                session.capturing -= 1
+            session.captures[artifact] = (generation, value)
+            return value
+
+    def mark_quit(self, driver):
+        """The captures taken so far are the last ones of the session"""
+        self._get_session(driver).quit = True
+
+
+capture_cache = CaptureCache()
@@ -0,0 +1,333 @@
+import base64
+import io
+import logging
+import os
+
+import jsonpickle
+
+from tauk import metrics
+from tauk.enums import ScreenshotModes, TestStatus
+from tauk.exceptions import TaukException
+from tauk.failure_dedup import FailureDeduplicator, fingerprint_error
+from tauk.screenshot_diff import ScreenshotDiffer
+from tauk.view_dedup import ViewDeduplicator
+
+logger = logging.getLogger('tauk')
+
+# Lines kept on each side of the failing line when the code context has to be trimmed
+TRIMMED_CODE_CONTEXT_LINES = 5
+# Tail of the traceback which is kept when it has to be trimmed, the innermost frames are the most useful ones
+TRIMMED_TRACEBACK_LENGTH = 4000
+
+_pillow_warned = False
+
+
+def _size(value):
+    if value is None:
+        return 0
+    return len(jsonpickle.encode(value, unpicklable=False))
+
+
+def make_thumbnail(screenshot, size):
+    """Downscale a base64 encoded screenshot, returns None if it could not be downscaled"""
+    global _pillow_warned
+    try:
+        from PIL import Image
+    except ImportError:
+        if not _pillow_warned:
+            logger.warning('Install Pillow (pip install tauk[thumbnails]) to capture thumbnail screenshots')
+            _pillow_warned = True
+        return None
+
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(screenshot)))
+        image.thumbnail(size)
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+    except Exception as ex:
+        logger.error('Failed to create screenshot thumbnail', exc_info=ex)
+        return None
+    return base64.b64encode(output.getvalue()).decode()
+
+
+class _ArtifactCandidates:
+    """Artifacts of a test which following tests may reference once it is uploaded"""
+
+    def __init__(self, first_artifacts=None, keyframe=None, view=False) -> None:
+        self.first_artifacts = first_artifacts
+        self.keyframe = keyframe
+        # Whether the view hierarchy of the test is uploaded in full
+        self.view = view
+
+
+class CaptureRule:
+    def __init__(self, view=True, screenshot=ScreenshotModes.FULL, log=True, recording=True) -> None:
+        self.view = view
+        self.screenshot = screenshot
+        self.log = log
+        # Whether the screen recording is uploaded, when recording is enabled in TaukConfig
+        self.recording = recording
+
+    def update(self, view=None, screenshot=None, log=None, recording=None):
+        if screenshot is not None and not isinstance(screenshot, ScreenshotModes):
+            raise TaukException(f'screenshot [{screenshot}] must be of type ScreenshotModes')
+        if view is not None:
+            self.view = view
+        if screenshot is not None:
+            self.screenshot = screenshot
+        if log is not None:
+            self.log = log
+        if recording is not None:
+            self.recording = recording
+
+    def __str__(self):
+        return f'view={self.view}, screenshot={self.screenshot.value}, log={self.log}, recording={self.recording}'
+
+
+class CapturePolicy:
+    """Decides which artifacts are captured and uploaded for a test depending on its status"""
+
+    def __init__(self) -> None:
+        self._rules = {
+            TestStatus.PASSED: CaptureRule(),
+            TestStatus.FAILED: CaptureRule(),
+        }
+        self._max_payload_size = None
+        self.thumbnail_size = (320, 320)
+        self._deduplicator: FailureDeduplicator | None = None
+        self._differ: ScreenshotDiffer | None = None
+        self._view_deduplicator: ViewDeduplicator | None = None
+
+    @staticmethod
+    def default():
+        return CapturePolicy()
+
+    @staticmethod
+    def lean():
+        """Full artifacts for failures, only a thumbnail for passing tests"""
+        policy = CapturePolicy()
+        policy.on_pass(view=False, screenshot=ScreenshotModes.THUMBNAIL, log=False, recording=False)
+        return policy
+
+    @staticmethod
+    def from_env():
+        policy = CapturePolicy.lean() if os.getenv('TAUK_CAPTURE_POLICY', '').lower() == 'lean' \
+            else CapturePolicy.default()
+        try:
+            max_payload_size = int(os.getenv('TAUK_MAX_PAYLOAD_SIZE', ''))
+            policy.max_payload_size = max_payload_size if max_payload_size > 0 else None
+        except ValueError:
+            pass
+        if os.getenv('TAUK_DEDUP_FAILURES', '').lower() == 'true':
+            try:
+                policy.dedup_failures(skip_view_after=int(os.getenv('TAUK_DEDUP_SKIP_VIEW_AFTER', '')))
+            except ValueError:
+                policy.dedup_failures()
+        if os.getenv('TAUK_DIFF_SCREENSHOTS', '').lower() == 'true':
+            policy.diff_screenshots()
+        if os.getenv('TAUK_DEDUP_VIEWS', '').lower() == 'true':
+            policy.dedup_views()
+        return policy
+
+    def on_pass(self, view: bool = None, screenshot: ScreenshotModes = None, log: bool = None, recording: bool = None):
+        self._rules[TestStatus.PASSED].update(view, screenshot, log, recording)
+        return self
+
+    def on_fail(self, view: bool = None, screenshot: ScreenshotModes = None, log: bool = None, recording: bool = None):
+        self._rules[TestStatus.FAILED].update(view, screenshot, log, recording)
+        return self
+
+    def get_rule(self, status: TestStatus) -> CaptureRule:
+        # Tests without a result yet are treated like failures, so nothing is lost
+        return self._rules.get(status, self._rules[TestStatus.FAILED])
+
+    @property
+    def max_payload_size(self):
+        """Upper bound in bytes on the serialized test case, artifacts are trimmed by priority to fit it"""
+        return self._max_payload_size
+
+    @max_payload_size.setter
+    def max_payload_size(self, size: int | None):
+        if size is not None and (not isinstance(size, int) or size <= 0):
+            raise TaukException('max payload size must be a positive integer')
+        self._max_payload_size = size
+
+    def dedup_failures(self, skip_view_after: int = None, window: float = 300.0):
+        """Identical failures reference the screenshot and view of their first occurrence instead of uploading them
+        again, and after `skip_view_after` of them within `window` seconds their view hierarchy isn't captured"""
+        if skip_view_after is not None and (not isinstance(skip_view_after, int) or skip_view_after < 1):
+            raise TaukException('skip_view_after must be a positive integer')
+        self._deduplicator = FailureDeduplicator(skip_view_after, window)
+        return self
+
+    @property
+    def is_deduplicating_failures(self):
+        return self._deduplicator is not None
+
+    def diff_screenshots(self, tile_size: int = 64, max_changed_ratio: float = 0.5):
+        """Tests sharing a driver session reference its last uploaded screenshot when theirs is identical, and only
+        upload the changed tiles when at most `max_changed_ratio` of them changed"""
+        if not isinstance(tile_size, int) or tile_size < 8:
+            raise TaukException('tile_size must be an integer of at least 8')
+        if not 0 < max_changed_ratio <= 1:
+            raise TaukException('max_changed_ratio must be between 0 and 1')
+        self._differ = ScreenshotDiffer(tile_size, max_changed_ratio)
+        return self
+
+    @property
+    def is_diffing_screenshots(self):
+        return self._differ is not None
+
+    def dedup_views(self, max_views: int = 256):
+        """A view hierarchy identical to one of the last `max_views` uploaded is referenced by its hash instead"""
+        if not isinstance(max_views, int) or max_views < 1:
+            raise TaukException('max_views must be a positive integer')
+        self._view_deduplicator = ViewDeduplicator(max_views)
+        return self
+
+    @property
+    def is_deduplicating_views(self):
+        return self._view_deduplicator is not None
+
+    def record_failure(self, test_case):
+        """Fingerprints the error of a failed test, returns whether its view hierarchy should be skipped"""
+        if self._deduplicator is None or test_case.error is None:
+            return False
+        test_case.fingerprint = fingerprint_error(test_case.error)
+        return self._deduplicator.record_failure(test_case.fingerprint)
+
+    def should_capture_view(self, status: TestStatus):
+        return self.get_rule(status).view
+
+    def should_keep_recording(self, status: TestStatus):
+        return self.get_rule(status).recording
+
+    def should_capture_screenshot(self, status: TestStatus):
+        return self.get_rule(status).screenshot is not ScreenshotModes.NONE
+
+    def apply(self, test_case):
+        """Drops or shrinks the artifacts of the test case which the policy doesn't want, returns the bytes saved"""
+        rule = self.get_rule(test_case.status)
+        saved = {}
+
+        def trim(field, func):
+            before = _size(getattr(test_case, field))
+            func()
+            delta = before - _size(getattr(test_case, field))
+            saved[field] = saved.get(field, 0) + delta
+            return delta
+
+        if not rule.view and test_case.view:
+            trim('view', lambda: setattr(test_case, 'view', None))
+        if not rule.log and test_case.log:
+            trim('log', lambda: setattr(test_case, 'log', None))
+        if test_case.screenshot:
+            if rule.screenshot is ScreenshotModes.NONE:
+                trim('screenshot', lambda: setattr(test_case, 'screenshot', None))
+            elif rule.screenshot is ScreenshotModes.THUMBNAIL:
+                trim('screenshot', lambda: self._thumbnail_screenshot(test_case))
+        first_artifacts = None
+        if self._deduplicator and test_case.status is TestStatus.FAILED and test_case.error:
+            if not test_case.fingerprint:
+                test_case.fingerprint = fingerprint_error(test_case.error)
+            first_artifacts = self._deduplicator.dedup_artifacts(test_case, trim)
+        keyframe = None
+        screenshot = None
+        if self._differ and test_case.screenshot and rule.screenshot is ScreenshotModes.FULL:
+            def diff():
+                nonlocal keyframe
+                keyframe = self._differ.diff(test_case)
+
+            screenshot = test_case.screenshot
+            trim('screenshot', diff)
+            saved['screenshot'] -= _size(test_case.screenshot_delta)
+        if self._view_deduplicator and test_case.view:
+            trim('view', lambda: self._view_deduplicator.dedup(test_case))
+
+        if self.max_payload_size:
+            self._enforce_max_payload(test_case, trim)
+        # Remembered once the upload returned the test id, artifacts dropped or shrunk to fit the max payload size and
+        # the ones of results which were never uploaded can't be referenced
+        if keyframe and test_case.screenshot is not screenshot:
+            keyframe = None
+        view = self._view_deduplicator is not None and bool(test_case.view)
+        test_case.artifact_candidates = _ArtifactCandidates(first_artifacts, keyframe, view) \
+            if first_artifacts or keyframe or view else None
+
+        total = sum(saved.values())
+        if total > 0:
+            logger.debug(f'Capture policy saved {total} bytes for the test {test_case.method_name} {saved}')
+            metrics.registry.increment('capture_policy.bytes_saved', total)
+            for field, value in saved.items():
+                if value > 0:
+                    metrics.registry.increment(f'capture_policy.bytes_saved.{field}', value)
+        return total
+
+    def remember_uploaded(self, test_case):
+        """Called once the upload of the test returned its id, following tests may then reference its artifacts"""
+        candidates, test_case.artifact_candidates = test_case.artifact_candidates, None
+        if candidates is None or not test_case.id:
+            return
+        if candidates.first_artifacts and self._deduplicator:
+            self._deduplicator.remember_artifacts(test_case, candidates.first_artifacts)
+        if candidates.keyframe and self._differ:
+            self._differ.remember(candidates.keyframe)
+        if candidates.view and self._view_deduplicator and test_case.view:
+            self._view_deduplicator.remember(test_case.view)
+
+    def _thumbnail_screenshot(self, test_case):
+        thumbnail = make_thumbnail(test_case.screenshot, self.thumbnail_size)
+        if thumbnail is not None and len(thumbnail) < len(test_case.screenshot):
+            test_case.screenshot = thumbnail
+
+    def _enforce_max_payload(self, test_case, trim):
+        payload_size = _size(test_case.to_json())
+        if payload_size <= self.max_payload_size:
+            return
+
+        # Least useful artifacts go first, the error message and type are never trimmed
+        steps = [
+            ('view', lambda: setattr(test_case, 'view', None)),
+            ('log', lambda: setattr(test_case, 'log', None)),
+            ('screenshot', lambda: self._thumbnail_screenshot(test_case)),
+            ('code_context', lambda: _narrow_code_context(test_case)),
+            ('screenshot', lambda: setattr(test_case, 'screenshot', None)),
+            ('screenshot_delta', lambda: _drop_screenshot_delta(test_case)),
+            ('code_context', lambda: setattr(test_case, 'code_context', None)),
+            ('error', lambda: _truncate_traceback(test_case)),
+        ]
+        for field, step in steps:
+            if getattr(test_case, field):
+                payload_size -= trim(field, step)
+            if payload_size <= self.max_payload_size:
+                return
+
+        logger.warning(f'Test {test_case.method_name} is still {payload_size} bytes after trimming, '
+                       f'which is above the max payload size of {self.max_payload_size}')
+
+    def __str__(self):
+        return f'CapturePolicy: Pass=[{self._rules[TestStatus.PASSED]}], Fail=[{self._rules[TestStatus.FAILED]}], ' \
+               f'MaxPayloadSize={self.max_payload_size}, DedupFailures={self.is_deduplicating_failures}, ' \
+               f'DiffScreenshots={self.is_diffing_screenshots}, DedupViews={self.is_deduplicating_views}'
+
+
+def _narrow_code_context(test_case):
+    error_line = test_case.error.line_number if test_case.error else 0
+    for index, line in enumerate(test_case.code_context):
+        if line['line_number'] == error_line:
+            test_case.code_context = test_case.code_context[max(index - TRIMMED_CODE_CONTEXT_LINES, 0):
+                                                            index + TRIMMED_CODE_CONTEXT_LINES + 1]
+            return
+
+
+def _drop_screenshot_delta(test_case):
+    # The delta is applied to the referenced keyframe, which on its own would show the screen of an earlier test
+    test_case.screenshot_delta = None
+    refs = {field: ref for field, ref in (test_case.artifact_refs or {}).items() if field != 'screenshot'}
+    test_case.artifact_refs = refs or None
+
+
+def _truncate_traceback(test_case):
+    traceback = getattr(test_case.error, 'traceback', None)
+    if traceback and len(traceback) > TRIMMED_TRACEBACK_LENGTH:
+        test_case.error.traceback = '...\n' + traceback[-TRIMMED_TRACEBACK_LENGTH:]
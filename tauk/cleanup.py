@@ -0,0 +1,185 @@
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tauk.utils import is_process_alive
+
+logger = logging.getLogger('tauk')
+
+LOGS = 'Logs'
+BINARIES = 'Binaries'
+EXECUTIONS = 'Executions'
+OTHERS = 'Others'
+CATEGORIES = [LOGS, BINARIES, EXECUTIONS, OTHERS]
+
+_PROJECT_DIR = re.compile(r'^[0-9a-f]{32}$')  # md5 of the project working directory
+_IGNORED = ['.DS_Store']
+
+
+class CategoryUsage:
+    def __init__(self) -> None:
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, size):
+        self.files += 1
+        self.bytes += size
+
+
+class ExecDir:
+    def __init__(self, path, pid) -> None:
+        self.path = path
+        self.pid = pid
+        self.bytes = 0
+        self.last_modified = 0.0
+        self.stale_reason = None
+
+
+class CleanupReport:
+    def __init__(self) -> None:
+        self.usage = {category: CategoryUsage() for category in CATEGORIES}
+        self.exec_dirs: list[ExecDir] = []
+        self.deleted: list[ExecDir] = []
+        self.failed: list[ExecDir] = []
+
+    @property
+    def stale_exec_dirs(self):
+        return [exec_dir for exec_dir in self.exec_dirs if exec_dir.stale_reason]
+
+    @property
+    def freed_bytes(self):
+        return sum(exec_dir.bytes for exec_dir in self.deleted)
+
+
+def _categorize(name):
+    if name == 'logs':
+        return LOGS
+    elif name == 'binaries':
+        return BINARIES
+    elif _PROJECT_DIR.match(name):
+        return EXECUTIONS
+    return OTHERS
+
+
+def _walk(path, on_file):
+    """Streams every file below `path` without materializing the tree, returns total size and latest mtime"""
+    total_size = 0
+    last_modified = 0.0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.name in _IGNORED:
+                        continue
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            last_modified = max(last_modified, stat.st_mtime)
+                            continue
+                    except OSError:
+                        # Files can vanish while the scan is running
+                        continue
+                    total_size += stat.st_size
+                    last_modified = max(last_modified, stat.st_mtime)
+                    on_file(entry.path, stat.st_size)
+        except OSError:
+            continue
+    return total_size, last_modified
+
+
+def _mark_stale(exec_dir: ExecDir, now, ttl, grace):
+    age = now - exec_dir.last_modified
+    if exec_dir.pid and exec_dir.pid == os.getpid():
+        return
+    if age > ttl:
+        exec_dir.stale_reason = f'older than {int(ttl)}s'
+    elif exec_dir.pid and not is_process_alive(exec_dir.pid) and age > grace:
+        exec_dir.stale_reason = f'process {exec_dir.pid} is not running'
+
+
+def _scan_exec_dirs(path, on_file, report: CleanupReport, now, ttl, grace):
+    with os.scandir(path) as entries:
+        for exec_entry in entries:
+            try:
+                if not exec_entry.is_dir(follow_symlinks=False):
+                    on_file(exec_entry.path, exec_entry.stat(follow_symlinks=False).st_size)
+                    continue
+                exec_dir = ExecDir(exec_entry.path, int(exec_entry.name) if exec_entry.name.isdigit() else None)
+                exec_dir.bytes, last_modified = _walk(exec_entry.path, on_file)
+                exec_dir.last_modified = max(last_modified, exec_entry.stat(follow_symlinks=False).st_mtime)
+            except FileNotFoundError:
+                # Files can vanish while the scan is running
+                continue
+            _mark_stale(exec_dir, now, ttl, grace)
+            report.exec_dirs.append(exec_dir)
+
+
+def scan(tauk_home, ttl=24 * 60 * 60, grace=60, on_file=None) -> CleanupReport:
+    """Aggregates the disk usage per category and finds stale execution dirs in a single pass"""
+    report = CleanupReport()
+    now = time.time()
+
+    def record(category):
+        def on_entry(path, size):
+            report.usage[category].add(size)
+            if on_file:
+                on_file(category, path, size)
+        return on_entry
+
+    try:
+        with os.scandir(tauk_home) as entries:
+            top_level = sorted(entries, key=lambda e: CATEGORIES.index(_categorize(e.name)))
+    except FileNotFoundError:
+        return report
+
+    for entry in top_level:
+        if entry.name in _IGNORED:
+            continue
+        category = _categorize(entry.name)
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                record(category)(entry.path, entry.stat(follow_symlinks=False).st_size)
+            elif category != EXECUTIONS:
+                _walk(entry.path, record(category))
+            else:
+                _scan_exec_dirs(entry.path, record(category), report, now, ttl, grace)
+        except FileNotFoundError:
+            # Deleted by a running process while scanning
+            continue
+
+    return report
+
+
+def prune(report: CleanupReport, workers=8):
+    """Deletes the stale execution dirs found by `scan` in parallel"""
+    stale = report.stale_exec_dirs
+    if not stale:
+        return report
+
+    def delete(exec_dir: ExecDir):
+        logger.debug(f'Deleting stale execution dir {exec_dir.path} ({exec_dir.stale_reason})')
+        shutil.rmtree(exec_dir.path)
+        return exec_dir
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(delete, exec_dir): exec_dir for exec_dir in stale}
+        for future, exec_dir in futures.items():
+            try:
+                report.deleted.append(future.result())
+            except OSError as ex:
+                logger.warning(f'Failed to delete execution dir {exec_dir.path}', exc_info=ex)
+                report.failed.append(exec_dir)
+
+    # Remove project dirs which have no executions left
+    for project_dir in {os.path.dirname(exec_dir.path) for exec_dir in report.deleted}:
+        try:
+            os.rmdir(project_dir)
+        except OSError:
+            pass
+
+    return report
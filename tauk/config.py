@@ -1,7 +1,36 @@
 import os
 
 from tauk.assistant.config import AssistantConfig
+from tauk.attachments import get_max_attachment_size
+from tauk.capture_policy import CapturePolicy
+from tauk.enums import AttachmentTypes
 from tauk.exceptions import TaukInvalidTypeException, TaukException
+from tauk.run_summary import get_default_summary_dir
+
+# Screenshots take a round trip to the driver, sampling faster than that only burns CPU on both ends
+MAX_SCREEN_RECORDING_FPS = 10
+
+
+def get_screen_recording_fps_from_env():
+    try:
+        fps = float(os.getenv('TAUK_SCREEN_RECORDING_FPS', ''))
+        return min(fps, MAX_SCREEN_RECORDING_FPS) if fps > 0 else None
+    except ValueError:
+        return None
+
+
+def get_run_summary_dir_from_env():
+    if os.getenv('TAUK_RUN_SUMMARY_DIR'):
+        return os.getenv('TAUK_RUN_SUMMARY_DIR')
+    return get_default_summary_dir() if os.getenv('TAUK_RUN_SUMMARY', '').lower() == 'true' else None
+
+
+def get_report_budget_from_env():
+    try:
+        budget = float(os.getenv('TAUK_REPORT_BUDGET', ''))
+        return budget if budget > 0 else None
+    except ValueError:
+        return None
 
 
 class TaukConfig:
@@ -19,6 +48,13 @@ class TaukConfig:
         self._cleanup_exec_context = True
         self._assistant_config: AssistantConfig | None = None
         self._project_root_dir = os.getcwd()
+        self._metrics_enabled = os.getenv('TAUK_METRICS', '').lower() == 'true'
+        self._metrics_dump = os.getenv('TAUK_METRICS_DUMP', '').lower() == 'true'
+        self._report_budget = get_report_budget_from_env()
+        self._capture_policy = CapturePolicy.from_env()
+        self._attachment_size_limits = {}
+        self._screen_recording_fps = get_screen_recording_fps_from_env()
+        self._run_summary_dir = get_run_summary_dir_from_env()
 
     def _get_value_from_property_or_env(self, prop, env_var):
         if prop:
@@ -73,6 +109,91 @@ class TaukConfig:
     def project_root_dir(self, path: str):
         self._project_root_dir = path
 
+    @property
+    def metrics_enabled(self):
+        return self._metrics_enabled
+
+    @metrics_enabled.setter
+    def metrics_enabled(self, val: bool):
+        self._validate_type(val, bool)
+        self._metrics_enabled = val
+
+    @property
+    def metrics_dump(self):
+        return self._metrics_dump
+
+    @metrics_dump.setter
+    def metrics_dump(self, val: bool):
+        # Dumping metrics requires collecting them
+        self._validate_type(val, bool)
+        self._metrics_dump = val
+        if val:
+            self._metrics_enabled = True
+
+    @property
+    def report_budget(self):
+        """Seconds a test may spend on reporting, None means unlimited"""
+        return self._report_budget
+
+    @report_budget.setter
+    def report_budget(self, val: float | None):
+        if val is not None:
+            self._validate_type(val, (int, float))
+            if val <= 0:
+                raise TaukException('report budget must be greater than 0')
+        self._report_budget = val
+
+    @property
+    def capture_policy(self):
+        return self._capture_policy
+
+    @capture_policy.setter
+    def capture_policy(self, val: CapturePolicy):
+        self._validate_type(val, CapturePolicy)
+        self._capture_policy = val
+
+    @property
+    def screen_recording_fps(self):
+        """Screenshots per second recorded from the registered driver while a test runs, None disables recording"""
+        return self._screen_recording_fps
+
+    @screen_recording_fps.setter
+    def screen_recording_fps(self, val: float | None):
+        if val is not None:
+            self._validate_type(val, (int, float))
+            if not 0 < val <= MAX_SCREEN_RECORDING_FPS:
+                raise TaukException(f'screen recording fps must be between 0 and {MAX_SCREEN_RECORDING_FPS}')
+        self._screen_recording_fps = val
+
+    @property
+    def run_summary_dir(self):
+        """Directory where the summary of every reported test is kept for `python -m tauk stats`, None disables it"""
+        return self._run_summary_dir
+
+    @run_summary_dir.setter
+    def run_summary_dir(self, val: str | None):
+        if val is not None:
+            self._validate_type(val, str)
+        self._run_summary_dir = val
+
+    def enable_run_summary(self):
+        """Keeps the run summaries in the default directory of the tauk home"""
+        self._run_summary_dir = get_default_summary_dir()
+
+    @property
+    def attachment_size_limits(self):
+        """Compressed size limits in bytes of the attachment types whose default limit was overridden"""
+        return self._attachment_size_limits
+
+    def set_attachment_size_limit(self, attachment_type: AttachmentTypes, max_size: int):
+        self._validate_type(attachment_type, AttachmentTypes)
+        if not isinstance(max_size, int) or max_size <= 0:
+            raise TaukException('attachment size limit must be a positive integer')
+        self._attachment_size_limits[attachment_type] = max_size
+
+    def get_attachment_size_limit(self, attachment_type: AttachmentTypes):
+        return get_max_attachment_size(attachment_type, self._attachment_size_limits)
+
     @staticmethod
     def _validate_type(val, expected_type):
         if not isinstance(val, expected_type):
@@ -84,4 +205,6 @@ class TaukConfig:
     def __str__(self):
         return f'TaukConfig: APIToken={self.api_token}, ProjectID={self.project_id}, API_URL={self.api_url}, ' \
                f'MultiprocessRun={self.multiprocess_run}, CleanupExecContext={self.cleanup_exec_context}, ' \
+               f'Metrics={self.metrics_enabled}, ReportBudget={self.report_budget}, {self.capture_policy}, ' \
+               f'ScreenRecordingFPS={self.screen_recording_fps}, RunSummaryDir={self.run_summary_dir}, ' \
                f'Assistant: {self.assistant_config}'
@@ -1,43 +1,97 @@
+import atexit
 import hashlib
+import itertools
 import logging
 import os
 import shutil
+import time
 import uuid
+import zlib
 import jsonpickle
 
 from tauk.api import TaukApi
 from tauk.assistant.assistant import TaukAssistant
 from tauk.config import TaukConfig
+from tauk.context import journal
+from tauk.context.journal import RunJournal
+from tauk.context.run_handle import RunHandle
+from tauk.context.test_case import TestCase
 from tauk.context.test_data import TestData
+from tauk.context.test_error import TestError
+from tauk.context.test_suite import TestSuite
+from tauk.deadline import Deadline
+from tauk.enums import AttachmentTypes, TestStatus
 from tauk.exceptions import TaukException
+from tauk.retry import ResultSpool
 from tauk.log_formatter import CustomJsonFormatter
+from tauk.run_summary import RunSummarySink, SUMMARY_FILE_EXTENSION, summary_row
+from tauk.uploader import BackgroundUploader
 
 from filelock import FileLock
 
-from tauk.utils import log_delay
+from tauk.utils import is_process_alive, log_delay
 
 logger = logging.getLogger('tauk')
 
 
 class TaukContext:
 
-    def __init__(self, tauk_config: TaukConfig):
+    def __init__(self, tauk_config: TaukConfig, run_handle: RunHandle = None):
         self.test_data: TestData = TestData()
-        self._setup_exec_dir(tauk_config.multiprocess_run)
+        self.pid = os.getpid()
+        # Attached contexts report into the run of another process, which owns its lifecycle
+        self.attached = run_handle is not None
+        if self.attached:
+            self.exec_dir = run_handle.exec_dir
+            os.makedirs(self.exec_dir, exist_ok=True)
+        else:
+            self._setup_exec_dir(tauk_config.multiprocess_run)
         self._setup_error_logger()
         self._exec_file = os.path.join(self.exec_dir, 'exec.run')
-        self.api = TaukApi(tauk_config.api_token, tauk_config.project_id, tauk_config.multiprocess_run)
+        self.api = TaukApi(run_handle.api_token if self.attached else tauk_config.api_token,
+                           run_handle.project_id if self.attached else tauk_config.project_id,
+                           tauk_config.multiprocess_run, api_url=run_handle.api_url if self.attached else None)
+        # Kept outside the execution dir, which a later run in the same directory deletes
+        self.api.spool = ResultSpool(os.path.join(os.environ.get('TAUK_HOME'), 'spool', self.api.get_project_id()))
+        self.api.attachment_size_limits = tauk_config.attachment_size_limits
+        self._multiprocess_run = tauk_config.multiprocess_run
+        self._async_api = None
+        self._report_budget = tauk_config.report_budget
+        self.capture_policy = tauk_config.capture_policy
+        self.background_uploader = BackgroundUploader()
         self._project_root_dir = tauk_config.project_root_dir
+        self.recordings_dir = os.path.join(self.exec_dir, 'recordings')
+        self._journal_path = os.path.join(self.exec_dir, 'run.journal')
+        # Results of finished tests are kept next to the journal until they are reported
+        self._journal_results_dir = os.path.join(self.exec_dir, 'journal')
+        self.journal: RunJournal | None = None
+        self._journal_keys = itertools.count()
+        self.run_summary: RunSummarySink | None = None
+        if tauk_config.run_summary_dir:
+            self.run_summary = RunSummarySink(os.path.join(
+                tauk_config.run_summary_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{self.pid}{SUMMARY_FILE_EXTENSION}'))
+            # Buffered rows are written even if Tauk.destroy is never called
+            atexit.register(self.run_summary.close)
+        # Processes of the same run recover the results of the ones which crashed through the journal
+        if self.attached or tauk_config.multiprocess_run:
+            self.open_journal()
 
         # Initialize Tauk Assistant
         self.assistant: TaukAssistant | None = None
         if tauk_config.is_assistant_enabled():
             try:
                 self.assistant = TaukAssistant(tauk_config.api_token, self.exec_dir, tauk_config.assistant_config)
-                self.assistant.launch()
+                self.assistant.start()
+                # Lease has to be released even if Tauk.destroy is never called (Ex: multiprocess listener)
+                atexit.register(self.assistant.stop)
             except Exception as ex:
                 logger.error('Failed to launch tauk assistant', exc_info=ex)
 
+        if self.attached:
+            self.run_id = self.api.run_id = run_handle.run_id
+            logger.debug(f'Attached to run {run_handle}')
+            return
+
         if tauk_config.multiprocess_run:
             self._setup_execution_file()
             return
@@ -48,6 +102,33 @@ class TaukContext:
     def project_root_dir(self):
         return self._project_root_dir
 
+    @property
+    def async_api(self):
+        # Created on first use because aiohttp is only required by async tests
+        if self._async_api is None:
+            from tauk.async_api import AsyncTaukApi
+            # Both clients talk to the same backend so they share its health and the retry budget
+            self._async_api = AsyncTaukApi(self.api.get_api_token(), self.api.get_project_id(), self._multiprocess_run,
+                                           retry_policy=self.api.retry_policy, retry_budget=self.api.retry_budget,
+                                           circuit_breaker=self.api.circuit_breaker, api_url=self.api.api_url)
+            self._async_api.run_id = self.api.run_id
+            self._async_api.spool = self.api.spool
+            self._async_api.attachment_size_limits = self.api.attachment_size_limits
+        return self._async_api
+
+    def get_run_handle(self):
+        # Workers attached with the handle write into the journal, which this process reconciles
+        self.open_journal()
+        return RunHandle(self.run_id, self.api.get_api_token(), self.api.get_project_id(), self.exec_dir,
+                         self.api.api_url)
+
+    def new_report_deadline(self):
+        return Deadline(self._report_budget)
+
+    def close_async_api(self):
+        if self._async_api is not None:
+            self._async_api.close_sync()
+
     def _setup_exec_dir(self, multiprocess_run):
         self.exec_dir = self._get_exec_dir(multiprocess_run)
         if not os.path.exists(self.exec_dir):
@@ -99,6 +180,11 @@ class TaukContext:
         if not os.path.exists(self.exec_dir):
             return
 
+        assistant_lease = os.path.join(self.exec_dir, 'assistant.lease')
+        if os.path.exists(assistant_lease):
+            logger.debug(f'Assistant is still leased by other processes, not deleting {self.exec_dir}')
+            return
+
         logger.debug(f'Deleting execution files in {self.exec_dir}')
         # Delete exec file
         lock_file = f'{self._exec_file}.lock'
@@ -108,15 +194,43 @@ class TaukContext:
         if os.path.exists(lock_file):
             os.remove(lock_file)
 
+        # Delete run journal
+        for journal_file in [self._journal_path, f'{self._journal_path}.lock']:
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+        shutil.rmtree(self._journal_results_dir, ignore_errors=True)
+
         # Delete error log file
         if os.path.exists(self.error_log):
             os.remove(self.error_log)
 
+        # Delete assistant output and lease lock files
+        for assistant_file in ['assistant.log', 'assistant.lease.lock']:
+            assistant_file = os.path.join(self.exec_dir, assistant_file)
+            if os.path.exists(assistant_file):
+                os.remove(assistant_file)
+
         # Delete assistant dir
         assistant_dir = os.path.join(self.exec_dir, 'assistant')
         if os.path.exists(assistant_dir):
             shutil.rmtree(assistant_dir)
 
+        # Screen recordings are deleted once uploaded, the ones left of this process were never reported
+        if os.path.isdir(self.recordings_dir):
+            for recording in os.listdir(self.recordings_dir):
+                if recording.startswith(f'{self.pid}-'):
+                    os.remove(os.path.join(self.recordings_dir, recording))
+            if not os.listdir(self.recordings_dir):
+                os.rmdir(self.recordings_dir)
+
+        # Spooled results which could not be uploaded are kept
+        if self.api.run_id:
+            self.api.spool.remove_if_empty(self.api.run_id)
+
+        # Files such as metrics dumps are meant to outlive the execution
+        if os.listdir(self.exec_dir):
+            logger.debug(f'Keeping execution dir {self.exec_dir} since it still has files in it')
+            return
         os.rmdir(self.exec_dir)
 
     def _setup_execution_file(self):
@@ -151,22 +265,164 @@ class TaukContext:
             set_exec_file(self._init_run(), self.api.get_api_token(), self.api.get_project_id())
             logger.debug(f'Execution unlocked for {self._exec_file}')
 
-    def get_json_test_data(self, test_suite_filename, test_method_name):
+    def get_json_test_data(self, test_suite_filename, test_case: TestCase):
         suite = self.test_data.get_test_suite(test_suite_filename)
         if not suite:
             raise TaukException(f'Could not find suite with filename {test_suite_filename}')
 
-        suite_json = suite.to_json()
-
-        # Clean up tests
-        for test in suite_json.get('test_cases'):
-            if test.get('method_name') != test_method_name:
-                suite_json.get('test_cases').remove(test)
-
+        self.capture_policy.apply(test_case)
+        # Only the reported test is serialized, not every test which is still running in the suite
         json_data = {
             "test_suites": [
-                suite_json
+                suite.to_json(test_cases=[test_case])
             ]
         }
 
         return jsonpickle.encode(json_data, unpicklable=False)
+
+    def open_journal(self):
+        if self.journal is not None:
+            return
+        try:
+            self.journal = RunJournal(self._journal_path)
+        except Exception as ex:
+            logger.error(f'Failed to open run journal {self._journal_path}', exc_info=ex)
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def start_test(self, test_suite_filename, test_case: TestCase):
+        self.test_data.add_test_case(test_suite_filename, test_case)
+        if self.journal is None:
+            return
+        test_case.journal_key = f'{self.pid}-{next(self._journal_keys)}'
+        self._append_journal(journal.START, test_case, {
+            'filename': test_suite_filename,
+            'method_name': test_case.method_name,
+            'custom_name': test_case.custom_name,
+            'start_timestamp': test_case.start_timestamp,
+        })
+
+    def _journal_result_file(self, journal_key):
+        return os.path.join(self._journal_results_dir, f'{journal_key}.json.z')
+
+    def journal_test_finished(self, test_suite_filename, test_case: TestCase, json_test_data):
+        if self.journal is None or test_case.journal_key is None:
+            return
+        # Written outside the journal, which would otherwise grow with every test. Compressed quickly, it is only read
+        # back when this process crashes before the upload
+        try:
+            os.makedirs(self._journal_results_dir, exist_ok=True)
+            with open(self._journal_result_file(test_case.journal_key), 'wb') as file:
+                file.write(zlib.compress(json_test_data.encode(), 1))
+        except OSError as ex:
+            logger.error(f'Failed to write the results of the test {test_case.method_name} for the run journal',
+                         exc_info=ex)
+            return
+        self._append_journal(journal.FINISH, test_case, {
+            'filename': test_suite_filename,
+            'method_name': test_case.method_name,
+        })
+
+    def journal_attachment(self, test_case: TestCase, file_path, attachment_type):
+        self._append_journal(journal.ARTIFACT, test_case, {'path': file_path, 'type': attachment_type.value})
+
+    def journal_test_reported(self, test_case: TestCase):
+        if self.journal is None or test_case.journal_key is None:
+            return
+        self._append_journal(journal.REPORTED, test_case, {'test_id': test_case.id})
+        self._delete_journal_result(test_case.journal_key)
+
+    def _delete_journal_result(self, journal_key):
+        try:
+            os.remove(self._journal_result_file(journal_key))
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            logger.warning(f'Failed to delete journal result {self._journal_result_file(journal_key)}', exc_info=ex)
+
+    def _append_journal(self, record_type, test_case: TestCase, meta, data=b''):
+        if self.journal is None or test_case.journal_key is None:
+            return
+        try:
+            self.journal.append(record_type, test_case.journal_key, meta, data)
+        except Exception as ex:
+            logger.error(f'Failed to write to run journal for the test {test_case.method_name}', exc_info=ex)
+
+    def record_run_summary(self, test_suite_filename, test_case: TestCase):
+        if self.run_summary is None:
+            return
+        try:
+            self.run_summary.record(summary_row(test_case.to_json(), test_suite_filename, getattr(self, 'run_id', None),
+                                                test_case.payload_size, test_case.step_durations))
+        except Exception as ex:
+            logger.error(f'Failed to record the run summary of the test {test_case.method_name}', exc_info=ex)
+
+    def close_run_summary(self):
+        if self.run_summary is not None:
+            self.run_summary.close()
+
+    def reconcile(self):
+        """Reports the tests of processes of the run which exited without reporting them, returns their count"""
+        if self.journal is None:
+            return 0
+
+        artifacts = {}
+
+        def select(records):
+            finished, reported, started = {}, set(), []
+            for record in records:
+                if record.type == journal.ARTIFACT:
+                    artifacts.setdefault(record.key, []).append(record.meta)
+                elif record.type == journal.FINISH:
+                    finished[record.key] = record
+                elif record.type == journal.REPORTED:
+                    reported.add(record.key)
+                elif record.type == journal.START:
+                    started.append(record)
+            # Finished tests are reported with their results, the others failed because their process crashed
+            pending = [finished.get(record.key, record) for record in started if record.key not in reported]
+            return [record for record in pending if not is_process_alive(record.pid)]
+
+        claimed = self.journal.claim(select)
+        if not claimed:
+            return 0
+
+        logger.warning(f'Reporting {len(claimed)} tests left behind by processes which exited')
+        for record in claimed:
+            try:
+                self._report_journal_record(record, artifacts.get(record.key, []))
+            except Exception as ex:
+                logger.error(f'Failed to report test {record.meta.get("method_name")} from the run journal',
+                             exc_info=ex)
+            finally:
+                self._delete_journal_result(record.key)
+        return len(claimed)
+
+    def _report_journal_record(self, record, artifacts):
+        filename = record.meta['filename']
+        if record.type == journal.FINISH:
+            with open(self._journal_result_file(record.key), 'rb') as file:
+                json_test_data = zlib.decompress(file.read()).decode()
+        else:
+            test_case = TestCase()
+            test_case.method_name = record.meta['method_name']
+            test_case.custom_name = record.meta.get('custom_name')
+            test_case.start_timestamp = record.meta.get('start_timestamp')
+            test_case.end_timestamp = record.timestamp
+            test_case.status = TestStatus.FAILED
+            test_case.error = TestError()
+            test_case.error.error_type = 'ProcessExited'
+            test_case.error.error_msg = f'Process {record.pid} exited before the test finished'
+            json_test_data = jsonpickle.encode({'test_suites': [TestSuite(filename).to_json([test_case])]},
+                                               unpicklable=False)
+
+        upload_result = self.api.upload(json_test_data)
+        test_id = upload_result.get(filename, {}).get(record.meta['method_name'])
+        if not test_id:
+            return
+        for artifact in artifacts:
+            if os.path.exists(artifact['path']):
+                self.api.upload_attachment(artifact['path'], AttachmentTypes(artifact['type']), test_id)
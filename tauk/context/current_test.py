@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only imported for type checking, so modules imported by test_case can look up the current test
+    from tauk.context.test_case import TestCase
+
+
+class CurrentTest(NamedTuple):
+    filename: str
+    test_case: 'TestCase'
+
+
+# Each thread and asyncio task sees the test it is running, so parallel tests don't report into each other
+_current_test: ContextVar[CurrentTest | None] = ContextVar('tauk_current_test', default=None)
+
+
+def get_current_test() -> CurrentTest | None:
+    return _current_test.get()
+
+
+def enter_test(filename, test_case: 'TestCase'):
+    """Makes the test current until exit_test is called with the returned token"""
+    return _current_test.set(CurrentTest(filename, test_case))
+
+
+def exit_test(token):
+    try:
+        _current_test.reset(token)
+    except ValueError:
+        # The token was created in another context, Ex: a runner which started the test on another thread
+        _current_test.set(None)
+
+
+@contextmanager
+def test_scope(filename, test_case: 'TestCase'):
+    token = enter_test(filename, test_case)
+    try:
+        yield test_case
+    finally:
+        exit_test(token)
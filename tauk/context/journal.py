@@ -0,0 +1,201 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger('tauk')
+
+MAGIC = b'TAUKJRN1'
+# magic, tail offset, capacity
+_FILE_HEADER = struct.Struct('<8sQQ')
+FILE_HEADER_SIZE = 64
+# state, record type, pid, timestamp in ms, payload length
+_RECORD_HEADER = struct.Struct('<BBxxIQI')
+INITIAL_CAPACITY = 4 * 1024 * 1024
+
+RESERVED = 0
+COMMITTED = 1
+
+START = 1
+FINISH = 2
+ARTIFACT = 3
+REPORTED = 4
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+class JournalRecord:
+    def __init__(self, record_type, pid, timestamp, key, meta, data, data_span=None) -> None:
+        self.type = record_type
+        self.pid = pid
+        self.timestamp = timestamp
+        self.key = key
+        self.meta = meta
+        self.data = data
+        # Where the data is in the journal when it wasn't read along with the metadata
+        self.data_span = data_span
+
+
+class RunJournal:
+    """Append-only journal shared by the processes of a run through a memory mapped file in the execution dir.
+
+    Records are written straight into the mapping and committed last, so a process which crashes leaves behind
+    what it wrote so far and at worst a record which never got committed. Records of reported tests are dropped when
+    the journal fills up, it only grows for the tests which are still running or waiting to be reconciled."""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._local_lock = threading.Lock()
+        self._file = None
+        self._mmap: mmap.mmap | None = None
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(fd, 'r+b')
+        with self._lock():
+            if os.fstat(fd).st_size < FILE_HEADER_SIZE:
+                os.ftruncate(fd, INITIAL_CAPACITY)
+                self._map()
+                _FILE_HEADER.pack_into(self._mmap, 0, MAGIC, FILE_HEADER_SIZE, INITIAL_CAPACITY)
+            else:
+                self._map()
+        magic, _, _ = _FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{self.path} is not a tauk journal')
+
+    def _map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), os.fstat(self._file.fileno()).st_size)
+
+    @contextmanager
+    def _lock(self):
+        with self._local_lock:
+            if fcntl is None:
+                from filelock import FileLock
+                with FileLock(f'{self.path}.lock'):
+                    yield
+                return
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _header(self):
+        _, tail, capacity = _FILE_HEADER.unpack_from(self._mmap, 0)
+        return tail, capacity
+
+    def append(self, record_type, key, meta=None, data=b''):
+        with self._lock():
+            self._append(record_type, key, meta, data)
+
+    def _append(self, record_type, key, meta=None, data=b''):
+        body = json.dumps({'key': key, **(meta or {})}, separators=(',', ':')).encode() + b'\n' + data
+        size = _RECORD_HEADER.size + len(body)
+        tail, capacity = self._header()
+        if tail + size > capacity:
+            tail = self._compact(tail, capacity)
+        if tail + size > capacity:
+            # Grows instead of wrapping around, records may not have been reconciled yet
+            capacity = max(capacity * 2, tail + size)
+            os.ftruncate(self._file.fileno(), capacity)
+        if capacity > len(self._mmap):
+            self._map()
+        _RECORD_HEADER.pack_into(self._mmap, tail, RESERVED, record_type, os.getpid(), _now(), len(body))
+        _FILE_HEADER.pack_into(self._mmap, 0, MAGIC, tail + size, capacity)
+
+        offset = tail + _RECORD_HEADER.size
+        self._mmap[offset:offset + len(body)] = body
+        # Committed last, so a torn record is never read back
+        self._mmap[tail] = COMMITTED
+
+    def _compact(self, tail, capacity):
+        """Drops the records of reported tests, and the ones which were never committed, by moving the others to the
+        front. Returns the new tail"""
+        kept, reported = [], set()
+        offset = FILE_HEADER_SIZE
+        while offset < tail:
+            state, record_type, _, _, length = _RECORD_HEADER.unpack_from(self._mmap, offset)
+            body_offset, end = offset + _RECORD_HEADER.size, offset + _RECORD_HEADER.size + length
+            if state == COMMITTED:
+                key = json.loads(self._mmap[body_offset:self._mmap.find(b'\n', body_offset, end)])['key']
+                if record_type == REPORTED:
+                    reported.add(key)
+                else:
+                    kept.append((offset, end, key))
+            offset = end
+
+        new_tail = FILE_HEADER_SIZE
+        for start, end, key in kept:
+            if key in reported:
+                continue
+            if start != new_tail:
+                self._mmap.move(new_tail, start, end - start)
+            new_tail += end - start
+        _FILE_HEADER.pack_into(self._mmap, 0, MAGIC, new_tail, capacity)
+        logger.debug(f'Compacted run journal {self.path} from {tail} to {new_tail} bytes')
+        return new_tail
+
+    def read(self):
+        with self._lock():
+            return self._read()
+
+    def _read(self, with_data=True):
+        records = []
+        tail, capacity = self._header()
+        if capacity > len(self._mmap):
+            self._map()
+        offset = FILE_HEADER_SIZE
+        while offset < tail:
+            state, record_type, pid, timestamp, length = _RECORD_HEADER.unpack_from(self._mmap, offset)
+            body_offset = offset + _RECORD_HEADER.size
+            offset = body_offset + length
+            if state != COMMITTED:
+                continue
+            if with_data:
+                meta, _, data = self._mmap[body_offset:offset].partition(b'\n')
+                data_span = None
+            else:
+                meta_end = self._mmap.find(b'\n', body_offset, offset)
+                meta, data, data_span = self._mmap[body_offset:meta_end], None, (meta_end + 1, offset)
+            meta = json.loads(meta)
+            records.append(JournalRecord(record_type, pid, timestamp, meta.pop('key'), meta, data, data_span))
+        return records
+
+    def claim(self, select):
+        """Marks the records picked by `select` from all records as reported, atomically so that processes
+        reconciling at the same time don't both pick them. `select` only gets the metadata of the records, the data
+        is only read for the claimed ones"""
+        with self._lock():
+            claimed = select(self._read(with_data=False))
+            for record in claimed:
+                start, end = record.data_span
+                record.data, record.data_span = self._mmap[start:end], None
+                self._append(REPORTED, record.key, {'reconciled': True})
+        return claimed
+
+    @property
+    def size(self):
+        return self._header()[0]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,15 @@
+class RunHandle:
+    """Everything a worker process needs to report into a run started by its parent. It is picklable so it can be
+    passed to multiprocessing or ProcessPoolExecutor workers, which then attach with Tauk.attach()"""
+
+    def __init__(self, run_id, api_token, project_id, exec_dir, api_url) -> None:
+        self.run_id = run_id
+        self.api_token = api_token
+        self.project_id = project_id
+        self.exec_dir = exec_dir
+        self.api_url = api_url
+
+    def __repr__(self):
+        # The API token is left out so that handles can be logged
+        return f'RunHandle(run_id={self.run_id}, project_id={self.project_id}, exec_dir={self.exec_dir}, ' \
+               f'api_url={self.api_url})'
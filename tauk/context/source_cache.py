@@ -0,0 +1,75 @@
+import functools
+import inspect
+import logging
+import os
+import tokenize
+
+logger = logging.getLogger('tauk')
+
+SOURCE_CACHE_SIZE = 64
+WINDOW_CACHE_SIZE = 256
+# Lines of code reported before and after the failing line
+LINES_BEFORE = 29
+LINES_AFTER = 29
+
+
+@functools.lru_cache(maxsize=SOURCE_CACHE_SIZE)
+def _read_source_lines(filename, mtime_ns):
+    # mtime is only part of the key, so a file edited during the run is read again
+    with tokenize.open(filename) as file:
+        return tuple(file.readlines())
+
+
+def get_source_lines(filename):
+    try:
+        return _read_source_lines(filename, os.stat(filename).st_mtime_ns)
+    except (OSError, SyntaxError, UnicodeDecodeError):
+        return None
+
+
+def get_source_line(filename, line_number):
+    lines = get_source_lines(filename)
+    if not lines or not 0 < line_number <= len(lines):
+        return None
+    return lines[line_number - 1].strip()
+
+
+def _get_code(func):
+    func = inspect.unwrap(func)
+    func = getattr(func, '__func__', func)
+    return getattr(func, '__code__', None)
+
+
+@functools.lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def _get_window(code, mtime_ns, error_line_number):
+    lines = _read_source_lines(code.co_filename, mtime_ns)
+    first_line_number = code.co_firstlineno
+    # Same lookup inspect.getsourcelines does, but the file has already been read
+    last_line_number = first_line_number - 1 + len(inspect.getblock(lines[first_line_number - 1:]))
+
+    if first_line_number <= error_line_number <= last_line_number:
+        start = max(error_line_number - LINES_BEFORE, first_line_number)
+        end = min(error_line_number + LINES_AFTER, last_line_number)
+    else:
+        start = first_line_number
+        end = min(first_line_number + LINES_BEFORE + LINES_AFTER, last_line_number)
+    return tuple((line_number, lines[line_number - 1]) for line_number in range(start, end + 1))
+
+
+def get_code_context(func, error_line_number=0):
+    """Source lines of `func` around the failing line, or its first lines when the error happened elsewhere"""
+    code = _get_code(func)
+    if code is None:
+        raise TypeError(f'could not find the code of {func}')
+    try:
+        mtime_ns = os.stat(code.co_filename).st_mtime_ns
+    except OSError:
+        raise OSError(f'could not find the source file of {func}')
+
+    return [{'line_number': line_number, 'line_code': line_code}
+            for line_number, line_code in _get_window(code, mtime_ns, error_line_number)]
+
+
+def cache_clear():
+    _read_source_lines.cache_clear()
+    _get_window.cache_clear()
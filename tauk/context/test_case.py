@@ -1,22 +1,54 @@
 import logging
 import os.path
 import re
+import time
 import tzlocal
-import inspect
 import traceback
 import typing
 
-from contextlib import suppress
+from contextlib import contextmanager, suppress
 from pathlib import Path
 from tauk.assistant.assistant import TaukAssistant
+from tauk.assistant.watcher import AttachmentWatcher
+from tauk.capture_cache import capture_cache
+from tauk.context.source_cache import get_code_context, get_source_line
 from tauk.context.test_error import TestError
+from tauk.deadline import is_budget_spent
 from tauk.enums import AutomationTypes, PlatformNames, TestStatus, BrowserNames, AttachmentTypes
 from tauk.exceptions import TaukException
+from tauk.recording import ScreenRecorder
 from tauk.utils import get_appium_server_version, get_browser_driver_version, get_browser_debugger_address, log_delay
 
 logger = logging.getLogger('tauk')
 
 
+def read_view_hierarchy(driver):
+    if hasattr(driver, 'contexts') and 'FLUTTER' in driver.contexts:
+        current_context = driver.current_context
+        driver.switch_to.context('NATIVE_APP')
+        page_source = driver.page_source
+        driver.switch_to.context(current_context)
+        return page_source
+    return driver.page_source
+
+
+def _capture_before_quit(driver, test_case):
+    # The test running when the driver is quit gets the captures, tests sharing the driver reuse them from the cache
+    try:
+        screenshot = capture_cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        if test_case is not None and not test_case.screenshot:
+            test_case.screenshot = screenshot
+    except Exception as ex:
+        logger.error('Failed to capture screenshot', exc_info=ex)
+
+    try:
+        view = capture_cache.capture(driver, 'view', lambda: read_view_hierarchy(driver))
+        if test_case is not None and not test_case.view:
+            test_case.view = view
+    except Exception as ex:
+        logger.error('Failed to capture view hierarchy', exc_info=ex)
+
+
 class TestCase(object):
 
     def __init__(self) -> None:
@@ -35,6 +67,8 @@ class TestCase(object):
         self.timezone: str = None  # "America/Los_Angeles"
         self._error: TestError = None
         self.screenshot: str = None
+        # Changed tiles of the screenshot, which is then referenced in artifact_refs
+        self.screenshot_delta: dict = None
         self.view: str = None
         self._code_context: typing.List[object] = None
         self.webdriver_client_version: str = None
@@ -42,12 +76,25 @@ class TestCase(object):
         self.appium_server_version: str = None
         self._browser_debugger = {'address': '', 'page_id': ''}
         self._attachments: typing.List[tuple] = []
+        # Attachments uploaded while the test is running, Ex: streamed assistant logs
+        self.streamed_attachments: typing.Set[str] = set()
         self._capabilities: {} = None
-        self._tags: {} = None
-        self._user_data: {} = None
+        self._tags: {} = {}
+        self._user_data: {} = {}
         self.log: typing.List[object] = None
+        self.fingerprint: str = None
+        self.artifact_refs: typing.Dict[str, str] = None
+        # Set by the capture policy, remembered once the test is uploaded
+        self.artifact_candidates = None
+        # Identifies the test in the run journal of multiprocess runs
+        self.journal_key: str = None
+        # Milliseconds spent by tauk on each step of reporting the test, and the size of what was uploaded
+        self.step_durations: typing.Dict[str, float] = {}
+        self.payload_size: int = None
 
         self._driver_instance = None
+        self._attachment_watcher: AttachmentWatcher | None = None
+        self._screen_recorder: ScreenRecorder | None = None
 
     # NOTE: Any object that should be a part of test case should be explicitly added to to_json()
     #       method
@@ -67,6 +114,7 @@ class TestCase(object):
             'timezone': self.timezone,
             'error': self.error,
             'screenshot': self.screenshot,
+            'screenshot_delta': self.screenshot_delta,
             'view': self.view,
             'code_context': self.code_context,
             'webdriver_client_version': self.webdriver_client_version,
@@ -76,6 +124,8 @@ class TestCase(object):
             'tags': self.tags,
             'user_data': self.user_data,
             'log': self.log,
+            'fingerprint': self.fingerprint,
+            'artifact_refs': self.artifact_refs,
         }
 
         return {k: v for k, v in json.items() if v}
@@ -216,6 +266,45 @@ class TestCase(object):
         except Exception as ex:
             logger.error('Failed to connect to browser debugger', exc_info=ex)
 
+    def start_attachment_stream(self, assistant: TaukAssistant, on_attachment):
+        """Calls on_attachment(file_path, attachment_type) for every assistant log completed during the test"""
+        if self._attachment_watcher or not self.browser_debugger_page_id:
+            return
+
+        def stream_attachment(file_path):
+            if not self.id:
+                logger.debug(f'[Assistant] Test is not registered yet, {file_path} will be uploaded at the end')
+                return
+            on_attachment(file_path, AttachmentTypes.resolve_assistant_log(os.path.basename(file_path)))
+
+        self._attachment_watcher = AttachmentWatcher(assistant.get_attachments_dir(self.browser_debugger_page_id),
+                                                     stream_attachment)
+        self._attachment_watcher.start()
+
+    def stop_attachment_stream(self) -> set:
+        """Returns the attachments which are still being streamed"""
+        if not self._attachment_watcher:
+            return set()
+        streaming = self._attachment_watcher.stop()
+        self._attachment_watcher = None
+        return streaming
+
+    def start_screen_recording(self, output_dir, fps):
+        if self._screen_recorder is not None or self.driver_instance is None:
+            return
+        name = f'{os.getpid()}-{id(self):x}-{self.method_name}'
+        self._screen_recorder = ScreenRecorder(self.driver_instance, output_dir, name, fps).start()
+
+    def stop_screen_recording(self):
+        """Returns the paths of the recorded segments, oldest first"""
+        if self._screen_recorder is None:
+            return []
+        recorder, self._screen_recorder = self._screen_recorder, None
+        segments = recorder.stop()
+        logger.debug(f'Recorded {recorder.frames} frames of the test {self.method_name}, '
+                     f'{recorder.skipped_frames} identical frames skipped')
+        return segments
+
     def register_driver(self, driver, assistant: TaukAssistant = None, test_filename=None, test_method_name=None):
         if not driver or 'webdriver' not in f'{type(driver)}':
             raise TaukException(f'Driver {type(driver)} is not of type webdriver')
@@ -231,25 +320,8 @@ class TestCase(object):
         if assistant and assistant.is_running() and assistant.config.is_cdp_capture_enabled():
             self._connect_to_browser_debugger(assistant)
 
-        def tauk_callback(func):
-            def inner():
-                try:
-                    self.capture_screenshot()
-                except Exception as ex:
-                    logger.error('Failed to capture screenshot', exc_info=ex)
-
-                try:
-                    self.capture_view_hierarchy()
-                except Exception as ex:
-                    logger.error('Failed to capture view hierarchy', exc_info=ex)
-                func()
-
-            return inner
-
-        # If browser is not quit and shared in multiple test cases then we have to make sure this is not recursive
-        if tauk_callback.__name__ not in str(driver.quit):
-            logger.debug('Attaching tauk callback to driver.quit()')
-            driver.quit = tauk_callback(driver.quit)
+        # Registering the same driver again only switches the test case it reports to
+        capture_cache.register(driver, self, _capture_before_quit)
 
         self.driver_instance = driver
         self.capabilities = driver.capabilities
@@ -287,7 +359,8 @@ class TestCase(object):
         if not self.driver_instance:
             raise TaukException('driver object is None, check if driver is registered')
 
-        self.screenshot = self.driver_instance.get_screenshot_as_base64()
+        self.screenshot = capture_cache.capture(self.driver_instance, 'screenshot',
+                                                self.driver_instance.get_screenshot_as_base64)
 
     @log_delay(action_name='Capture ViewHierarchy', after=3)
     def capture_view_hierarchy(self):
@@ -298,86 +371,71 @@ class TestCase(object):
         if not self.driver_instance:
             raise TaukException('driver object is None, check if driver is registered')
 
-        if hasattr(self.driver_instance, 'contexts') and 'FLUTTER' in self.driver_instance.contexts:
-            current_context = self.driver_instance.current_context
-            self.driver_instance.switch_to.context('NATIVE_APP')
-            self.view = self.driver_instance.page_source
-            self.driver_instance.switch_to.context(current_context)
-        else:
-            self.view = self.driver_instance.page_source
+        driver = self.driver_instance
+        self.view = capture_cache.capture(driver, 'view', lambda: read_view_hierarchy(driver))
 
     def capture_error(self, caller_filename, exec_info):
         exc_type, exc_value, exc_traceback = exec_info
-        stack_summary = traceback.extract_tb(exc_traceback)
 
         self.error = TestError()
         self.error.error_type = exc_value.__class__.__name__
         self.error.error_msg = str(exc_value)
         self.error.traceback = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
 
-        for frame_summary in stack_summary:
-            if caller_filename in frame_summary.filename:
-                self.error.line_number = frame_summary.lineno
-                self.error.invoked_func = frame_summary.name
-                self.error.code_executed = frame_summary.line
+        # Walking the frames avoids building a summary, with its source lines, for every frame of the stack
+        for frame, line_number in traceback.walk_tb(exc_traceback):
+            if caller_filename in frame.f_code.co_filename:
+                self.error.line_number = line_number
+                self.error.invoked_func = frame.f_code.co_name
+                self.error.code_executed = get_source_line(frame.f_code.co_filename, line_number) or ''
                 return
 
         logger.debug(f'Could not find a frame with filename {caller_filename} in stack summary')
 
     def capture_test_steps(self, testcase):
-        source_lines = inspect.getsourcelines(testcase)
-        starting_line_number = source_lines[1]
-
-        output = []
-        for i, line in enumerate(source_lines[0]):
-            output.append({
-                'line_number': starting_line_number + i,
-                'line_code': line
-            })
-
-        if self.error and self.error.line_number > 0:
-            for index, value in enumerate(output):
-                if value['line_number'] == self.error.line_number:
-                    # get previous 9 lines plus the line where the error occurred
-                    # ensure that the start range value is never below zero
-                    # get the next 9 lines after the error occurred
-                    # ensure that the end range value never exceeds the len of the list
-                    self.code_context = output[max(index - 29, 0): min(index + 30, len(output))]
-                    return
-
-        self.code_context = output
-
-    def capture_success_data(self):
-        self.status = TestStatus.PASSED
+        self.code_context = get_code_context(testcase, self.error.line_number if self.error else 0)
 
+    @contextmanager
+    def timed_step(self, step):
+        started = time.perf_counter()
         try:
-            self.capture_screenshot()
-        except Exception as ex:
-            logger.error('Failed to capture screenshot', exc_info=ex)
+            yield
+        finally:
+            self.step_durations[step] = self.step_durations.get(step, 0) + (time.perf_counter() - started) * 1000
+
+    def _capture_driver_artifacts(self, capture_policy, skip_view=False):
+        if capture_policy is None or capture_policy.should_capture_screenshot(self.status):
+            try:
+                with self.timed_step('screenshot'):
+                    self.capture_screenshot()
+            except Exception as ex:
+                logger.error('Failed to capture screenshot', exc_info=ex)
+
+        # Skipping the view hierarchy also saves a round trip to the driver
+        if (capture_policy is None or capture_policy.should_capture_view(self.status)) and not skip_view and \
+                not is_budget_spent('view hierarchy capture'):
+            try:
+                with self.timed_step('view'):
+                    self.capture_view_hierarchy()
+            except Exception as ex:
+                logger.error('Failed to capture view hierarchy', exc_info=ex)
 
-        try:
-            self.capture_view_hierarchy()
-        except Exception as ex:
-            logger.error('Failed to capture view hierarchy', exc_info=ex)
+    def capture_success_data(self, capture_policy=None):
+        self.status = TestStatus.PASSED
+        self._capture_driver_artifacts(capture_policy)
 
-    def capture_failure_data(self, test_filename, err, test_func):
+    def capture_failure_data(self, test_filename, err, test_func, capture_policy=None):
         self.status = TestStatus.FAILED
 
-        try:
-            self.capture_screenshot()
-        except Exception as ex:
-            logger.error('Failed to capture screenshot', exc_info=ex)
-
-        try:
-            self.capture_view_hierarchy()
-        except Exception as ex:
-            logger.error('Failed to capture view hierarchy', exc_info=ex)
-
+        # The error is captured first, repeats of the same failure don't need a new view hierarchy
         try:
             self.capture_error(test_filename, err)
         except Exception as ex:
             logger.error('Failed to capture error details', exc_info=ex)
 
+        skip_view = capture_policy is not None and capture_policy.record_failure(self)
+        self._capture_driver_artifacts(capture_policy, skip_view)
+
         try:
             self.capture_test_steps(testcase=test_func)
         except Exception as ex:
@@ -416,15 +474,15 @@ class TestCase(object):
         slice_range = slice(-55, -5)
         self.log = format_appium_log(self.driver_instance.get_log('server')[slice_range])
 
-    def add_attachment(self, file_path, attachment_type: AttachmentTypes):
+    def add_attachment(self, file_path, attachment_type: AttachmentTypes, streamed=False):
+        """Streamed attachments are uploaded by the caller while the test runs, not with the other ones"""
         logger.debug(f'Adding attachment {attachment_type}: {file_path}')
         path = Path(file_path)
         if not path.exists() or not path.is_file():
             raise TaukException(f'file not found {path}')
 
-        # Validate file size
-        size = os.path.getsize(path)
-        if size > 1 << 20:  # 10 MB
-            raise TaukException(f'attachment file size [{size}] cannot be greater than 10mb')
+        # Size limit is enforced on the compressed file when it is uploaded, see tauk.attachments
 
         self._attachments.append((file_path, attachment_type))
+        if streamed:
+            self.streamed_attachments.add(file_path)
@@ -1,4 +1,5 @@
 import logging
+import threading
 import time
 import typing
 from datetime import datetime, timezone
@@ -20,6 +21,7 @@ class TestData:
         self.timezone = tzlocal.get_localzone_name()
         self.dst = (time.localtime().tm_isdst != 0)
         self._test_suites: typing.List[TestSuite] = []
+        self._lock = threading.Lock()
 
     @property
     def test_suites(self):
@@ -32,17 +34,18 @@ class TestData:
         return None
 
     def add_test_case(self, filename: str, test_case: TestCase):
-        suite = self.get_test_suite(filename)
-        if suite is None:
-            suite = TestSuite(filename)
-            self._test_suites.append(suite)
+        with self._lock:
+            suite = self.get_test_suite(filename)
+            if suite is None:
+                suite = TestSuite(filename)
+                self._test_suites.append(suite)
 
         suite.add_testcase(test_case)
 
-    def delete_test_case(self, filename, test_method_name):
+    def delete_test_case(self, filename, test_case: TestCase):
         suite = self.get_test_suite(filename)
         if suite is None:
-            logger.warning(f'Failed to delete test case {filename}>{test_method_name}')
+            logger.warning(f'Failed to delete test case {filename}>{test_case.method_name}')
         else:
-            logger.debug(f'Deleting test case {filename}>{test_method_name}')
-            suite.remove_testcase(test_method_name)
+            logger.debug(f'Deleting test case {filename}>{test_case.method_name}')
+            suite.remove_testcase(test_case)
@@ -1,10 +1,10 @@
 import typing
 from threading import Lock
 
+from tauk.context.current_test import get_current_test
 from tauk.context.test_case import TestCase
 from tauk.exceptions import TaukException
 
-mutex = Lock()
 
 class TestSuite:
     def __init__(self, filename) -> None:
@@ -12,13 +12,18 @@ class TestSuite:
         self.name = None
         self.class_name = None
         self._test_cases: typing.List[TestCase] = []
+        self._lock = Lock()
 
-    def to_json(self):
+    def to_json(self, test_cases: typing.List[TestCase] = None):
+        """Serializes the suite with either the given or all of its test cases"""
+        if test_cases is None:
+            with self._lock:
+                test_cases = list(self._test_cases)
         json = {
             'filename': self.filename,
             'name': self.name,
             'class_name': self.class_name,
-            'test_cases': [test.to_json() for test in self.test_cases]
+            'test_cases': [test.to_json() for test in test_cases]
         }
         return {k: v for k, v in json.items() if v}
 
@@ -48,22 +53,25 @@ class TestSuite:
 
     @property
     def test_cases(self):
-        return self._test_cases
+        with self._lock:
+            return list(self._test_cases)
 
     def add_testcase(self, testcase: TestCase):
-        for test in self.test_cases:
-            if test.method_name == testcase.method_name:
-                raise TaukException('cannot use TaukListener and Observer() for the same test')
+        # The test started by a listener is current in this context, observing it as well would report it twice
+        current = get_current_test()
+        if current and current.filename == self.filename and current.test_case.method_name == testcase.method_name:
+            raise TaukException('cannot use TaukListener and Observer() for the same test')
+        # The same test may be running more than once at a time, Ex: parametrized tests run on a thread pool
+        with self._lock:
+            self._test_cases.append(testcase)
 
-        self.test_cases.append(testcase)
-
-    def remove_testcase(self, test_method_name):
-        with mutex:
-            # TODO: Make this implementation thread safe since we are rewriting test_cases
-            self.test_cases[:] = [t for t in self.test_cases if not t.method_name == test_method_name]
+    def remove_testcase(self, testcase: TestCase):
+        with self._lock:
+            self._test_cases[:] = [t for t in self._test_cases if t is not testcase]
 
     def get_test_case(self, test_name) -> TestCase:
-        for test in self.test_cases:
-            if test.custom_name == test_name or test.method_name == test_name:
-                return test
+        with self._lock:
+            for test in self._test_cases:
+                if test.custom_name == test_name or test.method_name == test_name:
+                    return test
         return None
@@ -0,0 +1,77 @@
+import logging
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger('tauk')
+
+# Network calls always get at least this long, so a nearly spent budget doesn't turn into instant failures
+MIN_TIMEOUT = 0.1
+
+_current_deadline: ContextVar['Deadline | None'] = ContextVar('tauk_report_deadline', default=None)
+
+
+class Deadline:
+    """Time budget for reporting a test, it only starts counting down once reporting begins"""
+
+    def __init__(self, budget=None, clock=time.monotonic) -> None:
+        self._budget = budget
+        self._clock = clock
+        self._started_at = None
+
+    @property
+    def budget(self):
+        return self._budget
+
+    def start(self):
+        if self._started_at is None:
+            self._started_at = self._clock()
+        return self
+
+    def remaining(self):
+        if self._budget is None or self._started_at is None:
+            return math.inf
+        return max(self._budget - (self._clock() - self._started_at), 0.0)
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def clamp(self, timeout):
+        """Shrink a requests style timeout, either a number or a (connect, read) tuple, to the remaining budget"""
+        remaining = self.remaining()
+        if remaining == math.inf:
+            return timeout
+        remaining = max(remaining, MIN_TIMEOUT)
+        if isinstance(timeout, tuple):
+            return tuple(min(t, remaining) if t is not None else remaining for t in timeout)
+        return min(timeout, remaining) if timeout is not None else remaining
+
+
+def get_current_deadline() -> Deadline | None:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline | None):
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def clamp_timeout(timeout):
+    deadline = _current_deadline.get()
+    return deadline.clamp(timeout) if deadline else timeout
+
+
+def is_budget_spent(step=None):
+    """Whether the reporting budget of the current test is spent, optional steps should be skipped then"""
+    deadline = _current_deadline.get()
+    if deadline is None or not deadline.expired:
+        return False
+    if step:
+        logger.debug(f'Reporting budget of {deadline.budget}s is spent, skipping {step}')
+    return True
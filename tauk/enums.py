@@ -19,6 +19,13 @@ class TestStatus(TaukEnum):
     EXCLUDED = 'excluded'
 
 
+@unique
+class ScreenshotModes(TaukEnum):
+    FULL = 'full'
+    THUMBNAIL = 'thumbnail'
+    NONE = 'none'
+
+
 @unique
 class BrowserNames(TaukEnum):
     CHROME = 'chrome'
@@ -77,6 +84,8 @@ class AttachmentTypes(TaukEnum):
     ASSISTANT_CONSOLE_LOGS = 'Runtime.consoleLogs'
     ASSISTANT_EXCEPTION_LOGS = 'Runtime.exceptionLogs'
     ASSISTANT_BROWSER_LOGS = 'Log.browserLogs'
+    NETWORK_HAR = 'Network.har'
+    SCREEN_RECORDING = 'Screen.recording'
 
     @classmethod
     def resolve_assistant_log(cls, name: str):
@@ -91,9 +100,14 @@ class AttachmentTypes(TaukEnum):
 
     @classmethod
     def is_assistant_attachment(cls, attachment_type):
-        if attachment_type in [AttachmentTypes.ASSISTANT_EXCEPTION_LOGS,
+        if attachment_type in [AttachmentTypes.ASSISTANT_CONSOLE_LOGS,
                                AttachmentTypes.ASSISTANT_EXCEPTION_LOGS,
                                AttachmentTypes.ASSISTANT_BROWSER_LOGS]:
             return True
 
         return False
+
+    @classmethod
+    def is_generated_attachment(cls, attachment_type):
+        """Attachments written by Tauk, which are deleted once uploaded"""
+        return cls.is_assistant_attachment(attachment_type) or attachment_type == AttachmentTypes.SCREEN_RECORDING
@@ -16,3 +16,8 @@ class TaukTestMethodNotFoundException(TaukException):
 class TaukInvalidTypeException(TaukException):
     def __init__(self, msg='') -> None:
         super().__init__(msg)
+
+
+class TaukCircuitOpenException(TaukException):
+    def __init__(self, msg='') -> None:
+        super().__init__(msg)
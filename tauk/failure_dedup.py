@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from tauk import metrics
+
+logger = logging.getLogger('tauk')
+
+
+def fingerprint_error(error):
+    """Identifies failures with the same cause, Ex: every test failing on the same broken fixture"""
+    if error is None:
+        return None
+    key = f'{error.error_type}\0{error.error_msg}\0{error.invoked_func}\0{error.line_number}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def hash_artifact(value):
+    return hashlib.sha1(value.encode()).hexdigest() if value else None
+
+
+class _Occurrence:
+    def __init__(self, first_seen) -> None:
+        self.first_seen = first_seen
+        self.count = 0
+        # Hashes of the artifacts reported by the first occurrence
+        self.artifacts = {}
+
+
+class FailureDeduplicator:
+    """Keeps track of identical failures so their repeated artifacts are referenced instead of uploaded again"""
+
+    def __init__(self, skip_view_after=None, window=300.0, max_fingerprints=1000, clock=time.monotonic) -> None:
+        self.skip_view_after = skip_view_after
+        self.window = window
+        self._max_fingerprints = max_fingerprints
+        self._clock = clock
+        self._occurrences: OrderedDict[str, _Occurrence] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_occurrence(self, fingerprint):
+        now = self._clock()
+        occurrence = self._occurrences.get(fingerprint)
+        if occurrence is None or now - occurrence.first_seen > self.window:
+            occurrence = self._occurrences[fingerprint] = _Occurrence(now)
+            while len(self._occurrences) > self._max_fingerprints:
+                self._occurrences.popitem(last=False)
+        self._occurrences.move_to_end(fingerprint)
+        return occurrence
+
+    def record_failure(self, fingerprint):
+        """Counts the failure, returns whether its view hierarchy should be skipped"""
+        with self._lock:
+            occurrence = self._get_occurrence(fingerprint)
+            occurrence.count += 1
+            skip_view = self.skip_view_after is not None and occurrence.count > self.skip_view_after
+        if skip_view:
+            logger.debug(f'Failure {fingerprint} happened {occurrence.count} times, skipping view hierarchy')
+            metrics.registry.increment('failure_dedup.views_skipped')
+        return skip_view
+
+    def dedup_artifacts(self, test_case, trim):
+        """Replaces artifacts identical to the ones of the first occurrence of the failure with references. Returns the
+        hashes of the artifacts of a first occurrence, to be remembered once they are certain to be uploaded"""
+        first_artifacts = {}
+        with self._lock:
+            occurrence = self._get_occurrence(test_case.fingerprint)
+            refs = {}
+            for field in ['screenshot', 'view']:
+                value = getattr(test_case, field)
+                first_hash = occurrence.artifacts.get(field)
+                if value is None:
+                    # Skipped because the failure kept repeating, the first occurrence has the closest match
+                    if first_hash and field == 'view':
+                        refs[field] = first_hash
+                    continue
+                value_hash = hash_artifact(value)
+                if first_hash is None:
+                    first_artifacts[field] = value_hash
+                elif first_hash == value_hash:
+                    trim(field, lambda f=field: setattr(test_case, f, None))
+                    refs[field] = value_hash
+
+        if refs:
+            metrics.registry.increment('failure_dedup.duplicates')
+            test_case.artifact_refs = refs
+        return first_artifacts
+
+    def remember_artifacts(self, test_case, first_artifacts):
+        """Called once the payload of the test is final, artifacts dropped or shrunk since then were never uploaded"""
+        with self._lock:
+            occurrence = self._get_occurrence(test_case.fingerprint)
+            for field, value_hash in first_artifacts.items():
+                if occurrence.artifacts.get(field) is None and hash_artifact(getattr(test_case, field)) == value_hash:
+                    occurrence.artifacts[field] = value_hash
@@ -0,0 +1,72 @@
+import http.client
+import io
+import os
+import ssl
+import urllib.parse
+
+import requests.certs
+
+
+def is_file_body(data):
+    """Whether the request body is a file which can be sent with sendfile"""
+    if data is None or isinstance(data, (bytes, bytearray, str, dict)):
+        return False
+    try:
+        data.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+class FileUploadResponse:
+    def __init__(self, status, reason, headers, body: bytes) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+def _ssl_context(verify):
+    """Verifies the server like requests does, verify being a bool or the path of a CA bundle file or directory"""
+    if verify is None or verify is True:
+        # Same environment variables as requests
+        verify = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE') or requests.certs.where()
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+    if os.path.isdir(verify):
+        return ssl.create_default_context(capath=verify)
+    return ssl.create_default_context(cafile=verify)
+
+
+def send_file(method, url, headers, file, timeout, verify=None):
+    """Sends the file as the request body with socket.sendfile, so the kernel copies it to the socket directly
+    instead of it being read in chunks into Python buffers. TLS sockets fall back to plain sends.
+    verify is the requests option, without it the CA bundle is taken from the environment like requests does.
+
+    Raises TimeoutError, OSError or http.client.HTTPException like the sockets do"""
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    parsed = urllib.parse.urlsplit(url)
+    path = f'{parsed.path}?{parsed.query}' if parsed.query else parsed.path
+    if parsed.scheme == 'https':
+        connection = http.client.HTTPSConnection(parsed.netloc, timeout=connect_timeout, context=_ssl_context(verify))
+    else:
+        connection = http.client.HTTPConnection(parsed.netloc, timeout=connect_timeout)
+
+    size = os.fstat(file.fileno()).st_size
+    try:
+        connection.putrequest(method, path, skip_accept_encoding=True)
+        for name, value in {**headers, 'Content-Length': str(size)}.items():
+            connection.putheader(name, value)
+        connection.endheaders()
+        connection.sock.settimeout(read_timeout)
+        # Retries send the file again from its start
+        sent = connection.sock.sendfile(file, 0, size)
+        if sent != size:
+            raise ConnectionError(f'sent {sent} of {size} bytes')
+        response = connection.getresponse()
+        return FileUploadResponse(response.status, response.reason, response.headers, response.read())
+    finally:
+        connection.close()
@@ -0,0 +1,273 @@
+"""pytest plugin reporting tests to Tauk, enabled with `--tauk`, the `tauk = true` ini option or TAUK_PYTEST=true
+
+Test results are collected in the process running the test (the xdist worker if any) without any frame
+inspection, attached to the test report and uploaded in batches by the controller process, which then uploads the
+attachments of the tests. Screen recordings and browser logs of the assistant are not captured.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+import jsonpickle
+import pytest
+
+from tauk.deadline import Deadline, deadline_scope, is_budget_spent
+from tauk.enums import AttachmentTypes
+from tauk.exceptions import TaukException
+from tauk.run_summary import summary_row
+from tauk.utils import upload_attachments
+
+logger = logging.getLogger('tauk')
+
+_TEST_CASE_ATTR = '_tauk_test_case'
+_DEADLINE_ATTR = '_tauk_report_deadline'
+
+
+def _now():
+    return int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+
+
+def _is_enabled(config):
+    return config.getoption('tauk') or config.getini('tauk') or os.getenv('TAUK_PYTEST', '').lower() == 'true'
+
+
+def _is_xdist_worker(config):
+    return hasattr(config, 'workerinput')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('tauk')
+    group.addoption('--tauk', action='store_true', default=False, dest='tauk', help='report test results to Tauk')
+    group.addoption('--tauk-batch-size', type=int, default=20, dest='tauk_batch_size',
+                    help='number of test results uploaded to Tauk in a single request')
+    parser.addini('tauk', type='bool', default=False, help='report test results to Tauk')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'tauk(custom_name=None, excluded=False): customize Tauk reporting of a test')
+    if not _is_enabled(config):
+        return
+
+    config.pluginmanager.register(TaukCollector(config), 'tauk-collector')
+    if not _is_xdist_worker(config):
+        config.pluginmanager.register(TaukReporter(config), 'tauk-reporter')
+
+
+class TaukTest:
+    """Handle to the Tauk test case of the running test, available through the `tauk` fixture"""
+
+    def __init__(self, test_case) -> None:
+        self._test_case = test_case
+
+    @property
+    def test_case(self):
+        return self._test_case
+
+    def register_driver(self, driver):
+        # Without the assistant, which xdist workers don't have, browser logs aren't captured
+        self._test_case.register_driver(driver)
+
+    def add_attachment(self, file_path, attachment_type: AttachmentTypes):
+        """Uploaded by the controller process once the results of the test are uploaded"""
+        self._test_case.add_attachment(file_path, attachment_type)
+
+    def add_user_data(self, name, value):
+        self._test_case.add_user_data(name, value)
+
+
+@pytest.fixture
+def tauk(request):
+    test_case = getattr(request.node, _TEST_CASE_ATTR, None)
+    if test_case is None:
+        pytest.skip('Tauk reporting is not enabled, run pytest with --tauk')
+    return TaukTest(test_case)
+
+
+class TaukCollector:
+    """Builds the Tauk test case in the process that runs the test and attaches it to the teardown report"""
+
+    def __init__(self, config) -> None:
+        from tauk.capture_policy import CapturePolicy
+        from tauk.config import get_report_budget_from_env
+
+        self._root_dir = str(config.invocation_params.dir)
+        self._report_budget = get_report_budget_from_env()
+        # Workers don't initialize Tauk, so the policy can only be configured through the environment
+        self._capture_policy = CapturePolicy.from_env()
+        # Tests whose artifacts may be referenced once they are uploaded. xdist workers never learn whether their
+        # tests were uploaded, so their tests never reference artifacts of earlier ones
+        self._uploading = {}
+        self._remember_uploads = not _is_xdist_worker(config)
+
+    def _filename(self, item):
+        return os.path.relpath(str(item.path), self._root_dir)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item):
+        from tauk.context.test_case import TestCase
+
+        marker = item.get_closest_marker('tauk')
+        test_case = TestCase()
+        test_case.method_name = item.name
+        test_case.custom_name = marker.kwargs.get('custom_name') if marker else None
+        test_case.excluded = marker.kwargs.get('excluded', False) if marker else False
+        test_case.start_timestamp = _now()
+        setattr(item, _TEST_CASE_ATTR, test_case)
+        setattr(item, _DEADLINE_ATTR, Deadline(self._report_budget))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        test_case = getattr(item, _TEST_CASE_ATTR, None)
+        if test_case is None:
+            return
+
+        deadline = getattr(item, _DEADLINE_ATTR)
+        with deadline_scope(deadline):
+            self._capture(item, call, report, test_case, deadline)
+
+    def _capture(self, item, call, report, test_case, deadline):
+        from tauk.enums import TestStatus
+
+        if report.skipped and report.when in ['setup', 'call']:
+            test_case.excluded = True
+        elif report.failed and report.when in ['setup', 'call'] and call.excinfo is not None:
+            test_case.end_timestamp = _now()
+            deadline.start()
+            test_func = getattr(item, 'function', None)
+            err = (call.excinfo.type, call.excinfo.value, call.excinfo.tb)
+            test_case.capture_failure_data(self._filename(item), err, test_func, self._capture_policy)
+        elif report.passed and report.when == 'call':
+            test_case.end_timestamp = _now()
+            deadline.start()
+            test_case.capture_success_data(self._capture_policy)
+        elif report.when == 'teardown':
+            if test_case.status is None and not test_case.excluded:
+                logger.debug(f'[pytest] No result was captured for {item.nodeid}')
+                return
+            if not test_case.end_timestamp:
+                test_case.end_timestamp = _now()
+            deadline.start()
+            # A test which passed but whose teardown failed is reported as failed, with the teardown error
+            if report.failed and call.excinfo is not None and not test_case.excluded and \
+                    test_case.status is not TestStatus.FAILED:
+                err = (call.excinfo.type, call.excinfo.value, call.excinfo.tb)
+                test_case.capture_failure_data(self._filename(item), err, getattr(item, 'function', None),
+                                               self._capture_policy)
+            self._capture_appium_logs(test_case)
+            # Only builtin types survive the trip from xdist workers to the controller
+            report.tauk_filename = self._filename(item)
+            report.tauk_class_name = item.cls.__name__ if getattr(item, 'cls', None) else None
+            self._capture_policy.apply(test_case)
+            report.tauk_test = jsonpickle.encode(test_case.to_json(), unpicklable=False)
+            report.tauk_step_durations = dict(test_case.step_durations)
+            report.tauk_attachments = [(file_path, attachment_type.value)
+                                       for file_path, attachment_type in test_case.attachments]
+            if self._remember_uploads and test_case.artifact_candidates:
+                self._uploading[item.nodeid] = test_case
+            delattr(item, _TEST_CASE_ATTR)
+
+    def remember_uploaded(self, nodeid, test_id):
+        test_case = self._uploading.pop(nodeid, None)
+        if test_case is not None:
+            test_case.id = test_id
+            self._capture_policy.remember_uploaded(test_case)
+
+    @staticmethod
+    def _capture_appium_logs(test_case):
+        from tauk.enums import AutomationTypes
+
+        if test_case.automation_type is AutomationTypes.APPIUM and not is_budget_spent('appium logs capture'):
+            try:
+                test_case.capture_appium_logs()
+            except Exception as ex:
+                logger.error('Failed to capture appium server logs', exc_info=ex)
+
+
+class TaukReporter:
+    """Uploads the results of all the tests of the session, including xdist workers, in batches"""
+
+    def __init__(self, config) -> None:
+        from tauk.config import TaukConfig
+        from tauk.tauk_webdriver import Tauk
+
+        if not Tauk.is_initialized():
+            Tauk(TaukConfig())
+        self._context = Tauk.get_context()
+        self._api = self._context.api
+        self._batch_size = max(config.getoption('tauk_batch_size'), 1)
+        self._pending = {}
+        self._pending_count = 0
+        # (nodeid, filename, method name, attachments) of the pending tests, to find their ids in the upload result
+        self._pending_tests = []
+        self._collector = config.pluginmanager.get_plugin('tauk-collector')
+
+    def pytest_runtest_logreport(self, report):
+        tauk_test = getattr(report, 'tauk_test', None)
+        if report.when != 'teardown' or not tauk_test:
+            return
+
+        suite_key = (report.tauk_filename, getattr(report, 'tauk_class_name', None))
+        test_json = json.loads(tauk_test)
+        self._pending.setdefault(suite_key, []).append(test_json)
+        self._pending_tests.append((report.nodeid, report.tauk_filename, test_json.get('method_name'),
+                                    getattr(report, 'tauk_attachments', None)))
+        if self._context.run_summary is not None:
+            self._record_run_summary(report, test_json, len(tauk_test))
+        self._pending_count += 1
+        if self._pending_count >= self._batch_size:
+            self.flush()
+
+    def _record_run_summary(self, report, test_json, payload_size):
+        try:
+            self._context.run_summary.record(summary_row(test_json, report.tauk_filename,
+                                                         getattr(self._context, 'run_id', None), payload_size,
+                                                         getattr(report, 'tauk_step_durations', None)))
+        except Exception as ex:
+            logger.error(f'[pytest] Failed to record the run summary of {report.nodeid}', exc_info=ex)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self, session):
+        self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        test_suites = []
+        for (filename, class_name), test_cases in self._pending.items():
+            suite = {'filename': filename, 'test_cases': test_cases}
+            if class_name:
+                suite['class_name'] = class_name
+            test_suites.append(suite)
+        count = self._pending_count
+        pending_tests = self._pending_tests
+        self._pending = {}
+        self._pending_count = 0
+        self._pending_tests = []
+        result = {}
+        try:
+            logger.debug(f'[pytest] Uploading {count} test results')
+            result = self._api.upload(jsonpickle.encode({'test_suites': test_suites}, unpicklable=False)) or {}
+        except Exception as ex:
+            logger.error(f'Failed to upload {count} test results', exc_info=ex)
+        for nodeid, filename, method_name, attachments in pending_tests:
+            test_id = result.get(filename, {}).get(method_name)
+            self._collector.remember_uploaded(nodeid, test_id)
+            if attachments:
+                self._upload_attachments(test_id, method_name, attachments)
+
+    def _upload_attachments(self, test_id, method_name, attachments):
+        from tauk.context.test_case import TestCase
+
+        test_case = TestCase()
+        test_case.id = test_id
+        test_case.method_name = method_name
+        for file_path, attachment_type in attachments:
+            try:
+                test_case.add_attachment(file_path, AttachmentTypes(attachment_type))
+            except TaukException as ex:
+                logger.error(f'[pytest] Failed to attach {file_path} to the test {method_name}', exc_info=ex)
+        upload_attachments(self._api, test_case)
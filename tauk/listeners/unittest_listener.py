@@ -7,10 +7,10 @@ import unittest
 from datetime import datetime, timezone
 from typing import Dict
 from tauk.config import TaukConfig
+from tauk.context.current_test import enter_test, exit_test
 from tauk.context.test_case import TestCase
-from tauk.enums import TestStatus, AutomationTypes
+from tauk.deadline import Deadline, deadline_scope
 from tauk.tauk_webdriver import Tauk
-from tauk.utils import attach_assistant_artifacts, upload_attachments
 
 logger = logging.getLogger('tauk')
 
@@ -21,8 +21,11 @@ def _should_observe(test: unittest.case.TestCase):
 
 class TaukListener(unittest.TestResult):
     def __init__(self, stream, descriptions, verbosity):
+        # Keyed by test id, tests may be started and stopped concurrently from several threads
         self.tests: Dict[str, TestCase] = {}
-        self.test_filename = None
+        self.deadlines: Dict[str, Deadline] = {}
+        self.test_filenames: Dict[str, str] = {}
+        self._test_tokens = {}
         super().__init__(stream, descriptions, verbosity)
 
     def startTestRun(self) -> None:
@@ -50,7 +53,7 @@ class TaukListener(unittest.TestResult):
 
         logger.info(f'# Test Started [{test.id()}] ---')
         caller_filename = inspect.getfile(test.__class__)
-        self.test_filename = os.path.relpath(caller_filename, ctx.project_root_dir)
+        test_filename = os.path.relpath(caller_filename, ctx.project_root_dir)
         test_method_name = test.id().split('.')[-1]
 
         test_case = TestCase()
@@ -58,8 +61,11 @@ class TaukListener(unittest.TestResult):
         test_case.start_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
         test_case.custom_name = test.shortDescription()
 
-        ctx.test_data.add_test_case(self.test_filename, test_case)
+        ctx.start_test(test_filename, test_case)
         self.tests[test.id()] = test_case
+        self.test_filenames[test.id()] = test_filename
+        self.deadlines[test.id()] = ctx.new_report_deadline()
+        self._test_tokens[test.id()] = enter_test(test_filename, test_case)
 
         super().startTest(test)
 
@@ -70,32 +76,17 @@ class TaukListener(unittest.TestResult):
             return
 
         logger.info(f'# Test Stopped [{test.id()}] ---')
-        ctx = Tauk.get_context()
-        try:
-            test_case = self.tests[test.id()]
-            test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-
-            if test_case.automation_type is AutomationTypes.APPIUM:  # Capture Appium logs
-                try:
-                    test_case.capture_appium_logs()
-                except Exception as ex:
-                    logger.error('Failed to capture appium server logs', exc_info=ex)
-
-            upload_result = ctx.api.upload(ctx.get_json_test_data(self.test_filename, test_case.method_name))
-            test_case.id = upload_result.get(self.test_filename).get(test_case.method_name)
-
-            # Attach assistant artifacts
+        test_case = self.tests.pop(test.id())
+        test_filename = self.test_filenames.pop(test.id())
+        test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+        deadline = self.deadlines.pop(test.id()).start()
+        with deadline_scope(deadline):
             try:
-                attach_assistant_artifacts(ctx.assistant, test_case)
-            except Exception as e:
-                logger.error('Failed to attach assistant artifacts', exc_info=e)
-            # Upload attachments
-            upload_attachments(ctx.api, test_case)
-        except Exception as ex:
-            logger.error(f'Failed to update test results for the test {test.id()}', exc_info=ex)
-        finally:
-            ctx.test_data.delete_test_case(self.test_filename, self.tests[test.id()].method_name)
-            del self.tests[test.id()]
+                Tauk._report_test_case(test_case, test_filename)
+            except Exception as ex:
+                logger.error(f'Failed to update test results for the test {test.id()}', exc_info=ex)
+            finally:
+                exit_test(self._test_tokens.pop(test.id()))
 
     def addError(self, test: unittest.case.TestCase, err: tuple) -> None:
         super().addError(test, err)
@@ -107,7 +98,9 @@ class TaukListener(unittest.TestResult):
         test_case = self.tests[test.id()]
         traceback.print_exception(*err)
         test_func = getattr(test, test_case.method_name)
-        test_case.capture_failure_data(self.test_filename, err, test_func)
+        with deadline_scope(self.deadlines[test.id()].start()):
+            test_case.capture_failure_data(self.test_filenames[test.id()], err, test_func,
+                                            Tauk.get_context().capture_policy)
 
     def addFailure(self, test: unittest.case.TestCase, err: tuple) -> None:
         super().addFailure(test, err)
@@ -119,7 +112,9 @@ class TaukListener(unittest.TestResult):
         test_case = self.tests[test.id()]
         traceback.print_exception(*err)
         test_func = getattr(test, test_case.method_name)
-        test_case.capture_failure_data(self.test_filename, err, test_func)
+        with deadline_scope(self.deadlines[test.id()].start()):
+            test_case.capture_failure_data(self.test_filenames[test.id()], err, test_func,
+                                            Tauk.get_context().capture_policy)
 
     def addSuccess(self, test: unittest.case.TestCase) -> None:
         super().addSuccess(test)
@@ -128,7 +123,8 @@ class TaukListener(unittest.TestResult):
             return
 
         logger.info(f'# Test Passed [{test.id()}] ---')
-        self.tests[test.id()].capture_success_data()
+        with deadline_scope(self.deadlines[test.id()].start()):
+            self.tests[test.id()].capture_success_data(Tauk.get_context().capture_policy)
 
     def addSkip(self, test: unittest.case.TestCase, reason: str) -> None:
         super().addSkip(test, reason)
@@ -2,14 +2,13 @@ from datetime import datetime, timezone
 
 from pythonjsonlogger import jsonlogger
 
+from tauk.context.current_test import get_current_test
+
 
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
 
     def __init__(self, *args, **kwargs):
-        # Check and store context so that we can extract the test method name
-        if kwargs.get('tauk_context'):
-            self.ctx = kwargs.get('tauk_context')
-            kwargs.pop('tauk_context')
+        self.ctx = kwargs.pop('tauk_context', None)
 
         super().__init__(*args, **kwargs)
 
@@ -23,12 +22,8 @@ class CustomJsonFormatter(jsonlogger.JsonFormatter):
         else:
             log_record['level'] = record.levelname
 
-        if self.ctx and self.ctx.test_data:
-            # Iterate and find the suite with one testcase in it because
-            # testcase gets cleand up after its over but suites does not
-            # TODO: Make this implementation thread safe
-            for suite in self.ctx.test_data.test_suites:
-                if len(suite.test_cases) == 1:
-                    log_record['suite'] = suite.filename
-                    log_record['test'] = suite.test_cases[0].method_name
-                    break
+        # Logs are attributed to the test running in the thread or task which logged them
+        current = get_current_test()
+        if current:
+            log_record['suite'] = current.filename
+            log_record['test'] = current.test_case.method_name
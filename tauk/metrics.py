@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger('tauk')
+
+# Upper bounds of the histogram buckets in milliseconds, anything slower goes into the last bucket
+BUCKET_BOUNDS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+
+class ActionStats:
+    __slots__ = ('count', 'total_ns', 'min_ns', 'max_ns', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+
+    def record(self, elapsed_ns):
+        if self.count == 0 or elapsed_ns < self.min_ns:
+            self.min_ns = elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.count += 1
+        self.total_ns += elapsed_ns
+
+        elapsed_ms = elapsed_ns / 1e6
+        for i, bound in enumerate(BUCKET_BOUNDS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket containing the percentile, in milliseconds"""
+        threshold = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= threshold:
+                return BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max_ns / 1e6
+        return 0
+
+    def to_json(self):
+        histogram = {f'<={bound}ms': count for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets) if count}
+        if self.buckets[-1]:
+            histogram[f'>{BUCKET_BOUNDS_MS[-1]}ms'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'total_ms': self.total_ns / 1e6,
+            'mean_ms': self.total_ns / self.count / 1e6 if self.count else 0,
+            'min_ms': self.min_ns / 1e6,
+            'max_ms': self.max_ns / 1e6,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'histogram': histogram,
+        }
+
+
+class MetricsRegistry:
+    """Per action timings of the work done by tauk, recording is a no-op unless enabled"""
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._actions: dict[str, ActionStats] = {}
+        self._counters: dict[str, int] = {}
+
+    def record(self, action, elapsed_ns):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._actions.get(action)
+            if stats is None:
+                stats = self._actions[action] = ActionStats()
+            stats.record(elapsed_ns)
+
+    def increment(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'actions': {action: stats.to_json() for action, stats in self._actions.items()},
+                'counters': dict(self._counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._actions.clear()
+            self._counters.clear()
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump({'pid': os.getpid(), **self.snapshot()}, file, indent=2)
+        logger.debug(f'Dumped tauk metrics to {path}')
+
+
+registry = MetricsRegistry()
+
+
+def timed(action_name=None):
+    def inner_decorator(func):
+        action = action_name if action_name else func.__name__
+
+        @wraps(func)
+        def timer(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            t1 = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.record(action, time.perf_counter_ns() - t1)
+
+        return timer
+
+    return inner_decorator
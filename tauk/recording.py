@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from tauk import metrics
+
+logger = logging.getLogger('tauk')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Segments are rotated so a long test keeps the frames leading up to its end instead of its first minutes
+FRAMES_PER_SEGMENT = 300
+# Sampling stops after this many screenshots failed in a row, Ex: the driver was quit
+MAX_CONSECUTIVE_ERRORS = 3
+
+
+def _chunk(chunk_type: bytes, data: bytes):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def read_png_chunks(png: bytes):
+    if not png.startswith(PNG_SIGNATURE):
+        raise ValueError('not a PNG image')
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(png):
+        length, chunk_type = struct.unpack_from('>I4s', png, offset)
+        yield chunk_type, png[offset + 8:offset + 8 + length]
+        offset += 12 + length
+
+
+class ApngWriter:
+    """Writes PNG frames into an animated PNG as they come, without holding them in memory.
+
+    The duration of a frame is only known once the next one arrives, so its frame control chunk is rewritten then"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.frames = 0
+        self._file = open(path, 'w+b')
+        self._header = None
+        self._palette = None
+        self._sequence = 0
+        self._actl_offset = None
+        self._last_fctl_offset = None
+        self._last_fctl = None
+
+    def add_frame(self, png: bytes):
+        """Appends the frame, returns False if it doesn't match the format of the first frame"""
+        header, palette, data = None, None, []
+        for chunk_type, chunk_data in read_png_chunks(png):
+            if chunk_type == b'IHDR':
+                header = chunk_data
+            elif chunk_type == b'PLTE':
+                palette = chunk_data
+            elif chunk_type == b'IDAT':
+                data.append(chunk_data)
+        if header is None or not data:
+            raise ValueError('PNG image without header or data')
+
+        if self._header is None:
+            self._header = header
+            self._palette = palette
+            self._file.write(PNG_SIGNATURE + _chunk(b'IHDR', header))
+            self._actl_offset = self._file.tell()
+            # Frame count is filled in by close()
+            self._file.write(_chunk(b'acTL', struct.pack('>II', 0, 0)))
+            if palette is not None:
+                self._file.write(_chunk(b'PLTE', palette))
+        elif header != self._header or palette != self._palette:
+            return False
+
+        width, height = struct.unpack_from('>II', header)
+        self._last_fctl_offset = self._file.tell()
+        self._last_fctl = [self._next_sequence(), width, height, 0, 0, 0, 1000, 0, 0]
+        self._file.write(_chunk(b'fcTL', struct.pack('>IIIIIHHBB', *self._last_fctl)))
+        if self.frames == 0:
+            self._file.write(_chunk(b'IDAT', b''.join(data)))
+        else:
+            self._file.write(_chunk(b'fdAT', struct.pack('>I', self._next_sequence()) + b''.join(data)))
+        self.frames += 1
+        return True
+
+    def set_last_frame_duration(self, seconds):
+        if self._last_fctl is None:
+            return
+        self._last_fctl[5] = max(1, min(int(seconds * 1000), 0xFFFF))
+        self._rewrite(self._last_fctl_offset, _chunk(b'fcTL', struct.pack('>IIIIIHHBB', *self._last_fctl)))
+
+    def _next_sequence(self):
+        sequence = self._sequence
+        self._sequence += 1
+        return sequence
+
+    def _rewrite(self, offset, data):
+        end = self._file.tell()
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.seek(end)
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.frames:
+            self._file.write(_chunk(b'IEND', b''))
+            self._rewrite(self._actl_offset, _chunk(b'acTL', struct.pack('>II', self.frames, 0)))
+        self._file.close()
+        self._file = None
+
+
+class ScreenRecorder:
+    """Samples screenshots of the driver on a background thread and writes them as animated PNG segments.
+
+    A screenshot identical to the previous one only extends how long that frame is shown"""
+
+    def __init__(self, driver, output_dir, name, fps=1.0, frames_per_segment=FRAMES_PER_SEGMENT,
+                 clock=time.monotonic) -> None:
+        self._driver = driver
+        self._output_dir = output_dir
+        self._name = name
+        self._interval = 1 / fps
+        self._frames_per_segment = frames_per_segment
+        self._clock = clock
+        self._segments = []
+        self._segment_index = 0
+        self._writer: ApngWriter | None = None
+        self._last_hash = None
+        self._last_frame_at = None
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.frames = 0
+        self.skipped_frames = 0
+
+    def start(self):
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name=f'ScreenRecorder-{self._name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        errors = 0
+        while not self._stop_event.is_set():
+            started = self._clock()
+            try:
+                self.capture_frame()
+                errors = 0
+            except Exception as ex:
+                errors += 1
+                if errors >= MAX_CONSECUTIVE_ERRORS:
+                    logger.debug(f'Stopping screen recording {self._name} after repeated failures', exc_info=ex)
+                    return
+            self._stop_event.wait(max(self._interval - (self._clock() - started), 0))
+
+    def capture_frame(self):
+        png = self._driver.get_screenshot_as_png()
+        now = self._clock()
+        frame_hash = hashlib.sha1(png).digest()
+        if frame_hash == self._last_hash:
+            self.skipped_frames += 1
+            metrics.registry.increment('screen_recording.frames_skipped')
+            return
+
+        if self._writer is not None:
+            self._writer.set_last_frame_duration(now - self._last_frame_at)
+        if self._writer is None or self._writer.frames >= self._frames_per_segment:
+            self._rotate_segment()
+        if not self._writer.add_frame(png):
+            # Ex: the window was resized, the animation can only hold frames of the same size
+            self._rotate_segment()
+            self._writer.add_frame(png)
+        self._last_hash = frame_hash
+        self._last_frame_at = now
+        self.frames += 1
+        metrics.registry.increment('screen_recording.frames')
+
+    def _close_segment(self):
+        self._writer.close()
+        if self._writer.frames == 0:
+            self._segments.remove(self._writer.path)
+            os.remove(self._writer.path)
+        self._writer = None
+
+    def _rotate_segment(self):
+        if self._writer is not None:
+            self._close_segment()
+        if len(self._segments) >= 2:
+            os.remove(self._segments.pop(0))
+        self._segment_index += 1
+        path = os.path.join(self._output_dir, f'{self._name}-{self._segment_index}.png')
+        self._segments.append(path)
+        self._writer = ApngWriter(path)
+
+    def stop(self, timeout=10):
+        """Stops sampling, returns the paths of the recorded segments in order"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f'Screen recording {self._name} did not stop within {timeout} seconds')
+                return []
+        if self._writer is not None:
+            if self._last_frame_at is not None:
+                self._writer.set_last_frame_duration(self._clock() - self._last_frame_at)
+            self._close_segment()
+        return list(self._segments)
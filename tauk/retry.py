@@ -0,0 +1,264 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+from tauk.deadline import get_current_deadline
+from tauk.exceptions import TaukCircuitOpenException
+
+logger = logging.getLogger('tauk')
+
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait according to a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at - (now if now is not None else time.time()), 0.0)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, a Retry-After longer than `max_delay` is not worth waiting for"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=10.0, max_elapsed=60.0, rand=None) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # No retry is started once a call has been running for this long, bounds the time a test is held up
+        self.max_elapsed = max_elapsed
+        self._random = rand if rand else random.Random()
+
+    def is_retryable(self, status_code):
+        return status_code in RETRYABLE_STATUS_CODES
+
+    def get_delay(self, attempt, retry_after=None, elapsed=0.0):
+        """Delay before the retry following the given 1-based attempt, None if it should not be retried"""
+        if retry_after is not None:
+            delay = retry_after if retry_after <= self.max_delay else None
+        else:
+            delay = self._random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if delay is None or elapsed + delay > self.max_elapsed:
+            return None
+        return delay
+
+
+class RetryBudget:
+    """Run-wide cap on retries, every request earns `ratio` of a retry so retries can't multiply the load"""
+
+    def __init__(self, min_retries=10, ratio=0.2, max_tokens=50) -> None:
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._tokens = float(min_retries)
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def on_request(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self._ratio, self._max_tokens)
+
+    def try_withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Stops calling the backend after `failure_threshold` consecutive failures for `reset_timeout` seconds,
+    then lets a single trial request through to decide whether to close again"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == CircuitBreaker.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+                return CircuitBreaker.HALF_OPEN
+            return self._state
+
+    @property
+    def is_open(self):
+        return self.state == CircuitBreaker.OPEN
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == CircuitBreaker.CLOSED:
+                return True
+            if self._state == CircuitBreaker.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+                self._state = CircuitBreaker.HALF_OPEN
+                return True
+            # Only a single trial request is allowed while half open
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CircuitBreaker.CLOSED:
+                logger.info('Tauk API recovered, closing circuit breaker')
+            self._state = CircuitBreaker.CLOSED
+            self._failures = 0
+
+    def record_inconclusive(self):
+        """For requests which failed for reasons unrelated to the backend, Ex: a timeout cut short by the caller"""
+        with self._lock:
+            if self._state == CircuitBreaker.HALF_OPEN:
+                # Give the trial slot back, the next request will try again
+                self._state = CircuitBreaker.OPEN
+                self._opened_at = self._clock() - self._reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == CircuitBreaker.HALF_OPEN or self._failures >= self._failure_threshold:
+                if self._state != CircuitBreaker.OPEN:
+                    logger.warning(f'Tauk API is failing, pausing requests for {self._reset_timeout} seconds')
+                self._state = CircuitBreaker.OPEN
+                self._opened_at = self._clock()
+
+
+class ResultSpool:
+    """Test results which could not be uploaded while the backend was down, spooled per run outside of the
+    execution dir so they survive it being deleted"""
+
+    SUFFIX = '.json.gz'
+
+    def __init__(self, spool_dir) -> None:
+        self.spool_dir = spool_dir
+        # Unknown until the spool is listed once, after that uploads don't list it unless something was spooled
+        self._has_results = None
+
+    def run_dir(self, run_id):
+        return os.path.join(self.spool_dir, run_id)
+
+    def write(self, run_id, data: bytes):
+        run_dir = self.run_dir(run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        file_path = os.path.join(run_dir, f'{time.time_ns()}-{os.getpid()}{ResultSpool.SUFFIX}')
+        with open(f'{file_path}.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(f'{file_path}.tmp', file_path)
+        self._has_results = True
+        logger.warning(f'Tauk API is unavailable, spooled test results to {file_path}')
+
+    def has_results(self, run_id):
+        if self._has_results is None:
+            run_dir = self.run_dir(run_id)
+            self._has_results = os.path.isdir(run_dir) and \
+                any(name.endswith(ResultSpool.SUFFIX) for name in os.listdir(run_dir))
+        return self._has_results
+
+    def take(self, run_id):
+        """Names of the results spooled for the run, oldest first. Results which are not sent must be put back"""
+        if not self.has_results(run_id):
+            return []
+        # Cleared before listing, so results spooled while these are sent aren't forgotten
+        self._has_results = False
+        return sorted(name for name in os.listdir(self.run_dir(run_id)) if name.endswith(ResultSpool.SUFFIX))
+
+    def claim(self, run_id, name):
+        """Path of the claimed results, None if another process of a multiprocess run claimed them first"""
+        claimed_path = os.path.join(self.run_dir(run_id), f'{name}.sending')
+        try:
+            os.rename(os.path.join(self.run_dir(run_id), name), claimed_path)
+        except FileNotFoundError:
+            return None
+        return claimed_path
+
+    def put_back(self, run_id, name):
+        os.rename(os.path.join(self.run_dir(run_id), f'{name}.sending'), os.path.join(self.run_dir(run_id), name))
+        self._has_results = True
+
+    def remove_if_empty(self, run_id):
+        run_dir = self.run_dir(run_id)
+        if os.path.isdir(run_dir) and not os.listdir(run_dir):
+            os.rmdir(run_dir)
+
+
+class RetryingApi:
+    """Retry, circuit breaker and spool decisions shared by TaukApi and AsyncTaukApi, which only differ in how
+    requests are sent"""
+
+    def __init__(self, retry_policy: RetryPolicy = None, retry_budget: RetryBudget = None,
+                 circuit_breaker: CircuitBreaker = None) -> None:
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self.retry_budget = retry_budget if retry_budget else RetryBudget()
+        self.circuit_breaker = circuit_breaker if circuit_breaker else CircuitBreaker()
+        # Test results which could not be uploaded while the backend was down are written here when set
+        self.spool: ResultSpool | None = None
+
+    def _start_request(self):
+        self.retry_budget.on_request()
+        return time.monotonic()
+
+    def _check_circuit(self, method, url):
+        if not self.circuit_breaker.allow_request():
+            raise TaukCircuitOpenException(f'skipped {method} {url} because Tauk API is unavailable')
+
+    def _should_retry(self, attempt, delay):
+        if delay is None or attempt >= self.retry_policy.max_attempts or self.circuit_breaker.is_open:
+            return False
+        # Don't wait for a retry which can't finish within the reporting budget of the test
+        deadline = get_current_deadline()
+        if deadline and delay >= deadline.remaining():
+            return False
+        return self.retry_budget.try_withdraw()
+
+    def _retry_delay_after_error(self, attempt, started, cut_short):
+        """Delay before retrying a request which failed to connect or timed out, None if it should be given up"""
+        if cut_short:
+            # The reporting budget of the test ran out, that says nothing about the health of the backend
+            self.circuit_breaker.record_inconclusive()
+            return None
+        self.circuit_breaker.record_failure()
+        delay = self.retry_policy.get_delay(attempt, elapsed=time.monotonic() - started)
+        return delay if self._should_retry(attempt, delay) else None
+
+    def _retry_delay_after_response(self, attempt, started, status, retry_after):
+        """Delay before retrying a request answered with the given status, None if the response is final"""
+        if not self.retry_policy.is_retryable(status):
+            self.circuit_breaker.record_success()
+            return None
+        self.circuit_breaker.record_failure()
+        delay = self.retry_policy.get_delay(attempt, parse_retry_after(retry_after), time.monotonic() - started)
+        return delay if self._should_retry(attempt, delay) else None
+
+    def _spool_if_unavailable(self, data):
+        """Spools the test results instead of uploading them while the circuit breaker is open"""
+        if not self.spool or not self.circuit_breaker.is_open:
+            return False
+        self._spool(data)
+        return True
+
+    def _spool_failed_upload(self, data, status=None):
+        """Spools the test results of an upload which failed to connect, or was answered with a retryable status"""
+        if not self.spool or (status is not None and not self.retry_policy.is_retryable(status)):
+            return False
+        self._spool(data)
+        return True
+
+    def _spool(self, data):
+        self.spool.write(self.run_id, data)
@@ -0,0 +1,267 @@
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from enum import Enum
+from pathlib import Path
+
+from tauk.exceptions import TaukException
+
+logger = logging.getLogger('tauk')
+
+MAGIC = b'TAUKRS1\n'
+SUMMARY_FILE_EXTENSION = '.trs'
+# Rows are buffered and written as one block, a crash loses at most this many of them
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 60.0
+
+FLOAT = 'f8'
+STRING = 'dict'
+STEP_PREFIX = 'step.'
+
+
+def get_default_summary_dir():
+    # Outside the execution dirs, which are deleted at the end of each run
+    return os.path.join(os.environ.get('TAUK_HOME', os.path.join(Path.home(), '.tauk')), 'run-summaries')
+
+
+def _value(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def _size(value):
+    return len(value) if isinstance(value, str) else None
+
+
+def summary_row(test_json: dict, file_name, run_id=None, payload_size=None, step_durations=None):
+    """Flattens the JSON of a finished test into the columns of the run summary"""
+    start, end = test_json.get('start_timestamp'), test_json.get('end_timestamp')
+    error = test_json.get('error')
+    row = {
+        'run_id': run_id,
+        'pid': os.getpid(),
+        'file_name': file_name,
+        'method_name': test_json.get('method_name'),
+        'custom_name': test_json.get('custom_name'),
+        'status': _value(test_json.get('status')),
+        'automation_type': _value(test_json.get('automation_type')),
+        'platform_name': _value(test_json.get('platform_name')),
+        'platform_version': test_json.get('platform_version'),
+        'browser_name': _value(test_json.get('browser_name')),
+        'browser_version': test_json.get('browser_version'),
+        'start_timestamp': start,
+        'end_timestamp': end,
+        'duration_ms': end - start if start and end else None,
+        'error_type': error.get('error_type') if isinstance(error, dict) else getattr(error, 'error_type', None),
+        'payload_bytes': payload_size,
+        'screenshot_bytes': _size(test_json.get('screenshot')),
+        'view_bytes': _size(test_json.get('view')),
+        'log_lines': len(test_json['log']) if test_json.get('log') else None,
+    }
+    for step, duration in (step_durations or {}).items():
+        row[f'{STEP_PREFIX}{step}_ms'] = duration
+    return row
+
+
+def _encode_column(values):
+    if all(value is None or isinstance(value, (int, float)) for value in values):
+        column = array('d', (math.nan if value is None else value for value in values))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return FLOAT, zlib.compress(column.tobytes())
+
+    # Dictionary encoded, most columns only hold a handful of distinct values
+    dictionary, codes = {}, array('I')
+    for value in values:
+        codes.append(dictionary.setdefault(None if value is None else str(value), len(dictionary)))
+    if sys.byteorder == 'big':
+        codes.byteswap()
+    return STRING, zlib.compress(json.dumps(list(dictionary)).encode() + b'\0' + codes.tobytes())
+
+
+def _decode_column(column_type, payload):
+    data = zlib.decompress(payload)
+    if column_type == FLOAT:
+        column = array('d')
+        column.frombytes(data)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return [None if math.isnan(value) else value for value in column]
+    elif column_type == STRING:
+        dictionary, codes_data = data.split(b'\0', 1)
+        dictionary = json.loads(dictionary)
+        codes = array('I')
+        codes.frombytes(codes_data)
+        if sys.byteorder == 'big':
+            codes.byteswap()
+        return [dictionary[code] for code in codes]
+    raise TaukException(f'unknown run summary column type {column_type}')
+
+
+def encode_block(rows):
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    columns, payloads = [], []
+    for name in names:
+        column_type, payload = _encode_column([row.get(name) for row in rows])
+        columns.append({'name': name, 'type': column_type, 'size': len(payload)})
+        payloads.append(payload)
+    header = json.dumps({'rows': len(rows), 'columns': columns}).encode()
+    return struct.pack('<I', len(header)) + header + b''.join(payloads)
+
+
+class RunSummarySink:
+    """Appends the summaries of finished tests to a columnar file, in blocks of rows"""
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, clock=time.monotonic) -> None:
+        self.path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._clock = clock
+        self._rows = []
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+
+    def record(self, row: dict):
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self._batch_size or self._clock() - self._last_flush >= self._flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = self._clock()
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as file:
+            # A single write, so a reader never sees a half written header
+            file.write((MAGIC if file.tell() == 0 else b'') + encode_block(rows))
+        logger.debug(f'Wrote {len(rows)} test summaries to {self.path}')
+
+    def close(self):
+        self.flush()
+
+
+def read_summary(path, columns=None):
+    """Yields the rows of each block as a dict of column name to values, only decoding the requested columns.
+    Columns missing from a block are filled with None"""
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise TaukException(f'{path} is not a run summary')
+        while True:
+            prefix = file.read(4)
+            if len(prefix) < 4:
+                return
+            header_size, = struct.unpack('<I', prefix)
+            try:
+                header = json.loads(file.read(header_size))
+                block = {}
+                for column in header['columns']:
+                    if columns is not None and column['name'] not in columns:
+                        file.seek(column['size'], os.SEEK_CUR)
+                        continue
+                    payload = file.read(column['size'])
+                    block[column['name']] = _decode_column(column['type'], payload)
+            except (ValueError, KeyError, zlib.error) as ex:
+                # Ex: the process was killed while writing the last block
+                logger.warning(f'Ignoring the rest of the run summary {path}: {ex}')
+                return
+            for name in columns or []:
+                block.setdefault(name, [None] * header['rows'])
+            yield block
+
+
+def read_column_names(path):
+    names = {}
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise TaukException(f'{path} is not a run summary')
+        while len(prefix := file.read(4)) == 4:
+            try:
+                header = json.loads(file.read(struct.unpack('<I', prefix)[0]))
+            except ValueError:
+                break
+            for column in header['columns']:
+                names[column['name']] = None
+                file.seek(column['size'], os.SEEK_CUR)
+    return list(names)
+
+
+def find_summaries(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(SUMMARY_FILE_EXTENSION))
+
+
+def _percentile(values, p):
+    # Nearest rank of the sorted values
+    return values[max(math.ceil(len(values) * p / 100) - 1, 0)]
+
+
+def _stats(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        'mean': sum(values) / len(values),
+        'p50': _percentile(values, 50),
+        'p90': _percentile(values, 90),
+        'max': values[-1],
+    }
+
+
+class RunSummaryStats:
+    def __init__(self) -> None:
+        self.files = 0
+        self.runs = set()
+        self.tests = 0
+        # Group value to column to the values of the tests in the group
+        self.groups: dict[str, dict[str, list]] = {}
+
+    def to_json(self):
+        return {
+            'files': self.files,
+            'runs': len(self.runs),
+            'tests': self.tests,
+            'groups': {
+                group: {'tests': len(columns['duration_ms']),
+                        **{name: _stats(values) for name, values in columns.items()}}
+                for group, columns in sorted(self.groups.items(), key=lambda item: str(item[0]))
+            },
+        }
+
+
+def aggregate(paths, group_by='status', since=None):
+    """Aggregates the durations and sizes of the tests in the run summaries, `since` in epoch milliseconds"""
+    stats = RunSummaryStats()
+    for path in paths:
+        try:
+            names = read_column_names(path)
+            measures = ['duration_ms', 'payload_bytes', 'screenshot_bytes', 'view_bytes'] + \
+                [name for name in names if name.startswith(STEP_PREFIX)]
+            blocks = read_summary(path, columns={'run_id', 'start_timestamp', group_by, *measures})
+            stats.files += 1
+            for block in blocks:
+                for index, group in enumerate(block[group_by]):
+                    start = block['start_timestamp'][index]
+                    if since is not None and (start is None or start < since):
+                        continue
+                    stats.tests += 1
+                    stats.runs.add(block['run_id'][index])
+                    columns = stats.groups.setdefault(group, {'duration_ms': []})
+                    for name in measures:
+                        columns.setdefault(name, []).append(block[name][index])
+        except (OSError, TaukException) as ex:
+            logger.warning(f'Skipping run summary {path}: {ex}')
+    return stats
@@ -0,0 +1,147 @@
+import base64
+import hashlib
+import io
+import logging
+import random
+import threading
+from collections import OrderedDict
+
+from tauk import metrics
+from tauk.failure_dedup import hash_artifact
+
+logger = logging.getLogger('tauk')
+
+_pillow_warned = False
+_weights = {}
+
+
+def _decode_screenshot(screenshot):
+    global _pillow_warned
+    try:
+        from PIL import Image
+    except ImportError:
+        if not _pillow_warned:
+            logger.warning('Install Pillow (pip install tauk[diff]) to upload only the changed parts of screenshots')
+            _pillow_warned = True
+        return None
+
+    try:
+        return Image.open(io.BytesIO(base64.b64decode(screenshot))).convert('RGB')
+    except Exception as ex:
+        logger.error('Failed to decode screenshot for diffing', exc_info=ex)
+        return None
+
+
+def _get_weights(numpy, tile_size):
+    # Fixed per process, the digests are only ever compared with digests computed by the same process
+    if tile_size not in _weights:
+        rng = random.Random(tile_size)
+        _weights[tile_size] = numpy.array([rng.randrange(1 << 20, 1 << 31) for _ in range(tile_size * tile_size * 3)],
+                                          dtype=numpy.float64)
+    return _weights[tile_size]
+
+
+def tile_digests(image, tile_size):
+    """Digest of every tile of the RGB image, row by row"""
+    width, height = image.size
+    columns = -(-width // tile_size)
+    try:
+        import numpy
+    except ImportError:
+        return [hashlib.blake2b(image.crop((x, y, x + tile_size, y + tile_size)).tobytes(), digest_size=16).digest()
+                for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+    pixels = numpy.asarray(image, dtype=numpy.uint8)
+    weights = _get_weights(numpy, tile_size)
+    digests = []
+    # A band of tiles at a time keeps the float copy small
+    for y in range(0, height, tile_size):
+        band = numpy.zeros((tile_size, columns * tile_size, 3), dtype=numpy.uint8)
+        rows = pixels[y:y + tile_size]
+        band[:rows.shape[0], :width] = rows
+        tiles = band.reshape(tile_size, columns, tile_size, 3).transpose(1, 0, 2, 3).reshape(columns, -1)
+        digests.extend((tiles @ weights).tolist())
+    return digests
+
+
+class _Keyframe:
+    def __init__(self, session_id, screenshot_hash, size, digests) -> None:
+        self.session_id = session_id
+        self.hash = screenshot_hash
+        self.size = size
+        self.digests = digests
+
+
+class ScreenshotDiffer:
+    """Compares the screenshots of a driver session with the last one uploaded in full, so tests sharing a driver
+    reference an unchanged screenshot and only upload the tiles of a changed one"""
+
+    def __init__(self, tile_size=64, max_changed_ratio=0.5, max_sessions=16) -> None:
+        self.tile_size = tile_size
+        self.max_changed_ratio = max_changed_ratio
+        self._max_sessions = max_sessions
+        self._keyframes: OrderedDict[str, _Keyframe] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def diff(self, test_case):
+        """Replaces the screenshot with a reference or its changed tiles, otherwise returns it as the next keyframe
+        of the session, to be passed to remember() once it is certain to be uploaded in full"""
+        session_id = getattr(test_case.driver_instance, 'session_id', None)
+        if not session_id or not test_case.screenshot:
+            return None
+
+        screenshot_hash = hash_artifact(test_case.screenshot)
+        with self._lock:
+            keyframe = self._keyframes.get(session_id)
+        if keyframe and keyframe.hash == screenshot_hash:
+            self._reference(test_case, keyframe)
+            metrics.registry.increment('screenshot_diff.unchanged')
+            return None
+
+        image = _decode_screenshot(test_case.screenshot)
+        digests = tile_digests(image, self.tile_size) if image else None
+        if keyframe and digests and keyframe.size == image.size:
+            changed = [index for index, (old, new) in enumerate(zip(keyframe.digests, digests)) if old != new]
+            if len(changed) <= self.max_changed_ratio * len(digests):
+                delta = self._encode_delta(image, changed)
+                if sum(len(tile['image']) for tile in delta['tiles']) < len(test_case.screenshot):
+                    self._reference(test_case, keyframe)
+                    test_case.screenshot_delta = delta
+                    metrics.registry.increment('screenshot_diff.deltas')
+                    return None
+
+        return _Keyframe(session_id, screenshot_hash, image.size if image else None, digests)
+
+    def remember(self, keyframe):
+        """The following screenshots of the session are compared with this one"""
+        with self._lock:
+            self._keyframes[keyframe.session_id] = keyframe
+            self._keyframes.move_to_end(keyframe.session_id)
+            while len(self._keyframes) > self._max_sessions:
+                self._keyframes.popitem(last=False)
+
+    @staticmethod
+    def _reference(test_case, keyframe):
+        test_case.screenshot = None
+        test_case.artifact_refs = {**(test_case.artifact_refs or {}), 'screenshot': keyframe.hash}
+
+    def _encode_delta(self, image, changed):
+        width, height = image.size
+        columns = -(-width // self.tile_size)
+        # Neighbouring changed tiles of a row are sent as a single image
+        runs = []
+        for index in changed:
+            row, column = divmod(index, columns)
+            if runs and runs[-1][0] == row and runs[-1][2] == column:
+                runs[-1][2] = column + 1
+            else:
+                runs.append([row, column, column + 1])
+
+        tiles = []
+        for row, first_column, end_column in runs:
+            box = (first_column * self.tile_size, row * self.tile_size,
+                   min(end_column * self.tile_size, width), min((row + 1) * self.tile_size, height))
+            output = io.BytesIO()
+            image.crop(box).save(output, format='PNG')
+            tiles.append({'x': box[0], 'y': box[1], 'image': base64.b64encode(output.getvalue()).decode()})
+        return {'width': width, 'height': height, 'tiles': tiles}
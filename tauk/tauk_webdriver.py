@@ -1,7 +1,9 @@
 """Helper package to facilitate reporting for webdriver-based tests on Tauk"""
+import asyncio
 import atexit
 import inspect
 import logging
+import multiprocessing.util
 import os
 import sys
 import unittest
@@ -9,17 +11,33 @@ from datetime import datetime, timezone
 from functools import wraps
 from threading import Lock
 
+from tauk import metrics
 from tauk.config import TaukConfig
 from tauk.context.context import TaukContext
+from tauk.context.current_test import get_current_test, test_scope
+from tauk.context.run_handle import RunHandle
+from tauk.deadline import deadline_scope, is_budget_spent
 from tauk.enums import AutomationTypes, AttachmentTypes
 from tauk.exceptions import TaukException, TaukTestMethodNotFoundException
+from tauk.metrics import timed
 from tauk.context.test_data import TestCase
-from tauk.utils import attach_assistant_artifacts, upload_attachments
+from tauk.utils import attach_assistant_artifacts, upload_attachment, upload_attachments
 
 logger = logging.getLogger('tauk')
 
 mutex = Lock()
 
+BACKGROUND_UPLOAD_DRAIN_TIMEOUT = 120
+
+
+def _capture_appium_logs(test_case: TestCase):
+    if test_case.automation_type == AutomationTypes.APPIUM and not is_budget_spent('appium logs capture'):
+        try:
+            with test_case.timed_step('appium_logs'):
+                test_case.capture_appium_logs()
+        except Exception as ex:
+            logger.error('Failed to capture appium server logs', exc_info=ex)
+
 
 class Tauk:
     instance = None
@@ -34,6 +52,7 @@ class Tauk:
                 cls.config = tauk_config
                 logger.debug(f'Creating new Tauk instance with config [{tauk_config}]')
                 cls.instance = super(Tauk, cls).__new__(cls)
+                metrics.registry.enabled = tauk_config.metrics_enabled or tauk_config.metrics_dump
 
                 Tauk.__context = TaukContext(tauk_config)
 
@@ -43,6 +62,48 @@ class Tauk:
 
             return cls.instance
 
+    @classmethod
+    def attach(cls, run_handle: RunHandle, tauk_config=None):
+        """Initialize Tauk in a worker process to report into the run of the parent process. Ex:
+        ProcessPoolExecutor(initializer=Tauk.attach, initargs=(Tauk.get_run_handle(),))"""
+        with mutex:
+            if Tauk.instance is not None:
+                if Tauk.__context.pid == os.getpid():
+                    if Tauk.__context.run_id != run_handle.run_id:
+                        raise TaukException(f'Tauk is already initialized with the run {Tauk.__context.run_id}')
+                    return cls.instance
+                # Inherited from the parent by fork, its threads and connections didn't come along
+                logger.debug('Discarding Tauk instance inherited from the parent process')
+                cls.instance = None
+
+            if tauk_config is None:
+                tauk_config = TaukConfig(run_handle.api_token, run_handle.project_id)
+            cls.config = tauk_config
+            logger.debug(f'Attaching Tauk instance to {run_handle} with config [{tauk_config}]')
+            cls.instance = super(Tauk, cls).__new__(cls)
+            metrics.registry.enabled = tauk_config.metrics_enabled or tauk_config.metrics_dump
+
+            Tauk.__context = TaukContext(tauk_config, run_handle)
+
+            # multiprocessing workers exit without running atexit handlers, but they do run its finalizers
+            atexit.register(Tauk.destroy)
+            multiprocessing.util.Finalize(None, Tauk.destroy, exitpriority=10)
+            return cls.instance
+
+    @classmethod
+    def get_run_handle(cls) -> RunHandle:
+        if not Tauk.is_initialized():
+            raise TaukException('Tauk is not yet initialized')
+        return Tauk.__context.get_run_handle()
+
+    @classmethod
+    def reconcile(cls):
+        """Reports the tests left behind by processes of the run which crashed, returns how many were reported.
+        Runs when Tauk is destroyed, call it earlier to report them while the run is still going"""
+        if not Tauk.is_initialized():
+            raise TaukException('Tauk is not yet initialized')
+        return Tauk.__context.reconcile()
+
     @classmethod
     def is_initialized(cls):
         return False if Tauk.instance is None else True
@@ -69,6 +130,23 @@ class Tauk:
         return test_case
 
     @classmethod
+    def _find_testcase(cls, unittestcase=None, ref_frame=None):
+        """Returns the relative file name and the test case of the test running in the current thread or task"""
+        current = get_current_test()
+        if current and (unittestcase is None or current.test_case.method_name == unittestcase.id().split('.')[-1]):
+            return current.filename, current.test_case
+
+        # Tests reporting from a thread they started themselves fall back to looking the test up by its name
+        _, relative_file_name, method_name = Tauk._get_test_method_details(unittestcase=unittestcase,
+                                                                           ref_frame=ref_frame)
+        return relative_file_name, Tauk._get_testcase(relative_file_name, method_name)
+
+    @classmethod
+    def get_metrics(cls):
+        return metrics.registry.snapshot()
+
+    @classmethod
+    @timed(action_name='Find Test Method')
     def _get_test_method_details(cls, unittestcase=None, func_name=None, ref_frame=None):
         if unittestcase:
             if not isinstance(unittestcase, unittest.TestCase):
@@ -102,25 +180,61 @@ class Tauk:
             logger.debug('Destroying Tauk context')
 
             try:
-                if Tauk.__context.assistant and Tauk.__context.assistant.is_running():
-                    Tauk.__context.assistant.kill()
+                Tauk.__context.background_uploader.drain(timeout=BACKGROUND_UPLOAD_DRAIN_TIMEOUT)
             except Exception as ex:
-                logger.error('Failed to kill assistant app', exc_info=ex)
+                logger.error('Failed to finish deferred uploads', exc_info=ex)
 
             try:
-                if os.path.exists(Tauk.__context.error_log) and os.path.getsize(Tauk.__context.error_log) > 0:
-                    Tauk.__context.api.finish_execution(Tauk.__context.error_log)
-                else:
-                    Tauk.__context.api.finish_execution()
+                if Tauk.__context.assistant:
+                    Tauk.__context.assistant.stop()
             except Exception as ex:
-                logger.error('Failed report execution complete', exc_info=ex)
+                logger.error('Failed to stop assistant app', exc_info=ex)
 
             try:
-                Tauk.__context.delete_execution_files()
+                Tauk.__context.reconcile()
             except Exception as ex:
-                logger.error('Failed to delete execution file', exc_info=ex)
+                logger.error('Failed to reconcile the run journal', exc_info=ex)
 
-            del cls.instance
+            try:
+                Tauk.__context.api.flush_spool()
+            except Exception as ex:
+                logger.error('Failed to upload spooled test results', exc_info=ex)
+
+            # The process which started the run finishes it
+            if not Tauk.__context.attached:
+                try:
+                    if os.path.exists(Tauk.__context.error_log) and os.path.getsize(Tauk.__context.error_log) > 0:
+                        Tauk.__context.api.finish_execution(Tauk.__context.error_log)
+                    else:
+                        Tauk.__context.api.finish_execution()
+                except Exception as ex:
+                    logger.error('Failed report execution complete', exc_info=ex)
+
+            if Tauk.config.metrics_dump:
+                try:
+                    metrics.registry.dump(os.path.join(Tauk.__context.exec_dir, f'tauk-metrics-{os.getpid()}.json'))
+                except Exception as ex:
+                    logger.error('Failed to dump tauk metrics', exc_info=ex)
+
+            try:
+                Tauk.__context.close_async_api()
+                Tauk.__context.api.close()
+                Tauk.__context.close_journal()
+            except Exception as ex:
+                logger.error('Failed to close api sessions', exc_info=ex)
+
+            try:
+                Tauk.__context.close_run_summary()
+            except Exception as ex:
+                logger.error('Failed to write the run summary', exc_info=ex)
+
+            if not Tauk.__context.attached:
+                try:
+                    Tauk.__context.delete_execution_files()
+                except Exception as ex:
+                    logger.error('Failed to delete execution file', exc_info=ex)
+
+            cls.instance = None
 
     @classmethod
     def register_driver(cls, driver, unittestcase=None):
@@ -133,68 +247,226 @@ class Tauk:
         if not Tauk.is_initialized():
             raise TaukException('driver can only be registered from test methods')
 
-        _, relative_file_name, method_name = Tauk._get_test_method_details(
-            unittestcase=unittestcase, ref_frame=Tauk.register_driver.__name__)
-        test = Tauk._get_testcase(relative_file_name, method_name)
+        relative_file_name, test = Tauk._find_testcase(unittestcase, ref_frame=Tauk.register_driver.__name__)
         if test is None:
             raise TaukException(f'TaukListener was not attached to unittest runner')
+        method_name = test.method_name
         test.register_driver(driver, Tauk.__context.assistant, relative_file_name, method_name)
+        if Tauk.config.screen_recording_fps:
+            try:
+                test.start_screen_recording(Tauk.__context.recordings_dir, Tauk.config.screen_recording_fps)
+            except Exception as ex:
+                logger.error('Failed to start screen recording', exc_info=ex)
+
+        assistant = Tauk.__context.assistant
+        if assistant and assistant.config.stream_attachments and test.browser_debugger_page_id:
+            try:
+                # Attachments can only be uploaded against a registered test
+                if not test.id:
+                    test.id = Tauk.__context.api.test_start(method_name, relative_file_name, test.start_timestamp)
+                test.start_attachment_stream(assistant, lambda file_path, attachment_type:
+                                             Tauk._stream_attachment(test, file_path, attachment_type))
+            except Exception as ex:
+                logger.error('Failed to start streaming assistant attachments', exc_info=ex)
+
+    @classmethod
+    def _stream_attachment(cls, test_case: TestCase, file_path, attachment_type):
+        test_case.add_attachment(file_path, attachment_type, streamed=True)
+        Tauk.__context.journal_attachment(test_case, file_path, attachment_type)
+        if upload_attachment(Tauk.__context.api, test_case, file_path, attachment_type):
+            logger.debug(f'[Assistant] Streamed attachment {file_path}')
+        else:
+            # Uploaded again with the other attachments of the test
+            test_case.streamed_attachments.discard(file_path)
 
     @classmethod
     def observe(cls, custom_test_name=None, excluded=False):
         def inner_decorator(func):
             logger.debug(f'Registering test method=[{func.__name__}]'
                          f' with custom_test_name=[{custom_test_name}], excluded=[{excluded}]')
-            test_case = TestCase()
-            test_case.custom_name = custom_test_name
-            test_case.excluded = excluded
-            test_case.method_name = func.__name__
-
-            file_name, relative_file_name, _ = Tauk._get_test_method_details(func_name=test_case.method_name)
+            file_name, relative_file_name, _ = Tauk._get_test_method_details(func_name=func.__name__)
             Tauk() if not Tauk.is_initialized() else None
-            Tauk.__context.test_data.add_test_case(relative_file_name, test_case)
 
-            @wraps(func)
-            def invoke_test_case(*args, **kwargs):
-                try:
-                    test_case.start_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-                    result = func(*args, **kwargs)
-                    test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-                    test_case.capture_success_data()
-                except Exception:
-                    test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-                    test_case.capture_failure_data(file_name, sys.exc_info(), func)
-                    raise
-                else:
-                    return result
-                finally:
-                    if test_case.automation_type == AutomationTypes.APPIUM:
+            def start_test_case():
+                # Every invocation is its own test case, the same test may run again or on several threads at once
+                test_case = TestCase()
+                test_case.custom_name = custom_test_name
+                test_case.excluded = excluded
+                test_case.method_name = func.__name__
+                test_case.start_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+                Tauk.__context.start_test(relative_file_name, test_case)
+                return test_case
+
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def invoke_async_test_case(*args, **kwargs):
+                    test_case = start_test_case()
+                    # The reporting budget starts once the test itself is done
+                    with test_scope(relative_file_name, test_case), \
+                            deadline_scope(Tauk.__context.new_report_deadline()) as deadline:
                         try:
-                            test_case.capture_appium_logs()
-                        except Exception as ex:
-                            logger.error('Failed to capture appium server logs', exc_info=ex)
+                            result = await func(*args, **kwargs)
+                            test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+                            deadline.start()
+                            # Capturing talks to the driver synchronously, keep it off the event loop
+                            await asyncio.to_thread(test_case.capture_success_data, Tauk.__context.capture_policy)
+                        except Exception:
+                            test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+                            deadline.start()
+                            await asyncio.to_thread(test_case.capture_failure_data, file_name, sys.exc_info(), func,
+                                                    Tauk.__context.capture_policy)
+                            raise
+                        else:
+                            return result
+                        finally:
+                            await Tauk._report_test_case_async(test_case, relative_file_name)
+
+                return invoke_async_test_case
 
-                    # TODO: Investigate about overloaded test name
+            @wraps(func)
+            def invoke_test_case(*args, **kwargs):
+                test_case = start_test_case()
+                # The reporting budget starts once the test itself is done
+                with test_scope(relative_file_name, test_case), \
+                        deadline_scope(Tauk.__context.new_report_deadline()) as deadline:
                     try:
-                        json_test_data = Tauk.__context.get_json_test_data(relative_file_name, test_case.method_name)
-                        test_case.id = Tauk.__context.api.upload(json_test_data)
-
-                        # Attach assistant artifacts
-                        try:
-                            attach_assistant_artifacts(Tauk.__context.assistant, test_case)
-                        except Exception as e:
-                            logger.error('Failed to attach assistant artifacts', exc_info=e)
-                        # Upload attachments
-                        upload_attachments(Tauk.__context.api, test_case)
-                    except Exception as ex:
-                        logger.error(f'Failed to update test results for the test {test_case.method_name}', exc_info=ex)
-
-                    Tauk.__context.test_data.delete_test_case(relative_file_name, test_case.method_name)
+                        result = func(*args, **kwargs)
+                        test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+                        deadline.start()
+                        test_case.capture_success_data(Tauk.__context.capture_policy)
+                    except Exception:
+                        test_case.end_timestamp = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+                        deadline.start()
+                        test_case.capture_failure_data(file_name, sys.exc_info(), func, Tauk.__context.capture_policy)
+                        raise
+                    else:
+                        return result
+                    finally:
+                        Tauk._report_test_case(test_case, relative_file_name)
 
             return invoke_test_case
 
         return inner_decorator
 
+    @classmethod
+    def _serialize_test_case(cls, test_case: TestCase, relative_file_name):
+        try:
+            with test_case.timed_step('serialize'):
+                json_test_data = Tauk.__context.get_json_test_data(relative_file_name, test_case)
+            test_case.payload_size = len(json_test_data)
+            Tauk.__context.journal_test_finished(relative_file_name, test_case, json_test_data)
+            return json_test_data
+        except Exception as ex:
+            logger.error(f'Failed to update test results for the test {test_case.method_name}', exc_info=ex)
+            Tauk.__context.journal_test_reported(test_case)
+            Tauk.__context.record_run_summary(relative_file_name, test_case)
+            return None
+        finally:
+            # Uploads may be deferred, they only need the serialized test data
+            Tauk.__context.test_data.delete_test_case(relative_file_name, test_case)
+
+    @classmethod
+    def _finish_screen_recording(cls, test_case: TestCase):
+        try:
+            with test_case.timed_step('screen_recording'):
+                segments = test_case.stop_screen_recording()
+        except Exception as ex:
+            logger.error('Failed to stop screen recording', exc_info=ex)
+            return
+        keep = Tauk.__context.capture_policy.should_keep_recording(test_case.status)
+        for segment in segments:
+            if keep:
+                test_case.add_attachment(segment, AttachmentTypes.SCREEN_RECORDING)
+                Tauk.__context.journal_attachment(test_case, segment, AttachmentTypes.SCREEN_RECORDING)
+            else:
+                os.remove(segment)
+
+    @classmethod
+    def _report_test_case(cls, test_case: TestCase, relative_file_name):
+        Tauk._finish_screen_recording(test_case)
+        _capture_appium_logs(test_case)
+
+        # TODO: Investigate about overloaded test name
+        json_test_data = Tauk._serialize_test_case(test_case, relative_file_name)
+        if json_test_data is None:
+            return
+        if is_budget_spent('uploading test results inline'):
+            Tauk.__context.background_uploader.submit(Tauk._upload_test_case, test_case, relative_file_name,
+                                                      json_test_data)
+            return
+        Tauk._upload_test_case(test_case, relative_file_name, json_test_data)
+
+    @classmethod
+    def _upload_test_case(cls, test_case: TestCase, relative_file_name, json_test_data):
+        try:
+            with test_case.timed_step('upload'):
+                upload_result = Tauk.__context.api.upload(json_test_data)
+            test_case.id = upload_result.get(relative_file_name, {}).get(test_case.method_name)
+        except Exception as ex:
+            logger.error(f'Failed to update test results for the test {test_case.method_name}', exc_info=ex)
+            Tauk.__context.record_run_summary(relative_file_name, test_case)
+            return
+        finally:
+            # Results which could not be uploaded were spooled or rejected, either way they are not recovered
+            Tauk.__context.journal_test_reported(test_case)
+        Tauk.__context.capture_policy.remember_uploaded(test_case)
+
+        if is_budget_spent('uploading attachments inline'):
+            Tauk.__context.background_uploader.submit(Tauk._upload_artifacts, test_case, relative_file_name)
+            return
+        Tauk._upload_artifacts(test_case, relative_file_name)
+
+    @classmethod
+    def _upload_artifacts(cls, test_case: TestCase, relative_file_name):
+        with test_case.timed_step('attachments'):
+            # Attach assistant artifacts
+            try:
+                attach_assistant_artifacts(Tauk.__context.assistant, test_case)
+            except Exception as e:
+                logger.error('Failed to attach assistant artifacts', exc_info=e)
+            # Upload attachments
+            upload_attachments(Tauk.__context.api, test_case)
+        Tauk.__context.record_run_summary(relative_file_name, test_case)
+
+    @classmethod
+    async def _report_test_case_async(cls, test_case: TestCase, relative_file_name):
+        await asyncio.to_thread(Tauk._finish_screen_recording, test_case)
+        await asyncio.to_thread(_capture_appium_logs, test_case)
+
+        json_test_data = Tauk._serialize_test_case(test_case, relative_file_name)
+        if json_test_data is None:
+            return
+        if is_budget_spent('uploading test results inline'):
+            Tauk.__context.background_uploader.submit(Tauk._upload_test_case, test_case, relative_file_name,
+                                                      json_test_data)
+            return
+
+        api = Tauk.__context.async_api
+        try:
+            with test_case.timed_step('upload'):
+                upload_result = await api.upload(json_test_data)
+            test_case.id = upload_result.get(relative_file_name, {}).get(test_case.method_name)
+        except Exception as ex:
+            logger.error(f'Failed to update test results for the test {test_case.method_name}', exc_info=ex)
+            Tauk.__context.record_run_summary(relative_file_name, test_case)
+            return
+        finally:
+            Tauk.__context.journal_test_reported(test_case)
+        Tauk.__context.capture_policy.remember_uploaded(test_case)
+
+        if is_budget_spent('uploading attachments inline'):
+            Tauk.__context.background_uploader.submit(Tauk._upload_artifacts, test_case, relative_file_name)
+            return
+        with test_case.timed_step('attachments'):
+            # Attach assistant artifacts
+            try:
+                await asyncio.to_thread(attach_assistant_artifacts, Tauk.__context.assistant, test_case)
+            except Exception as e:
+                logger.error('Failed to attach assistant artifacts', exc_info=e)
+            # Upload attachments
+            await api.upload_attachments(test_case)
+        Tauk.__context.record_run_summary(relative_file_name, test_case)
+
     @classmethod
     def sync_data(cls):
         pass
@@ -213,9 +485,7 @@ class Tauk:
             test.add_user_data(name, value)
             return
 
-        _, relative_file_name, method_name = Tauk._get_test_method_details(
-            unittestcase=unittestcase, ref_frame=Tauk.add_user_data.__name__)
-        test = Tauk._get_testcase(relative_file_name, method_name)
+        _, test = Tauk._find_testcase(unittestcase, ref_frame=Tauk.add_user_data.__name__)
         if test is None:
             raise TaukException(f'user data can only be added within testcase')
         test.add_user_data(name, value)
@@ -232,12 +502,9 @@ class Tauk:
             if test is None:
                 raise TaukException(f'attachment can only be added withing the test method,'
                                     f' verify if {test_file_name} has @Tauk.observe decorator')
-            test.add_attachment(attachment_file_path, attachment_type)
-            return
-
-        _, relative_file_name, method_name = Tauk._get_test_method_details(
-            unittestcase=unittestcase, ref_frame=Tauk.add_user_data.__name__)
-        test = Tauk._get_testcase(relative_file_name, method_name)
-        if test is None:
-            raise TaukException(f'attachment can only be added within testcase')
+        else:
+            _, test = Tauk._find_testcase(unittestcase, ref_frame=Tauk.add_attachment.__name__)
+            if test is None:
+                raise TaukException(f'attachment can only be added within testcase')
         test.add_attachment(attachment_file_path, attachment_type)
+        Tauk.__context.journal_attachment(test, attachment_file_path, attachment_type)
@@ -0,0 +1,63 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger('tauk')
+
+
+class BackgroundUploader:
+    """Runs reporting work deferred by tests which ran out of their reporting budget on a single daemon thread"""
+
+    def __init__(self, name='tauk-uploader') -> None:
+        self._name = name
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    @property
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+        self._queue.put((func, args, kwargs))
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                if func is None:
+                    if self._queue.empty():
+                        return
+                    # Work was submitted after drain gave up waiting, it still runs before stopping
+                    self._queue.put((None, (), {}))
+                    continue
+                func(*args, **kwargs)
+            except Exception as ex:
+                logger.error(f'Background upload [{getattr(func, "__name__", func)}] failed', exc_info=ex)
+            finally:
+                self._queue.task_done()
+
+    def drain(self, timeout=None):
+        """Waits for the submitted work to finish, returns False if it didn't within `timeout` seconds"""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return True
+            if self.pending:
+                logger.info(f'Waiting for {self.pending} deferred uploads to finish')
+            if not self._stopping:
+                self._queue.put((None, (), {}))
+                self._stopping = True
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f'Gave up waiting for {self.pending} deferred uploads')
+                return False
+            self._thread = None
+            self._stopping = False
+            return True
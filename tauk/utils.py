@@ -1,3 +1,5 @@
+import inspect
+import json
 import logging
 import os
 import re
@@ -8,7 +10,10 @@ from functools import wraps
 import requests
 
 from contextlib import closing
+from filelock import FileLock
 
+from tauk import metrics
+from tauk.deadline import clamp_timeout
 from tauk.enums import AttachmentTypes
 
 logger = logging.getLogger('tauk')
@@ -16,7 +21,7 @@ logger = logging.getLogger('tauk')
 
 def get_appium_server_version(driver):
     driver_url = driver.command_executor._url
-    response = requests.get(f'{driver_url}/status')
+    response = requests.get(f'{driver_url}/status', timeout=clamp_timeout(10))
     if response.status_code == 200:
         try:
             json_response = response.json()
@@ -50,14 +55,90 @@ def get_browser_debugger_address(driver):
         return None
 
 
+def is_port_free(port):
+    # Binding is immediate and reliable unlike probing with connect which hangs on filtered ports
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        if os.name != 'nt':
+            # Ports in TIME_WAIT can be reused by the assistant, on windows this flag would allow stealing the port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('', port))
+            return True
+        except OSError:
+            return False
+
+
 def get_open_port(port_range):
     for port in port_range:
-        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
-            if sock.connect_ex(('0.0.0.0', port)) != 0:
-                return port
+        if is_port_free(port):
+            return port
     return None
 
 
+def _ports_file():
+    return os.path.join(os.environ.get('TAUK_HOME'), 'ports.json')
+
+
+def _read_port_reservations(ports_file, ttl):
+    reservations = {}
+    if os.path.exists(ports_file):
+        try:
+            with open(ports_file, 'r') as file:
+                reservations = json.load(file)
+        except (OSError, ValueError) as ex:
+            logger.warning(f'Ignoring invalid port reservations file {ports_file}', exc_info=ex)
+
+    now = time.time()
+    return {port: reservation for port, reservation in reservations.items()
+            if now - reservation.get('ts', 0) < ttl and is_process_alive(reservation.get('pid'))}
+
+
+def _write_port_reservations(ports_file, reservations):
+    tmp_file = f'{ports_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as file:
+        json.dump(reservations, file)
+    os.replace(tmp_file, ports_file)
+
+
+def reserve_open_port(port_range, ttl=30):
+    """Find a free port which is not reserved by any other process and reserve it for `ttl` seconds"""
+    ports_file = _ports_file()
+    with FileLock(f'{ports_file}.lock', timeout=30):
+        reservations = _read_port_reservations(ports_file, ttl)
+        for port in port_range:
+            if str(port) in reservations or not is_port_free(port):
+                continue
+            reservations[str(port)] = {'pid': os.getpid(), 'ts': time.time()}
+            _write_port_reservations(ports_file, reservations)
+            logger.debug(f'Reserved port {port}')
+            return port
+    return None
+
+
+def release_port(port, ttl=30):
+    ports_file = _ports_file()
+    with FileLock(f'{ports_file}.lock', timeout=30):
+        reservations = _read_port_reservations(ports_file, ttl)
+        if reservations.pop(str(port), None):
+            _write_port_reservations(ports_file, reservations)
+            logger.debug(f'Released port {port}')
+
+
+def is_process_alive(pid):
+    if not pid or pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Process exists but is owned by another user
+        return True
+    except OSError:
+        return False
+    return True
+
+
 def shortened_json(json_text):
     json_text = re.sub(r'"screenshot": ".+?"', '"screenshot" : "stripped"', json_text, flags=re.DOTALL)
     json_text = re.sub(r'"view": ".+?", "', '"view" : "stripped", ', json_text, flags=re.DOTALL)
@@ -67,6 +148,8 @@ def shortened_json(json_text):
 
 def attach_assistant_artifacts(assistant, test_case):
     browser_debugger_address = test_case.browser_debugger_address
+    # Whatever was not streamed during the test gets picked up below
+    streaming = test_case.stop_attachment_stream()
     if assistant and assistant.config.is_cdp_capture_enabled():
         if assistant.is_running():
             connected_page = test_case.browser_debugger_page_id
@@ -86,7 +169,11 @@ def attach_assistant_artifacts(assistant, test_case):
         # So we want to be able to check if there are any logs if we have a valid page ID
         if test_case.browser_debugger_page_id:
             assistant_attachments = assistant.get_attachments(connected_page_id=test_case.browser_debugger_page_id)
+            attached = {file_path for file_path, _ in test_case.attachments}
             for file, file_type in assistant_attachments:
+                if file in streaming or file in attached:
+                    logger.debug(f'[Assistant] Attachment {file} was already streamed, not adding it again')
+                    continue
                 try:
                     test_case.add_attachment(file, file_type)
                 except Exception as ex:
@@ -97,38 +184,73 @@ def attach_assistant_artifacts(assistant, test_case):
         logger.debug('[Assistant] Capture is disabled')
 
 
+def log_skipped_attachments(test_case):
+    # Results spooled while Tauk API was unavailable have no test id to attach to
+    files = ', '.join(f'{attachment_type.value}: {file_path}' for file_path, attachment_type in test_case.attachments)
+    logger.warning(f'Skipping {len(test_case.attachments)} attachments of unregistered test'
+                   f' [{test_case.method_name}], they are not uploaded [{files}]')
+
+
 def upload_attachments(api, test_case):
     if len(test_case.attachments) == 0:
         logger.debug('No attachments to upload')
+    elif not test_case.id:
+        log_skipped_attachments(test_case)
+        return
     for file_path, attachment_type in test_case.attachments:
-        try:
-            api.upload_attachment(file_path, attachment_type, test_case.id)
-            # If it's an assistant attachment we should delete it after successful upload
-            if AttachmentTypes.is_assistant_attachment(attachment_type):
-                if os.path.exists(file_path):
-                    logger.debug(f'Deleting assistant attachment {file_path}')
-                    os.remove(file_path)
-        except Exception as ex:
-            logger.error(f'Failed to upload attachment {attachment_type}: {file_path}', exc_info=ex)
+        if file_path not in test_case.streamed_attachments:
+            upload_attachment(api, test_case, file_path, attachment_type)
+
+
+def upload_attachment(api, test_case, file_path, attachment_type):
+    """Uploads an attachment of a registered test, returns whether it was uploaded"""
+    try:
+        api.upload_attachment(file_path, attachment_type, test_case.id)
+        # Attachments written by Tauk are deleted after a successful upload
+        if AttachmentTypes.is_generated_attachment(attachment_type):
+            if os.path.exists(file_path):
+                logger.debug(f'Deleting generated attachment {file_path}')
+                os.remove(file_path)
+        return True
+    except Exception as ex:
+        logger.error(f'Failed to upload attachment {attachment_type}: {file_path}', exc_info=ex)
+        return False
+
+
+def _report_delay(action, elapsed_ns, after):
+    time_taken = elapsed_ns / 1e9
+    metrics.registry.record(action, elapsed_ns)
+    log_with_level = logger.debug
+    title = 'TIME TAKEN:'
+    if type(after) == int and after > 0:
+        log_with_level = logger.warning
+        title = 'SLOW ACTION:'
+    if type(after) == int and time_taken > after:
+        log_with_level(f'{title} [{action}] took [{time_taken}] seconds')
 
 
 def log_delay(action_name=None, after=0):
     def inner_decorator(func):
+        action = action_name if action_name else func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_timer(*args, **kwargs):
+                t1 = time.perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _report_delay(action, time.perf_counter_ns() - t1, after)
+
+            return async_timer
+
         @wraps(func)
         def timer(*args, **kwargs):
-            t1 = time.time()
+            t1 = time.perf_counter_ns()
             try:
                 return func(*args, **kwargs)
             finally:
-                time_taken = (time.time() - t1)
-                action = action_name if action_name else func.__name__
-                log_with_level = logger.debug
-                title = 'TIME TAKEN:'
-                if type(after) == int and after > 0:
-                    log_with_level = logger.warning
-                    title = 'SLOW ACTION:'
-                if type(after) == int and time_taken > after:
-                    log_with_level(f'{title} [{action}] took [{time_taken}] seconds')
+                _report_delay(action, time.perf_counter_ns() - t1, after)
 
         return timer
 
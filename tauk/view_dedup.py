@@ -0,0 +1,40 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from tauk import metrics
+from tauk.failure_dedup import hash_artifact
+
+logger = logging.getLogger('tauk')
+
+
+class ViewDeduplicator:
+    """Remembers the hashes of the view hierarchies uploaded by this process, so a test ending on a screen which was
+    already uploaded references it instead of sending the same page source again"""
+
+    def __init__(self, max_views=256) -> None:
+        self._max_views = max_views
+        self._hashes: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dedup(self, test_case):
+        if not test_case.view:
+            return
+        view_hash = hash_artifact(test_case.view)
+        with self._lock:
+            if view_hash not in self._hashes:
+                return
+            self._hashes.move_to_end(view_hash)
+
+        test_case.view = None
+        test_case.artifact_refs = {**(test_case.artifact_refs or {}), 'view': view_hash}
+        metrics.registry.increment('view_dedup.duplicates')
+
+    def remember(self, view):
+        """Called once the view is certain to be part of the uploaded test"""
+        with self._lock:
+            view_hash = hash_artifact(view)
+            self._hashes[view_hash] = None
+            self._hashes.move_to_end(view_hash)
+            while len(self._hashes) > self._max_views:
+                self._hashes.popitem(last=False)
@@ -0,0 +1,107 @@
+"""Measures large attachment upload throughput against a local mock Tauk server, with and without sendfile
+
+Usage:
+    python -m tests.benchmark.attachments --size-mb 50 --repeat 3
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+
+from tauk.api import POST, TaukApi
+from tauk.attachments import compress_attachment
+from tauk.enums import AttachmentTypes
+from tests.benchmark.mock_server import MockTaukServer
+
+
+def _write_har(path, size):
+    # Repetitive like real HAR files, but not so much that it compresses to nothing
+    entry = {'request': {'method': 'GET', 'url': 'https://example.com/api/items'}, 'response': {'status': 200}}
+    with open(path, 'w') as file:
+        file.write('{"log": {"entries": [')
+        written, index = 0, 0
+        while written < size:
+            entry['response']['content'] = os.urandom(96).hex()
+            entry['request']['url'] = f'https://example.com/api/items/{index}'
+            line = json.dumps(entry) + ','
+            file.write(line)
+            written += len(line)
+            index += 1
+        file.write('{}]}}')
+
+
+def _serve(queue):
+    # Kept out of the measured process, it reads and decompresses every upload
+    with MockTaukServer() as server:
+        queue.put((server.api_url, server.run_id))
+        while True:
+            time.sleep(1)
+
+
+def _measure(func, repeat):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / repeat, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.benchmark.attachments')
+    parser.add_argument('--size-mb', type=float, default=50, help='size of the HAR file before compression')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(queue,), daemon=True)
+    server.start()
+    api_url, run_id = queue.get(timeout=30)
+    api = TaukApi('api-token', 'project-id', api_url=api_url)
+    api.run_id = run_id
+    url = f'{api_url}/execution/project-id/{run_id}/attachment/upload/test-id'
+    headers = {'Tauk-Attachment-Type': AttachmentTypes.NETWORK_HAR.value, 'Content-Encoding': 'gzip'}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'network.har')
+        _write_har(path, int(args.size_mb * 1024 * 1024))
+        with compress_attachment(path, AttachmentTypes.NETWORK_HAR) as staged:
+            compressed = staged.read()
+            report = {
+                'file_mb': round(os.path.getsize(path) / (1024 * 1024), 1),
+                'compressed_mb': round(len(compressed) / (1024 * 1024), 1),
+                'repeat': args.repeat,
+            }
+            # Warm up the connection pool
+            api.request(POST, url, data=compressed, headers=dict(headers))
+
+            results = {
+                # Sending the compressed body, the way it was done before sendfile
+                'send_from_memory': _measure(lambda: api.request(POST, url, data=compressed, headers=dict(headers)),
+                                             args.repeat),
+                'send_with_sendfile': _measure(lambda: api.request(POST, url, data=staged, headers=dict(headers)),
+                                               args.repeat),
+            }
+        del compressed
+        results['upload_attachment'] = _measure(
+            lambda: api.upload_attachment(path, AttachmentTypes.NETWORK_HAR, 'test-id'), args.repeat)
+
+    api.close()
+    server.terminate()
+
+    for name, (seconds, peak) in results.items():
+        report[name] = {
+            'seconds': round(seconds, 3),
+            'compressed_mb_per_second': round(report['compressed_mb'] / seconds, 1),
+            'peak_python_memory_mb': round(peak / (1024 * 1024), 1),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import base64
+import random
+import struct
+import zlib
+
+
+def make_png(color, width=4, height=3):
+    """Solid RGB image of the given color"""
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    rows = b''.join(b'\x00' + bytes(color) * width for _ in range(height))
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+
+class FakeWebDriver:
+    """WebDriver stand-in returning synthetic screenshots and page sources of a configurable size"""
+
+    def __init__(self, screenshot_size=100 * 1024, page_source_size=50 * 1024, seed=0) -> None:
+        rng = random.Random(seed)
+        # Random bytes are incompressible, just like real PNG data
+        self._screenshot = base64.b64encode(rng.randbytes(screenshot_size)).decode()
+        node = '<node index="{i}" text="Item {i}" resource-id="io.tauk.sample:id/item" class="android.widget.TextView"' \
+               ' bounds="[0,{i}][1080,{j}]" clickable="true" enabled="true"/>\n'
+        lines = []
+        size = 0
+        i = 0
+        while size < page_source_size:
+            lines.append(node.format(i=i, j=i + 40))
+            size += len(lines[-1])
+            i += 1
+        self._page_source = f'<?xml version="1.0" encoding="UTF-8"?>\n<hierarchy>\n{"".join(lines)}</hierarchy>'
+        self.capabilities = {'platformName': 'linux'}
+        self.session_id = f'fake-session-{seed}'
+        self.commands = 0
+
+    def execute(self, driver_command, params=None):
+        # Every command goes through execute, like in selenium's WebDriver
+        self.commands += 1
+        if driver_command == 'screenshot':
+            return {'value': self._screenshot}
+        elif driver_command == 'getPageSource':
+            return {'value': self._page_source}
+        return {'value': None}
+
+    def get_screenshot_as_base64(self):
+        return self.execute('screenshot')['value']
+
+    def get_screenshot_as_png(self):
+        # A different image every time, Ex: for screen recordings
+        self.execute('screenshot')
+        return make_png([self.commands % 256, 0, 0])
+
+    @property
+    def page_source(self):
+        return self.execute('getPageSource')['value']
+
+    def get_log(self, log_type):
+        return []
+
+    def quit(self):
+        self.execute('quit')
@@ -0,0 +1,134 @@
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ROUTES = [
+    ('initialize', re.compile(r'^/api/v1/execution/[^/]+/initialize$')),
+    ('upload', re.compile(r'^/api/v1/execution/[^/]+/[^/]+/report/upload$')),
+    ('test_start', re.compile(r'^/api/v1/execution/[^/]+/[^/]+/report/test/start$')),
+    ('test_finish', re.compile(r'^/api/v1/execution/[^/]+/[^/]+/report/test/finish$')),
+    ('attachment', re.compile(r'^/api/v1/execution/[^/]+/[^/]+/attachment/upload/[^/]+$')),
+    ('finish', re.compile(r'^/api/v1/execution/[^/]+/[^/]+/finish/[^/]+$')),
+]
+
+
+class MockTaukServer(ThreadingHTTPServer):
+    """In-process stand-in for the Tauk API with configurable latency and failure injection"""
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, failure_rate=0.0, record_uploads=False, seed=None) -> None:
+        super().__init__(('127.0.0.1', 0), _MockTaukHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.record_uploads = record_uploads
+        self.run_id = str(uuid.uuid4())
+        self.uploads = []
+        self.attachments = []
+        self.stats = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/v1'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='MockTaukServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self.server_close()
+
+    def should_fail(self):
+        with self._lock:
+            return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def record(self, endpoint, size, body=None):
+        with self._lock:
+            count, total = self.stats.get(endpoint, (0, 0))
+            self.stats[endpoint] = (count + 1, total + size)
+            if body is not None and self.record_uploads:
+                self.uploads.append(body)
+
+
+class _MockTaukHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle every response would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._respond(404, {'message': 'not found'})
+
+    def do_POST(self):
+        raw_body = self._read_body()
+        server: MockTaukServer = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        endpoint = next((name for name, pattern in _ROUTES if pattern.match(self.path.split('?')[0])), None)
+        if endpoint is None:
+            self._respond(404, {'message': f'unknown endpoint {self.path}'})
+            return
+        if server.should_fail():
+            server.record(f'{endpoint}_failed', len(raw_body))
+            self._respond(503, {'message': 'injected failure'})
+            return
+
+        body = gzip.decompress(raw_body) if self.headers.get('Content-Encoding') == 'gzip' else raw_body
+        if endpoint == 'initialize':
+            server.record(endpoint, len(raw_body))
+            self._respond(200, {'run_id': server.run_id, 'message': 'success'})
+        elif endpoint == 'upload':
+            test_data = json.loads(body)
+            server.record(endpoint, len(raw_body), test_data)
+            result = {}
+            for suite in test_data.get('test_suites', []):
+                tests = result.setdefault(suite.get('filename'), {})
+                for test in suite.get('test_cases', []):
+                    tests[test.get('method_name')] = test.get('id') or str(uuid.uuid4())
+            self._respond(200, {'message': 'success', 'result': result})
+        elif endpoint in ['test_start', 'test_finish']:
+            server.record(endpoint, len(raw_body))
+            self._respond(200, {'message': 'success', 'external_test_id': str(uuid.uuid4())})
+        elif endpoint == 'attachment':
+            server.record(endpoint, len(raw_body))
+            if server.record_uploads:
+                with server._lock:
+                    server.attachments.append((self.headers.get('Tauk-Attachment-Type'), body))
+            self._respond(200, {'message': 'success'})
+        else:
+            server.record(endpoint, len(raw_body))
+            self._respond(200, {'message': 'success'})
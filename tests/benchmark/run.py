@@ -0,0 +1,199 @@
+"""Measures the wall time and memory Tauk adds to each test against a local mock Tauk server
+
+Usage:
+    python -m tests.benchmark.run --mode decorator --tests 200 --latency-ms 20
+    python -m tests.benchmark.run --mode multiprocess --workers 4 --tests 100 --max-p99-overhead-ms 150
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import unittest
+
+BODY_DURATION = 0.001  # Simulated test work in seconds
+
+
+def _percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _peak_rss_mb(include_children=False):
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        usage = max(usage, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024
+
+
+def _init_tauk(multiprocess=False):
+    from tauk.config import TaukConfig
+    from tauk.tauk_webdriver import Tauk
+
+    config = TaukConfig('api-token', 'project-id', multiprocess_run=multiprocess)
+    if multiprocess:
+        config.cleanup_exec_context = False
+    Tauk(config)
+    return Tauk
+
+
+def _make_driver(args, seed=0):
+    from tests.benchmark.fake_webdriver import FakeWebDriver
+    return FakeWebDriver(args.screenshot_kb * 1024, args.view_kb * 1024, seed=seed)
+
+
+body_durations = []
+
+
+def synthetic_test(driver, fail):
+    from tauk.tauk_webdriver import Tauk
+
+    t1 = time.perf_counter()
+    Tauk.register_driver(driver)
+    time.sleep(BODY_DURATION)
+    body_durations.append(time.perf_counter() - t1)
+    assert not fail, 'synthetic failure'
+
+
+def run_decorator_mode(args):
+    Tauk = _init_tauk()
+    driver = _make_driver(args)
+    totals = []
+    for i in range(args.tests):
+        test = Tauk.observe()(synthetic_test)
+        t1 = time.perf_counter()
+        try:
+            test(driver, i < args.tests * args.fail_ratio)
+        except AssertionError:
+            pass
+        totals.append(time.perf_counter() - t1)
+    Tauk.destroy()
+    return [total - body for total, body in zip(totals, body_durations)]
+
+
+def _listener_test_class(args, seed=0):
+    from tauk.tauk_webdriver import Tauk
+
+    driver = _make_driver(args, seed)
+
+    def make_test(fail):
+        def test(self):
+            t1 = time.perf_counter()
+            Tauk.register_driver(driver, unittestcase=self)
+            time.sleep(BODY_DURATION)
+            body_durations.append(time.perf_counter() - t1)
+            self.assertFalse(fail, 'synthetic failure')
+        return test
+
+    methods = {f'test_{i:05d}': make_test(i < args.tests * args.fail_ratio) for i in range(args.tests)}
+    return type('SyntheticTest', (unittest.TestCase,), methods)
+
+
+def run_listener_mode(args, multiprocess=False, seed=0):
+    from tauk.listeners.unittest_listener import TaukListener
+    from tauk.listeners.unittest_multiprocess_listener import TaukMultiprocessListener
+
+    base_listener = TaukMultiprocessListener if multiprocess else TaukListener
+    totals = []
+
+    class TimedListener(base_listener):
+        def startTest(self, test):
+            self._t1 = time.perf_counter()
+            super().startTest(test)
+
+        def stopTest(self, test):
+            super().stopTest(test)
+            totals.append(time.perf_counter() - self._t1)
+
+    Tauk = None if multiprocess else _init_tauk()
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(_listener_test_class(args, seed))
+    unittest.TextTestRunner(stream=io.StringIO(), resultclass=TimedListener).run(suite)
+    if Tauk:
+        Tauk.destroy()
+    return [total - body for total, body in zip(totals, body_durations)]
+
+
+def run_multiprocess_mode(args):
+    Tauk = _init_tauk(multiprocess=True)
+    cmd = [sys.executable, '-m', 'tests.benchmark.run', '--worker', '--tests', str(args.tests),
+           '--screenshot-kb', str(args.screenshot_kb), '--view-kb', str(args.view_kb),
+           '--fail-ratio', str(args.fail_ratio)]
+    workers = [subprocess.Popen(cmd + ['--seed', str(i)], stdout=subprocess.PIPE) for i in range(args.workers)]
+
+    overheads = []
+    for worker in workers:
+        out, _ = worker.communicate()
+        if worker.returncode != 0:
+            raise RuntimeError(f'benchmark worker failed with exit code {worker.returncode}')
+        overheads.extend(json.loads(out.decode().strip().splitlines()[-1])['overheads'])
+    Tauk.destroy()
+    return overheads
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.benchmark.run')
+    parser.add_argument('--mode', choices=['decorator', 'listener', 'multiprocess'], default='decorator')
+    parser.add_argument('--tests', type=int, default=100, help='number of tests (per worker in multiprocess mode)')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes in multiprocess mode')
+    parser.add_argument('--screenshot-kb', type=int, default=100)
+    parser.add_argument('--view-kb', type=int, default=50)
+    parser.add_argument('--fail-ratio', type=float, default=0.1, help='fraction of tests which fail')
+    parser.add_argument('--latency-ms', type=float, default=0, help='latency added to each mock API call')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of mock API calls which fail')
+    parser.add_argument('--max-p99-overhead-ms', type=float, help='exit with an error above this p99 overhead')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--seed', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Log level is read when tauk is first imported
+    os.environ.setdefault('TAUK_LOG_LEVEL', 'WARNING')
+    import tauk  # noqa: F401
+
+    if args.worker:
+        overheads = run_listener_mode(args, multiprocess=True, seed=args.seed)
+        print(json.dumps({'overheads': overheads}))
+        return
+
+    from tests.benchmark.mock_server import MockTaukServer
+
+    with MockTaukServer(latency=args.latency_ms / 1000, failure_rate=args.failure_rate, seed=1) as server:
+        os.environ['TAUK_API_URL'] = server.api_url
+        # Keep the execution files of the benchmark away from real runs
+        os.environ['TAUK_EXEC_DIR'] = os.path.join(os.environ['TAUK_HOME'], 'benchmark', str(os.getpid()))
+
+        t1 = time.perf_counter()
+        if args.mode == 'decorator':
+            overheads = run_decorator_mode(args)
+        elif args.mode == 'listener':
+            overheads = run_listener_mode(args)
+        else:
+            overheads = run_multiprocess_mode(args)
+        wall_time = time.perf_counter() - t1
+
+    overheads_ms = [overhead * 1000 for overhead in overheads]
+    report = {
+        'mode': args.mode,
+        'tests': len(overheads_ms),
+        'wall_time_s': round(wall_time, 3),
+        'overhead_mean_ms': round(statistics.fmean(overheads_ms), 3) if overheads_ms else 0,
+        'overhead_p50_ms': round(_percentile(overheads_ms, 50), 3),
+        'overhead_p99_ms': round(_percentile(overheads_ms, 99), 3),
+        'peak_rss_mb': round(_peak_rss_mb(include_children=args.mode == 'multiprocess'), 1),
+        'api_calls': {endpoint: {'count': count, 'bytes': size} for endpoint, (count, size) in server.stats.items()},
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.max_p99_overhead_ms is not None and report['overhead_p99_ms'] > args.max_p99_overhead_ms:
+        print(f'p99 overhead {report["overhead_p99_ms"]}ms exceeds {args.max_p99_overhead_ms}ms', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Measures the bytes needed to upload the view hierarchies of a run with generated Appium (UiAutomator2) page sources,
+with gzip as it is done today, with views deduplicated by content hash and with dictionary compression
+
+Usage:
+    python -m tests.benchmark.views --tests 500 --screens 8
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+import zlib
+
+from tauk.capture_policy import CapturePolicy
+from tauk.context.test_case import TestCase
+from tauk.enums import TestStatus
+
+# Deflate can only reference the last 32 KB, a bigger preset dictionary is wasted
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 110 * 1024
+PACKAGE = 'com.example.shop'
+WORDS = ['order', 'shipped', 'delivered', 'cart', 'item', 'price', 'discount', 'review', 'account', 'settings',
+         'wishlist', 'payment', 'address', 'return', 'support', 'gift', 'card', 'coupon', 'size', 'color']
+
+
+def _node(cls, bounds, text='', resource_id='', clickable=False, scrollable=False, children=(), index=0):
+    attributes = {
+        'index': index, 'package': PACKAGE, 'class': cls, 'text': text, 'resource-id': resource_id,
+        'checkable': 'false', 'checked': 'false', 'clickable': str(clickable).lower(), 'enabled': 'true',
+        'focusable': str(clickable).lower(), 'focused': 'false', 'long-clickable': 'false', 'password': 'false',
+        'scrollable': str(scrollable).lower(), 'selected': 'false', 'displayed': 'true',
+        'bounds': '[{},{}][{},{}]'.format(*bounds),
+    }
+    attrs = ' '.join(f'{name}="{value}"' for name, value in attributes.items())
+    if not children:
+        return f'<{cls} {attrs} />'
+    inner = ''.join(child if isinstance(child, str) else _node(**child, index=i) for i, child in enumerate(children))
+    return f'<{cls} {attrs}>{inner}</{cls}>'
+
+
+def _row(rng, top, item):
+    title = ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+    return {
+        'cls': 'android.widget.LinearLayout', 'bounds': (0, top, 1080, top + 220), 'clickable': True,
+        'resource_id': f'{PACKAGE}:id/row', 'children': [
+            {'cls': 'android.widget.ImageView', 'bounds': (40, top + 30, 200, top + 190),
+             'resource_id': f'{PACKAGE}:id/thumbnail'},
+            {'cls': 'android.widget.TextView', 'bounds': (240, top + 40, 1040, top + 100), 'text': title,
+             'resource_id': f'{PACKAGE}:id/title'},
+            {'cls': 'android.widget.TextView', 'bounds': (240, top + 120, 1040, top + 170),
+             'text': f'Item #{item} - ${(item * 7919) % 500}.99', 'resource_id': f'{PACKAGE}:id/subtitle'},
+        ]}
+
+
+def page_source(screen, scroll, clock):
+    """Page source of one of the screens of the app, scrolled by a number of rows, with the status bar clock"""
+    rng = random.Random(screen * 1000 + scroll)
+    rows = [_row(rng, 300 + i * 220, screen * 100 + scroll + i) for i in range(8)]
+    content = {'cls': 'android.widget.LinearLayout', 'bounds': (0, 0, 1080, 2220), 'children': [
+        {'cls': 'android.widget.TextView', 'bounds': (40, 10, 200, 70), 'text': clock,
+         'resource_id': 'com.android.systemui:id/clock'},
+        {'cls': 'android.view.ViewGroup', 'bounds': (0, 80, 1080, 280), 'resource_id': f'{PACKAGE}:id/toolbar',
+         'children': [{'cls': 'android.widget.TextView', 'bounds': (40, 120, 800, 240),
+                       'text': f'Screen {screen}'.title()}]},
+        {'cls': 'androidx.recyclerview.widget.RecyclerView', 'bounds': (0, 280, 1080, 2060), 'scrollable': True,
+         'resource_id': f'{PACKAGE}:id/list', 'children': rows},
+        {'cls': 'android.widget.LinearLayout', 'bounds': (0, 2060, 1080, 2220),
+         'resource_id': f'{PACKAGE}:id/bottom_navigation', 'children': [
+             {'cls': 'android.widget.FrameLayout', 'bounds': (i * 270, 2060, (i + 1) * 270, 2220), 'clickable': True,
+              'resource_id': f'{PACKAGE}:id/nav_{name}', 'text': name.title()}
+             for i, name in enumerate(['home', 'search', 'cart', 'account'])]},
+    ]}
+    root = {'cls': 'android.widget.FrameLayout', 'bounds': (0, 0, 1080, 2220), 'children': [content]}
+    return '<?xml version="1.0" encoding="UTF-8"?><hierarchy index="0" class="hierarchy" rotation="0" ' \
+           f'width="1080" height="2220">{_node(**root)}</hierarchy>'
+
+
+def generate_views(tests, screens, seconds_between_tests, seed=0):
+    """The view each test ended on, tests end on a few screens and the clock moves on every minute"""
+    rng = random.Random(seed)
+    views = []
+    for i in range(tests):
+        minute = i * seconds_between_tests // 60
+        views.append(page_source(rng.randrange(screens), rng.randrange(3), f'{9 + minute // 60}:{minute % 60:02d}'))
+    return views
+
+
+def _zlib_dictionary(samples):
+    # The last bytes of the dictionary are the closest, so every training view gets an even share of them
+    share = ZLIB_DICTIONARY_SIZE // len(samples)
+    return b''.join(sample[-share:] for sample in samples)
+
+
+def _zlib_compress(data, dictionary):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=dictionary)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _measure(views, compress):
+    started = time.perf_counter()
+    sizes = [compress(view) for view in views]
+    elapsed = time.perf_counter() - started
+    return {'bytes': sum(sizes), 'ms_per_view': round(elapsed * 1000 / len(views), 3)}
+
+
+def _dedup(views):
+    """The views left to upload after content hash deduplication, and the size of the references sent instead"""
+    policy = CapturePolicy().dedup_views()
+    uploaded, refs_size = [], 0
+    for view in views:
+        test_case = TestCase()
+        test_case.status = TestStatus.PASSED
+        test_case.view = view
+        policy.apply(test_case)
+        if test_case.view:
+            uploaded.append(test_case.view)
+        else:
+            refs_size += len(json.dumps({'artifact_refs': test_case.artifact_refs}))
+    return uploaded, refs_size
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='tests.benchmark.views')
+    parser.add_argument('--tests', type=int, default=500)
+    parser.add_argument('--screens', type=int, default=8, help='number of distinct screens tests end on')
+    parser.add_argument('--seconds-between-tests', type=int, default=20)
+    parser.add_argument('--train', type=int, default=20, help='views used to build the compression dictionaries')
+    args = parser.parse_args()
+
+    views = [view.encode() for view in generate_views(args.tests, args.screens, args.seconds_between_tests)]
+    samples = views[:args.train]
+    zlib_dictionary = _zlib_dictionary(samples)
+    unique_views, refs_size = _dedup([view.decode() for view in views])
+    unique_views = [view.encode() for view in unique_views]
+
+    results = {
+        'raw': _measure(views, len),
+        'gzip': _measure(views, lambda view: len(gzip.compress(view))),
+        'dedup_gzip': _measure(unique_views, lambda view: len(gzip.compress(view))),
+        'zlib_dictionary': _measure(views, lambda view: len(_zlib_compress(view, zlib_dictionary))),
+        'dedup_zlib_dictionary': _measure(unique_views, lambda view: len(_zlib_compress(view, zlib_dictionary))),
+    }
+    for name in ['dedup_gzip', 'dedup_zlib_dictionary']:
+        results[name]['bytes'] += refs_size
+    for name in ['zlib_dictionary', 'dedup_zlib_dictionary']:
+        results[name]['dictionary_bytes'] = len(zlib_dictionary)
+
+    try:
+        import zstandard
+    except ImportError:
+        results['zstd_dictionary'] = 'skipped, pip install zstandard'
+    else:
+        dictionary = zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples)
+        compressor = zstandard.ZstdCompressor(level=3, dict_data=dictionary)
+        results['zstd'] = _measure(views, lambda view: len(zstandard.ZstdCompressor(level=3).compress(view)))
+        results['zstd_dictionary'] = _measure(views, lambda view: len(compressor.compress(view)))
+        results['zstd_dictionary']['dictionary_bytes'] = len(dictionary.as_bytes())
+
+    gzip_bytes = results['gzip']['bytes']
+    for result in results.values():
+        if isinstance(result, dict):
+            result['saved_vs_gzip'] = f'{(1 - result["bytes"] / gzip_bytes) * 100:.1f}%'
+    print(json.dumps({
+        'tests': args.tests,
+        'unique_views': len(unique_views),
+        'mean_view_kb': round(sum(map(len, views)) / len(views) / 1024, 1),
+        **results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
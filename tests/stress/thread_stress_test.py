@@ -0,0 +1,80 @@
+"""Runs observed tests on a thread pool against a local mock Tauk server and checks every result is attributed to
+the test which produced it
+
+Usage:
+    python -m pytest tests/stress
+    TAUK_STRESS_THREADS=8 TAUK_STRESS_TESTS=100 python -m pytest tests/stress
+"""
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tauk.tauk_webdriver import Tauk
+from tests.benchmark.fake_webdriver import FakeWebDriver
+from tests.utils import MockServerTestCase
+
+THREADS = int(os.getenv('TAUK_STRESS_THREADS', '64'))
+TESTS_PER_THREAD = int(os.getenv('TAUK_STRESS_TESTS', '1000'))
+
+
+def synthetic_test(driver, thread_no, index):
+    Tauk.register_driver(driver)
+    Tauk.add_user_data('thread', str(thread_no))
+    Tauk.add_user_data('index', str(index))
+    # Let other threads run in the middle of the test
+    time.sleep(0)
+    assert index % 10 != 0, 'synthetic failure'
+
+
+class ThreadStressTest(MockServerTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.test = Tauk.observe()(synthetic_test)
+
+    def _run_thread(self, thread_no, tests, durations):
+        driver = FakeWebDriver(screenshot_size=1024, page_source_size=1024, seed=thread_no)
+        driver.capabilities = {'platformName': 'linux', 'thread': thread_no}
+        for index in range(tests):
+            t1 = time.perf_counter()
+            try:
+                self.test(driver, thread_no, index)
+            except AssertionError:
+                pass
+            durations.append((time.perf_counter(), time.perf_counter() - t1))
+
+    def _run(self, threads, tests):
+        durations = []
+        t1 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='stress') as executor:
+            for future in [executor.submit(self._run_thread, thread_no, tests, durations)
+                           for thread_no in range(threads)]:
+                future.result()
+        return threads * tests / (time.perf_counter() - t1), [duration for _, duration in sorted(durations)]
+
+    def test_attribution_and_throughput(self):
+        baseline, _ = self._run(1, min(TESTS_PER_THREAD, 200))
+        self.server.uploads.clear()
+
+        throughput, durations = self._run(THREADS, TESTS_PER_THREAD)
+        print(f'\n{THREADS} threads x {TESTS_PER_THREAD} tests: {throughput:.0f} tests/s '
+              f'(single thread: {baseline:.0f} tests/s)')
+
+        seen = set()
+        for upload in self.server.uploads:
+            suites = upload['test_suites']
+            self.assertEqual(1, len(suites))
+            self.assertEqual(1, len(suites[0]['test_cases']), 'upload contains tests of other threads')
+            test = suites[0]['test_cases'][0]
+            thread_no, index = int(test['user_data']['thread']), int(test['user_data']['index'])
+            self.assertEqual(thread_no, test['capabilities']['thread'], 'driver registered to another test')
+            self.assertEqual('failed' if index % 10 == 0 else 'passed', test['status'])
+            self.assertNotIn((thread_no, index), seen)
+            seen.add((thread_no, index))
+        self.assertEqual(THREADS * TESTS_PER_THREAD, len(seen))
+
+        # Reporting doesn't slow down as more tests have run, and threads don't make it slower than running serially
+        tenth = max(len(durations) // 10, 1)
+        self.assertLess(statistics.fmean(durations[-tenth:]), 2 * statistics.fmean(durations[:tenth]) + 0.005)
+        self.assertGreater(throughput, baseline / 2)
@@ -0,0 +1,126 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tauk.assistant.installer import AssistantInstaller
+from tauk.exceptions import TaukException
+
+BINARY = b'#!/bin/sh\necho tauk-assistant\n' * 2048
+
+
+def _build_archive(name):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        info = tarfile.TarInfo(name)
+        info.size = len(BINARY)
+        archive.addfile(info, io.BytesIO(BINARY))
+        evil = tarfile.TarInfo('../../escaped')
+        evil.size = 1
+        archive.addfile(evil, io.BytesIO(b'x'))
+    return buffer.getvalue()
+
+
+class _BinaryServer(ThreadingHTTPServer):
+    def __init__(self, archive, sha256):
+        super().__init__(('127.0.0.1', 0), _BinaryHandler)
+        self.archive = archive
+        self.sha256 = sha256
+        self.requests = []
+
+
+class _BinaryHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        if self.path.startswith('/api'):
+            body = json.dumps({'url': f'http://127.0.0.1:{self.server.server_port}/binary.tgz',
+                               'sha256': self.server.sha256}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        archive = self.server.archive
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(archive) - 1}/{len(archive)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(archive) - start))
+        self.end_headers()
+        self.wfile.write(archive[start:])
+
+
+class AssistantInstallerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.binaries_home = tempfile.TemporaryDirectory()
+        self.archive = _build_archive('tauk-assistant-linux-amd64')
+        self.server = _BinaryServer(self.archive, hashlib.sha256(self.archive).hexdigest())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.binaries_home.cleanup()
+
+    def _installer(self, version='1.0.0'):
+        return AssistantInstaller('token', version, self.binaries_home.name,
+                                  api_url=f'http://127.0.0.1:{self.server.server_port}/api',
+                                  os_name='linux', arch='amd64')
+
+    def _downloads(self):
+        return [r for r in self.server.requests if r[0] == '/binary.tgz']
+
+    def test_install_and_reuse_cache(self):
+        installer = self._installer()
+        path = installer.install()
+
+        with open(path, 'rb') as file:
+            self.assertEqual(BINARY, file.read())
+        self.assertTrue(os.access(path, os.X_OK))
+        self.assertFalse(os.path.exists(os.path.join(self.binaries_home.name, 'escaped')))
+
+        # Already installed, nothing is requested
+        self.assertTrue(installer.is_installed())
+        installer.install()
+        self.assertEqual(1, len(self._downloads()))
+
+        # Reinstalling a cached version does not download again
+        os.remove(path)
+        installer.install()
+        self.assertEqual(1, len(self._downloads()))
+
+    def test_resume_partial_download(self):
+        installer = self._installer()
+        os.makedirs(installer.cache_dir)
+        with open(os.path.join(installer.cache_dir, 'tauk-assistant.tgz.part'), 'wb') as file:
+            file.write(self.archive[:100])
+
+        installer.install()
+        self.assertEqual([('/binary.tgz', 'bytes=100-')], self._downloads())
+        with open(installer.install_path, 'rb') as file:
+            self.assertEqual(BINARY, file.read())
+
+    def test_checksum_mismatch(self):
+        self.server.sha256 = '0' * 64
+        installer = self._installer()
+        with self.assertRaises(TaukException):
+            installer.install()
+        self.assertFalse(os.path.exists(installer.install_path))
+        self.assertFalse(os.path.exists(os.path.join(installer.cache_dir, 'tauk-assistant.tgz.part')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from tauk.assistant.assistant import TaukAssistant
+from tauk.assistant.config import AssistantConfig
+from tauk.assistant.lease import AssistantLease
+
+
+class FakeAssistant(TaukAssistant):
+    """Launches and attaches without a tauk-assistant executable"""
+
+    def __init__(self, execution_dir, launched_pid) -> None:
+        config = AssistantConfig()
+        config.executable_path = sys.executable
+        super().__init__('api-token', execution_dir, config)
+        self.launched_pid = launched_pid
+        self.killed = False
+
+    def launch(self, attempts=3):
+        self._assistant_port = 8285
+        self._assistant_pid = self.launched_pid
+
+    def _attach(self, port, pid) -> bool:
+        self._assistant_port = port
+        self._assistant_pid = pid
+        return True
+
+    def is_running(self) -> bool:
+        return not self.killed
+
+    def kill(self):
+        self.killed = True
+
+
+class AssistantLeaseTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.exec_dir = self._tmp_dir.name
+        self.lease = AssistantLease(self.exec_dir)
+        # Any process which is certainly alive, standing in for the assistant and the other lease holders
+        self.other_pid = os.getppid()
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def test_read_write_delete(self):
+        self.assertIsNone(self.lease.read())
+        with self.lease:
+            self.lease.write(8285, 123, [456])
+        self.assertEqual({'port': 8285, 'pid': 123, 'holders': [456]}, self.lease.read())
+
+        self.lease.delete()
+        self.assertFalse(self.lease.exists())
+
+    def test_invalid_lease_is_ignored(self):
+        with open(self.lease.lease_file, 'w') as file:
+            file.write('{')
+        self.assertIsNone(self.lease.read())
+
+    def test_last_holder_shuts_down_the_assistant(self):
+        assistant = FakeAssistant(self.exec_dir, self.other_pid)
+        assistant.start()
+        self.assertEqual({'port': 8285, 'pid': self.other_pid, 'holders': [os.getpid()]}, self.lease.read())
+
+        assistant.stop()
+        self.assertTrue(assistant.killed)
+        self.assertFalse(self.lease.exists())
+
+    def test_shared_assistant_is_left_to_the_other_holders(self):
+        self.lease.write(8285, self.other_pid, [self.other_pid])
+        assistant = FakeAssistant(self.exec_dir, launched_pid=None)
+        assistant.start()
+        self.assertEqual([self.other_pid, os.getpid()], self.lease.read()['holders'])
+
+        assistant.stop()
+        self.assertFalse(assistant.killed)
+        self.assertEqual({'port': 8285, 'pid': self.other_pid, 'holders': [self.other_pid]}, self.lease.read())
+
+    def test_lease_of_a_relaunched_assistant_is_left_alone(self):
+        assistant = FakeAssistant(self.exec_dir, self.other_pid)
+        assistant.start()
+        # The assistant died and another process launched a new one
+        self.lease.write(8286, self.other_pid + 1, [self.other_pid])
+
+        assistant.stop()
+        self.assertFalse(assistant.killed)
+        self.assertEqual({'port': 8286, 'pid': self.other_pid + 1, 'holders': [self.other_pid]}, self.lease.read())
+
+    def test_assistant_is_shut_down_when_the_lease_is_missing(self):
+        assistant = FakeAssistant(self.exec_dir, self.other_pid)
+        assistant.start()
+        self.lease.delete()
+
+        assistant.stop()
+        self.assertTrue(assistant.killed)
+        self.assertFalse(self.lease.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
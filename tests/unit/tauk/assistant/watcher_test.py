@@ -0,0 +1,57 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from tauk.assistant.watcher import AttachmentWatcher
+
+
+class AttachmentWatcherTest(unittest.TestCase):
+
+    def _watch_and_write(self, use_inotify):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            completed = []
+            page_dir = os.path.join(tmp_dir, 'page-id')
+            watcher = AttachmentWatcher(page_dir, completed.append, poll_interval=0.05, settle_time=0.2,
+                                        use_inotify=use_inotify)
+            watcher.start()
+            try:
+                with open(os.path.join(page_dir, 'console_logs.json'), 'w') as file:
+                    file.write('[]')
+
+                deadline = time.monotonic() + 5
+                while not completed and time.monotonic() < deadline:
+                    time.sleep(0.05)
+            finally:
+                watcher.stop()
+
+            self.assertEqual([os.path.join(page_dir, 'console_logs.json')], completed)
+
+    def test_inotify(self):
+        self._watch_and_write(use_inotify=True)
+
+    def test_polling(self):
+        self._watch_and_write(use_inotify=False)
+
+    def test_stop_returns_files_still_in_flight(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            started, release = threading.Event(), threading.Event()
+
+            def slow_upload(file_path):
+                started.set()
+                release.wait(5)
+
+            watcher = AttachmentWatcher(tmp_dir, slow_upload, poll_interval=0.05, settle_time=0.1, use_inotify=False)
+            watcher.start()
+            file_path = os.path.join(tmp_dir, 'network.har')
+            with open(file_path, 'w') as file:
+                file.write('{}')
+            self.assertTrue(started.wait(5))
+
+            self.assertEqual({file_path}, watcher.stop(timeout=0.1))
+            release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
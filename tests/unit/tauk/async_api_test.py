@@ -0,0 +1,155 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tauk.context.test_case import TestCase as TaukTestCase
+from tauk.enums import AttachmentTypes
+from tauk.exceptions import TaukException
+
+try:
+    import aiohttp
+    from tauk.async_api import AsyncTaukApi
+except ImportError:
+    aiohttp = None
+
+
+class _StubServer:
+    """Minimal asyncio HTTP/1.1 server answering the Tauk endpoints used by the tests"""
+
+    def __init__(self, delay=0.0) -> None:
+        self.delay = delay
+        self.requests = []
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server = None
+
+    @property
+    def api_url(self):
+        return f'http://127.0.0.1:{self._server.sockets[0].getsockname()[1]}/api/v1'
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while request_line := await reader.readline():
+                method, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in [b'\r\n', b'']:
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                if headers.get('content-encoding') == 'gzip':
+                    body = gzip.decompress(body)
+
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(self.delay)
+                self.in_flight -= 1
+
+                self.requests.append((method, path, headers, body))
+                status, response = self._respond(path, body)
+                payload = json.dumps(response).encode()
+                writer.write(f'HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _respond(path, body):
+        if path.endswith('/initialize'):
+            return 200, {'run_id': 'run-id'}
+        elif path.endswith('/report/upload'):
+            data = json.loads(body)
+            return 200, {'result': {suite['filename']: {test['method_name']: 'test-id'
+                                                        for test in suite['test_cases']}
+                                    for suite in data['test_suites']}}
+        elif '/attachment/upload/bad' in path:
+            return 500, {'message': 'failed'}
+        return 200, {'message': 'success'}
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncTaukApiTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.server = await _StubServer(delay=0.05).__aenter__()
+        with mock.patch.dict(os.environ, {'TAUK_API_URL': self.server.api_url}):
+            self.api = AsyncTaukApi('api-token', 'project-id', max_concurrent_uploads=4)
+
+    async def asyncTearDown(self) -> None:
+        await self.api.close()
+        await self.server.__aexit__(None, None, None)
+
+    async def test_upload(self):
+        from tauk.context.test_data import TestData
+
+        self.assertEqual('run-id', await self.api.initialize_run(TestData()))
+        result = await self.api.upload(json.dumps({'test_suites': [
+            {'filename': 'test_file.py', 'test_cases': [{'method_name': 'test_method'}]}]}))
+
+        self.assertEqual({'test_file.py': {'test_method': 'test-id'}}, result)
+        method, path, headers, _ = self.server.requests[-1]
+        self.assertEqual('/api/v1/execution/project-id/run-id/report/upload', path)
+        self.assertEqual('Bearer api-token', headers['authorization'])
+
+    async def test_concurrent_attachment_uploads(self):
+        self.api.run_id = 'run-id'
+        test_case = TaukTestCase()
+        test_case.id = 'test-id'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i in range(8):
+                file_path = os.path.join(tmp_dir, f'attachment-{i}.log')
+                with open(file_path, 'w') as file:
+                    file.write(f'log line {i}\n' * 100)
+                test_case.add_attachment(file_path, AttachmentTypes.ASSISTANT_CONSOLE_LOGS)
+
+            await self.api.upload_attachments(test_case)
+            # Assistant attachments are deleted once uploaded
+            self.assertEqual([], os.listdir(tmp_dir))
+
+        self.assertEqual(8, len(self.server.requests))
+        self.assertEqual(4, self.server.max_in_flight)
+        # Requests share the pooled connections of the session
+        self.assertLessEqual(self.server.connections, 4)
+        self.assertEqual({f'log line {i}\n'.encode() * 100 for i in range(8)},
+                         {body for _, _, _, body in self.server.requests})
+
+    async def test_failed_attachment(self):
+        self.api.run_id = 'run-id'
+        with tempfile.NamedTemporaryFile(suffix='.log') as file:
+            with self.assertRaises(TaukException):
+                await self.api.upload_attachment(file.name, AttachmentTypes.ASSISTANT_BROWSER_LOGS, 'bad')
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncTaukApiSessionTest(unittest.TestCase):
+
+    def test_session_is_recreated_for_new_event_loop(self):
+        async def request(api, server):
+            async with server:
+                api._API_URL = server.api_url
+                await api.finish_execution()
+                return api._session
+
+        api = AsyncTaukApi('api-token', 'project-id')
+        first = asyncio.run(request(api, _StubServer()))
+        second = asyncio.run(request(api, _StubServer()))
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        api.close_sync()
+        self.assertTrue(second.closed)
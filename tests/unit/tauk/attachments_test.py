@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+import random
+import ssl
+import tempfile
+import unittest
+from unittest import mock
+
+import requests.certs
+
+from tauk import file_upload
+from tauk.api import TaukApi
+from tauk.attachments import compress_attachment, compress_file, shrink_log
+from tauk.config import TaukConfig
+from tauk.enums import AttachmentTypes
+from tauk.exceptions import TaukException
+from tests.benchmark.mock_server import MockTaukServer
+
+
+class AttachmentCompressionTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write(self, data: bytes):
+        path = os.path.join(self.tmp_dir.name, 'console_logs.json')
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+    def test_small_attachment_is_compressed_as_is(self):
+        data = json.dumps([{'level': 'error', 'message': 'boom'}] * 10).encode()
+        compressed = compress_attachment(self._write(data), AttachmentTypes.ASSISTANT_CONSOLE_LOGS)
+        self.assertEqual(data, gzip.decompress(compressed))
+
+    def test_oversized_log_keeps_head_and_tail(self):
+        rng = random.Random(7)
+        entries = [{'level': 'error', 'message': f'{i} {rng.getrandbits(256):x}'} for i in range(5000)]
+        data = json.dumps(entries).encode()
+
+        compressed = compress_attachment(self._write(data), AttachmentTypes.ASSISTANT_CONSOLE_LOGS, max_size=32_000)
+        self.assertLessEqual(len(compressed), 32_000)
+
+        trimmed = json.loads(gzip.decompress(compressed))
+        self.assertEqual(entries[0], trimmed[0])
+        self.assertEqual(entries[-1], trimmed[-1])
+        self.assertTrue(any('omitted' in entry['message'] for entry in trimmed))
+
+    def test_repeated_messages_are_deduplicated(self):
+        entries = [{'level': 'error', 'message': 'same'}] * 100 + [{'level': 'error', 'message': 'other'}]
+        trimmed = json.loads(gzip.decompress(shrink_log(json.dumps(entries).encode())))
+        self.assertEqual([{'level': 'error', 'message': 'same', 'tauk_repeat_count': 100},
+                          {'level': 'error', 'message': 'other'}], trimmed)
+
+    def test_large_output_is_staged_in_a_file(self):
+        data = os.urandom(64 * 1024)
+        staged = compress_file(self._write(data), staging_size=1024)
+        self.assertTrue(file_upload.is_file_body(staged))
+        with staged:
+            self.assertEqual(data, gzip.decompress(staged.read()))
+        self.assertIsInstance(compress_file(self._write(data)), bytes)
+
+    def test_size_limit_is_configurable_per_type(self):
+        config = TaukConfig('api-token', 'project-id')
+        self.assertEqual(1 << 20, config.get_attachment_size_limit(AttachmentTypes.ASSISTANT_CONSOLE_LOGS))
+        self.assertEqual(50 << 20, config.get_attachment_size_limit(AttachmentTypes.NETWORK_HAR))
+        config.set_attachment_size_limit(AttachmentTypes.NETWORK_HAR, 1000)
+        self.assertEqual(1000, config.get_attachment_size_limit(AttachmentTypes.NETWORK_HAR))
+        with self.assertRaises(TaukException):
+            config.set_attachment_size_limit(AttachmentTypes.NETWORK_HAR, 0)
+
+        with self.assertRaises(TaukException):
+            compress_attachment(self._write(os.urandom(4000)), AttachmentTypes.NETWORK_HAR,
+                                config.get_attachment_size_limit(AttachmentTypes.NETWORK_HAR))
+
+
+class LargeAttachmentUploadTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = MockTaukServer(record_uploads=True).__enter__()
+        self.api = TaukApi('api-token', 'project-id', api_url=self.server.api_url)
+        self.api.run_id = self.server.run_id
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.api.close()
+        self.tmp_dir.cleanup()
+        self.server.__exit__(None, None, None)
+
+    def test_large_attachment_is_sent_with_sendfile(self):
+        path = os.path.join(self.tmp_dir.name, 'network.har')
+        data = os.urandom(3 << 20)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+        with mock.patch('tauk.api.send_file', wraps=file_upload.send_file) as send_file:
+            self.api.upload_attachment(path, AttachmentTypes.NETWORK_HAR, 'test-id')
+        self.assertEqual(1, send_file.call_count)
+        self.assertEqual([(AttachmentTypes.NETWORK_HAR.value, data)], self.server.attachments)
+
+    def test_large_attachment_is_sent_again_on_retry(self):
+        self.server.failure_rate = 1.0
+        self.api.retry_policy.base_delay = 0.01
+        path = os.path.join(self.tmp_dir.name, 'network.har')
+        with open(path, 'wb') as file:
+            file.write(os.urandom(2 << 20))
+
+        with self.assertRaises(TaukException):
+            self.api.upload_attachment(path, AttachmentTypes.NETWORK_HAR, 'test-id')
+        count, size = self.server.stats['attachment_failed']
+        self.assertEqual(3, count)
+        self.assertEqual(0, size % count)
+        self.assertGreater(size, 3 * (2 << 20))
+
+    def test_https_uses_the_ca_bundle_of_the_environment(self):
+        ca_bundle = os.path.join(self.tmp_dir.name, 'ca.pem')
+        with open(requests.certs.where(), 'rb') as source, open(ca_bundle, 'wb') as file:
+            file.write(source.read())
+
+        with open(ca_bundle, 'rb') as body, mock.patch.dict(os.environ, {'REQUESTS_CA_BUNDLE': ca_bundle}), \
+                mock.patch('ssl.create_default_context', wraps=ssl.create_default_context) as create_context:
+            # Nothing listens on the port, the TLS context is created before connecting
+            with self.assertRaises(OSError):
+                file_upload.send_file('POST', 'https://127.0.0.1:1/attachments', {}, body, (1, 1))
+        create_context.assert_called_once_with(cafile=ca_bundle)
+
+
+if __name__ == '__main__':
+    unittest.main()
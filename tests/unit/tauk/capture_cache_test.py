@@ -0,0 +1,160 @@
+import unittest
+
+from tauk import metrics
+from tauk.capture_cache import CaptureCache, capture_cache
+from tauk.context import current_test
+from tauk.context.test_case import TestCase as TaukTestCase
+from tests.benchmark.fake_webdriver import FakeWebDriver
+
+
+def _driver_failing_after_quit(seed):
+    """Fails every command once quit, like a real driver"""
+    driver = FakeWebDriver(1024, 1024, seed=seed)
+    execute = driver.execute
+
+    def failing_execute(driver_command, params=None):
+        if driver.is_quit:
+            raise ConnectionError('driver was quit')
+        driver.is_quit = driver_command == 'quit'
+        return execute(driver_command, params)
+
+    driver.is_quit = False
+    driver.execute = failing_execute
+    return driver
+
+
+class UntrackedWebDriver:
+    """Driver without execute, Ex: a wrapper around a WebDriver"""
+
+    def __init__(self) -> None:
+        self.session_id = 'untracked-session'
+        self.commands = 0
+
+    def get_screenshot_as_base64(self):
+        self.commands += 1
+        return 'c2NyZWVu'
+
+
+class CaptureCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        metrics.registry.enabled = True
+        metrics.registry.reset()
+        self.cache = CaptureCache()
+
+    def tearDown(self) -> None:
+        metrics.registry.enabled = False
+        metrics.registry.reset()
+
+    def test_captures_are_reused_until_a_command_changes_the_screen(self):
+        driver = FakeWebDriver(1024, 1024, seed=101)
+        self.cache.track(driver)
+        self.cache.track(driver)
+
+        for _ in range(3):
+            self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.assertEqual(1, driver.commands)
+        # The screen recorder and other read only commands don't make the capture stale
+        driver.get_screenshot_as_png()
+        self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.assertEqual(2, driver.commands)
+
+        driver.execute('clickElement')
+        self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.assertEqual(4, driver.commands)
+        self.assertEqual(3, metrics.registry.snapshot()['counters']['capture_cache.hits'])
+
+    def test_untracked_drivers_are_only_reused_once_quit(self):
+        driver = UntrackedWebDriver()
+        self.cache.track(driver)
+        self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.assertEqual(2, driver.commands)
+
+        self.cache.mark_quit(driver)
+        self.assertEqual('c2NyZWVu', self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64))
+        self.assertEqual(2, driver.commands)
+
+    def test_drivers_beyond_max_sessions_are_wrapped_once(self):
+        cache = CaptureCache(max_sessions=2)
+        drivers = [FakeWebDriver(16, 16, seed=seed) for seed in range(5)]
+        quits = []
+        test_case = TaukTestCase()
+        for driver in drivers:
+            cache.register(driver, test_case, lambda quitting, current: quits.append(quitting))
+        wrappers = [(driver.execute, driver.quit) for driver in drivers]
+        for _ in range(3):
+            for driver in drivers:
+                cache.register(driver, test_case, lambda quitting, current: quits.append(quitting))
+        self.assertEqual(wrappers, [(driver.execute, driver.quit) for driver in drivers])
+
+        for driver in drivers:
+            driver.execute('clickElement')
+            driver.quit()
+        self.assertEqual(drivers, quits)
+
+    def test_new_driver_session_starts_with_empty_captures(self):
+        driver = FakeWebDriver(16, 16, seed=105)
+        self.cache.track(driver)
+        self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.cache.mark_quit(driver)
+
+        driver.session_id = 'restarted-session'
+        self.cache.track(driver)
+        self.cache.capture(driver, 'screenshot', driver.get_screenshot_as_base64)
+        self.assertEqual(2, driver.commands)
+
+
+class SharedDriverCaptureTest(unittest.TestCase):
+
+    def test_quit_captures_are_used_by_the_running_test(self):
+        driver = _driver_failing_after_quit(seed=102)
+        first = TaukTestCase()
+        first.register_driver(driver)
+        first.capture_success_data()
+        self.assertEqual(2, driver.commands)
+
+        # The quit callback was attached by the first test, the second one still gets the captures taken at quit
+        second = TaukTestCase()
+        second.register_driver(driver)
+        driver.execute('clickElement')
+        driver.quit()
+        second.capture_success_data()
+
+        self.assertEqual(6, driver.commands)
+        self.assertEqual(first.screenshot, second.screenshot)
+        self.assertIsNotNone(second.view)
+
+    def test_module_cache_is_shared(self):
+        driver = FakeWebDriver(1024, 1024, seed=103)
+        test_case = TaukTestCase()
+        test_case.register_driver(driver)
+        capture_cache.capture(driver, 'view', lambda: driver.page_source)
+        test_case.capture_view_hierarchy()
+        self.assertEqual(1, driver.commands)
+
+    def test_quit_is_wrapped_once_and_captures_go_to_the_current_test(self):
+        driver = FakeWebDriver(1024, 1024, seed=104)
+        first = TaukTestCase()
+        first.register_driver(driver)
+        quit = driver.quit
+        second = TaukTestCase()
+        second.register_driver(driver)
+        self.assertIs(quit, driver.quit)
+
+        driver.quit()
+        self.assertIsNone(first.screenshot)
+        self.assertEqual(driver.get_screenshot_as_base64(), second.screenshot)
+        self.assertIsNotNone(second.view)
+
+    def test_quit_captures_go_to_the_test_running_when_quit(self):
+        driver = FakeWebDriver(1024, 1024, seed=106)
+        first = TaukTestCase()
+        first.register_driver(driver)
+        second = TaukTestCase()
+        second.register_driver(driver)
+
+        with current_test.test_scope('file.py', first):
+            driver.quit()
+        self.assertIsNotNone(first.screenshot)
+        self.assertIsNone(second.screenshot)
@@ -0,0 +1,187 @@
+import unittest
+from unittest import mock
+
+from tauk import metrics
+from tauk.capture_policy import CapturePolicy
+from tauk.context.test_case import TestCase as TaukTestCase
+from tauk.context.test_error import TestError as TaukTestError
+from tauk.enums import ScreenshotModes, TestStatus as Status
+from tauk.failure_dedup import hash_artifact
+from tests.utils import upload_with_policy
+
+try:
+    import PIL
+except ImportError:
+    PIL = None
+
+
+def _test_case(status):
+    test_case = TaukTestCase()
+    test_case.method_name = 'test_method'
+    test_case.status = status
+    test_case.screenshot = 'A' * 1000
+    test_case.view = '<view>' + 'V' * 5000 + '</view>'
+    test_case.log = [{'message': 'L' * 100}] * 50
+    test_case.error = TaukTestError()
+    test_case.error.error_type = 'AssertionError'
+    test_case.error.error_msg = 'expected true'
+    test_case.error.line_number = 50
+    test_case.error.traceback = 'T' * 10000
+    test_case.code_context = [{'line_number': i, 'line_code': f'line {i}'} for i in range(21, 80)]
+    return test_case
+
+
+class CapturePolicyTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        metrics.registry.enabled = True
+        metrics.registry.reset()
+
+    def tearDown(self) -> None:
+        metrics.registry.enabled = False
+        metrics.registry.reset()
+
+    def test_default_policy_keeps_everything(self):
+        test_case = _test_case(Status.PASSED)
+        self.assertEqual(0, CapturePolicy.default().apply(test_case))
+        self.assertIsNotNone(test_case.view)
+        self.assertEqual({}, metrics.registry.snapshot()['counters'])
+
+    def test_lean_policy(self):
+        policy = CapturePolicy.lean()
+        self.assertFalse(policy.should_capture_view(Status.PASSED))
+        self.assertTrue(policy.should_capture_view(Status.FAILED))
+        self.assertTrue(policy.should_capture_view(None))
+
+        passed = _test_case(Status.PASSED)
+        saved = policy.apply(passed)
+        self.assertIsNone(passed.view)
+        self.assertIsNone(passed.log)
+        self.assertEqual(saved, metrics.registry.snapshot()['counters']['capture_policy.bytes_saved'])
+
+        failed = _test_case(Status.FAILED)
+        self.assertEqual(0, policy.apply(failed))
+        self.assertIsNotNone(failed.view)
+
+    def test_capture_skips_driver_calls(self):
+        test_case = TaukTestCase()
+        test_case.driver_instance = mock.Mock()
+        policy = CapturePolicy().on_pass(view=False, screenshot=ScreenshotModes.NONE)
+        test_case.capture_success_data(policy)
+        test_case.driver_instance.get_screenshot_as_base64.assert_not_called()
+        self.assertIsNone(test_case.view)
+
+    def test_max_payload_trims_by_priority(self):
+        policy = CapturePolicy()
+        policy.max_payload_size = 14000
+        test_case = _test_case(Status.FAILED)
+        policy.apply(test_case)
+
+        # The view and the log are the first to go and are enough here
+        self.assertIsNone(test_case.view)
+        self.assertIsNone(test_case.log)
+        self.assertIsNotNone(test_case.screenshot)
+        self.assertEqual(59, len(test_case.code_context))
+
+        policy.max_payload_size = 1000
+        policy.apply(test_case)
+        self.assertIsNone(test_case.screenshot)
+        self.assertIsNone(test_case.code_context)
+        self.assertLess(len(test_case.error.traceback), 4100)
+        self.assertEqual('expected true', test_case.error.error_msg)
+
+        counters = metrics.registry.snapshot()['counters']
+        self.assertIn('capture_policy.bytes_saved.view', counters)
+        self.assertIn('capture_policy.bytes_saved.error', counters)
+
+    def test_narrows_code_context_around_error(self):
+        policy = CapturePolicy()
+        test_case = _test_case(Status.FAILED)
+        test_case.view = test_case.log = test_case.screenshot = None
+        policy.max_payload_size = 11500
+        policy.apply(test_case)
+        self.assertEqual(list(range(45, 56)), [line['line_number'] for line in test_case.code_context])
+
+    @unittest.skipIf(PIL is None, 'Pillow is not installed')
+    def test_thumbnail(self):
+        import base64
+        import io
+        from PIL import Image
+
+        output = io.BytesIO()
+        Image.effect_noise((1280, 720), 64).save(output, format='PNG')
+        test_case = _test_case(Status.PASSED)
+        test_case.screenshot = base64.b64encode(output.getvalue()).decode()
+
+        CapturePolicy.lean().apply(test_case)
+        thumbnail = Image.open(io.BytesIO(base64.b64decode(test_case.screenshot)))
+        self.assertEqual((320, 180), thumbnail.size)
+
+    def test_dedup_views(self):
+        policy = CapturePolicy().dedup_views(max_views=2)
+        views = [_test_case(Status.PASSED).view, '<view>other</view>', '<view>third</view>']
+        first = _test_case(Status.PASSED)
+        upload_with_policy(policy, first)
+        self.assertEqual(views[0], first.view)
+
+        repeat = _test_case(Status.FAILED)
+        saved = upload_with_policy(policy, repeat)
+        self.assertIsNone(repeat.view)
+        self.assertEqual({'view': hash_artifact(views[0])}, repeat.artifact_refs)
+        self.assertGreater(saved, 5000)
+        self.assertEqual(1, metrics.registry.snapshot()['counters']['view_dedup.duplicates'])
+
+        # Only the most recently uploaded views are remembered
+        for view in views[1:]:
+            test_case = _test_case(Status.PASSED)
+            test_case.view = view
+            upload_with_policy(policy, test_case)
+        test_case = _test_case(Status.PASSED)
+        upload_with_policy(policy, test_case)
+        self.assertEqual(views[0], test_case.view)
+
+    def test_dedup_views_skips_views_dropped_for_max_payload(self):
+        policy = CapturePolicy().dedup_views()
+        policy.max_payload_size = 4000
+        test_case = _test_case(Status.PASSED)
+        upload_with_policy(policy, test_case)
+        self.assertIsNone(test_case.view)
+
+        policy.max_payload_size = None
+        test_case = _test_case(Status.PASSED)
+        policy.apply(test_case)
+        self.assertIsNotNone(test_case.view)
+        self.assertIsNone(test_case.artifact_refs)
+
+    def test_dedup_views_skips_views_of_tests_which_were_not_uploaded(self):
+        policy = CapturePolicy().dedup_views()
+        test_case = _test_case(Status.PASSED)
+        policy.apply(test_case)
+        # The upload failed or the results were spooled, so there is no test id
+        policy.remember_uploaded(test_case)
+
+        test_case = _test_case(Status.PASSED)
+        upload_with_policy(policy, test_case)
+        self.assertIsNotNone(test_case.view)
+        self.assertIsNone(test_case.artifact_refs)
+
+    def test_dedup_failures_skips_artifacts_dropped_for_max_payload(self):
+        policy = CapturePolicy().dedup_failures()
+        policy.max_payload_size = 4000
+        first = _test_case(Status.FAILED)
+        upload_with_policy(policy, first)
+        self.assertIsNone(first.view)
+        self.assertIsNone(first.screenshot)
+
+        # The first failure uploaded neither, so the repeat has to upload them instead of referencing them
+        policy.max_payload_size = None
+        repeat = _test_case(Status.FAILED)
+        upload_with_policy(policy, repeat)
+        self.assertIsNotNone(repeat.view)
+        self.assertIsNotNone(repeat.screenshot)
+        self.assertIsNone(repeat.artifact_refs)
+
+        again = _test_case(Status.FAILED)
+        upload_with_policy(policy, again)
+        self.assertEqual({'screenshot': hash_artifact(repeat.screenshot), 'view': hash_artifact(repeat.view)},
+                         again.artifact_refs)
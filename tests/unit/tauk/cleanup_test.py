@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from tauk import cleanup
+
+
+class CleanupTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tauk_home = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _write(self, *parts, size=10, age=0):
+        path = os.path.join(self.tauk_home, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'x' * size)
+        if age:
+            mtime = time.time() - age
+            os.utime(path, (mtime, mtime))
+            os.utime(os.path.dirname(path), (mtime, mtime))
+        return os.path.dirname(path)
+
+    def _dead_pid(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        return process.pid
+
+    def test_scan_and_prune(self):
+        project = 'a' * 32
+        self._write('logs', 'tauk-webdriver.log', size=100)
+        self._write('binaries', 'tauk-assistant', size=1000)
+        self._write('ports.json', size=5)
+        alive_dir = self._write(project, str(os.getpid()), 'exec.run', size=20)
+        dead_dir = self._write(project, str(self._dead_pid()), 'exec.run', size=30, age=120)
+        fresh_dead_dir = self._write(project, str(self._dead_pid() + 100000), 'exec.run', size=40)
+        expired_dir = self._write(project, str(os.getppid()), 'exec.run', size=50, age=7200)
+
+        report = cleanup.scan(self.tauk_home, ttl=3600)
+        self.assertEqual(100, report.usage[cleanup.LOGS].bytes)
+        self.assertEqual(1000, report.usage[cleanup.BINARIES].bytes)
+        self.assertEqual(5, report.usage[cleanup.OTHERS].bytes)
+        self.assertEqual(140, report.usage[cleanup.EXECUTIONS].bytes)
+        self.assertEqual({dead_dir, expired_dir}, {exec_dir.path for exec_dir in report.stale_exec_dirs})
+
+        cleanup.prune(report, workers=2)
+        self.assertEqual(80, report.freed_bytes)
+        self.assertTrue(os.path.exists(alive_dir))
+        self.assertTrue(os.path.exists(fresh_dead_dir))
+        self.assertFalse(os.path.exists(dead_dir))
+        self.assertFalse(os.path.exists(expired_dir))
+
+    def test_scan_skips_exec_dirs_deleted_while_scanning(self):
+        project = 'a' * 32
+        exec_dirs = [self._write(project, str(pid), 'exec.run', size=10) for pid in range(1000, 1004)]
+
+        def delete_others(category, path, size):
+            # Like another process pruning its own exec dir during the scan
+            for exec_dir in exec_dirs:
+                if not path.startswith(exec_dir) and os.path.exists(exec_dir):
+                    shutil.rmtree(exec_dir)
+
+        report = cleanup.scan(self.tauk_home, on_file=delete_others)
+        self.assertEqual(1, len(report.exec_dirs))
+        self.assertEqual(10, report.usage[cleanup.EXECUTIONS].bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import logging
+import threading
+import unittest
+
+from tauk.context import current_test
+from tauk.context.test_case import TestCase as TaukTestCase
+from tauk.context.test_data import TestData
+from tauk.exceptions import TaukException
+from tauk.log_formatter import CustomJsonFormatter
+
+
+class CurrentTestTest(unittest.TestCase):
+
+    def test_each_thread_sees_its_own_test(self):
+        formatter = CustomJsonFormatter('%(message)s')
+        test_data = TestData()
+        barrier = threading.Barrier(8)
+        results = {}
+
+        def run(thread_no):
+            test_case = TaukTestCase()
+            test_case.method_name = 'test_shared_name'
+            test_data.add_test_case('test_file.py', test_case)
+            with current_test.test_scope('test_file.py', test_case):
+                barrier.wait()
+                record = logging.LogRecord('tauk', logging.WARNING, __file__, 1, f'thread {thread_no}', None, None)
+                results[thread_no] = (current_test.get_current_test().test_case is test_case, json.loads(formatter.format(record)))
+            test_data.delete_test_case('test_file.py', test_case)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsNone(current_test.get_current_test())
+        self.assertEqual([], test_data.get_test_suite('test_file.py').test_cases)
+        for thread_no, (is_own_test, log_record) in results.items():
+            self.assertTrue(is_own_test)
+            self.assertEqual('test_file.py', log_record['suite'])
+            self.assertEqual('test_shared_name', log_record['test'])
+
+    def test_current_test_cannot_be_started_again(self):
+        test_data = TestData()
+        test_case = TaukTestCase()
+        test_case.method_name = 'test_listened'
+        test_data.add_test_case('test_file.py', test_case)
+
+        observed = TaukTestCase()
+        observed.method_name = 'test_listened'
+        with current_test.test_scope('test_file.py', test_case):
+            with self.assertRaises(TaukException):
+                test_data.add_test_case('test_file.py', observed)
+            # Tests of other files may have the same name
+            test_data.add_test_case('other_file.py', observed)
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tauk.context import journal
+from tauk.context.journal import RunJournal
+from tauk.tauk_webdriver import Tauk
+from tests.utils import MockServerTestCase
+
+
+def _append_records(path, count):
+    run_journal = RunJournal(path)
+    for i in range(count):
+        run_journal.append(journal.START, f'{os.getpid()}-{i}', {'index': i}, os.urandom(512))
+    run_journal.close()
+
+
+def _synthetic_test():
+    Tauk.add_user_data('crashed', 'before upload')
+
+
+def _crashing_test():
+    os._exit(1)
+
+
+def _crash_before_upload(handle):
+    Tauk.attach(handle)
+    with mock.patch.object(Tauk, '_upload_test_case', side_effect=lambda *args: os._exit(1)):
+        Tauk.observe()(_synthetic_test)()
+
+
+def _crash_during_test(handle):
+    Tauk.attach(handle)
+    Tauk.observe()(_crashing_test)()
+
+
+class RunJournalTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'run.journal')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_records_are_read_back(self):
+        run_journal = RunJournal(self.path)
+        run_journal.append(journal.START, '1-0', {'method_name': 'test_a'})
+        run_journal.append(journal.FINISH, '1-0', {'method_name': 'test_a'}, b'\x00payload\n')
+        run_journal.close()
+
+        records = RunJournal(self.path).read()
+        self.assertEqual([journal.START, journal.FINISH], [record.type for record in records])
+        self.assertEqual(['1-0', '1-0'], [record.key for record in records])
+        self.assertEqual({'method_name': 'test_a'}, records[1].meta)
+        self.assertEqual(b'\x00payload\n', records[1].data)
+        self.assertEqual(os.getpid(), records[0].pid)
+
+    def test_journal_grows_past_its_capacity(self):
+        run_journal = RunJournal(self.path)
+        data = os.urandom(1024 * 1024)
+        for i in range(10):
+            run_journal.append(journal.FINISH, f'1-{i}', data=data)
+        self.assertGreater(os.path.getsize(self.path), journal.INITIAL_CAPACITY)
+        self.assertEqual([data] * 10, [record.data for record in run_journal.read()])
+        run_journal.close()
+
+    def test_reported_records_are_compacted_instead_of_growing(self):
+        run_journal = RunJournal(self.path)
+        run_journal.append(journal.START, 'running', {'index': 0})
+        data = os.urandom(512 * 1024)
+        for i in range(20):
+            run_journal.append(journal.START, f'1-{i}', data=data)
+            run_journal.append(journal.REPORTED, f'1-{i}')
+        self.assertEqual(journal.INITIAL_CAPACITY, os.path.getsize(self.path))
+
+        records = run_journal.read()
+        self.assertEqual(('running', {'index': 0}), (records[0].key, records[0].meta))
+        reported = {record.key for record in records if record.type == journal.REPORTED}
+        self.assertEqual(['running'], [record.key for record in records if record.key not in reported])
+        run_journal.close()
+
+    def test_uncommitted_records_are_skipped(self):
+        run_journal = RunJournal(self.path)
+        run_journal.append(journal.START, '1-0')
+        run_journal.append(journal.START, '1-1')
+        run_journal.close()
+        # Process crashed before committing the first record
+        with open(self.path, 'r+b') as file:
+            file.seek(journal.FILE_HEADER_SIZE)
+            file.write(bytes([journal.RESERVED]))
+
+        self.assertEqual(['1-1'], [record.key for record in RunJournal(self.path).read()])
+
+    def test_processes_append_concurrently(self):
+        processes = [multiprocessing.Process(target=_append_records, args=(self.path, 500)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        records = RunJournal(self.path).read()
+        self.assertEqual(2000, len(records))
+        self.assertEqual(2000, len({record.key for record in records}))
+
+    def test_claimed_records_are_not_claimed_again(self):
+        run_journal = RunJournal(self.path)
+        run_journal.append(journal.START, '1-0')
+        select = lambda records: [r for r in records if r.type == journal.START and len(records) == 1]
+        self.assertEqual(['1-0'], [record.key for record in run_journal.claim(select)])
+        self.assertEqual([], run_journal.claim(select))
+        self.assertEqual(journal.REPORTED, run_journal.read()[-1].type)
+        run_journal.close()
+
+    def test_only_claimed_records_data_is_read(self):
+        run_journal = RunJournal(self.path)
+        run_journal.append(journal.FINISH, '1-0', {'index': 0}, b'first\nresult')
+        run_journal.append(journal.FINISH, '1-1', {'index': 1}, b'second result')
+
+        def select(records):
+            self.assertEqual([None, None], [record.data for record in records])
+            return [record for record in records if record.meta['index'] == 0]
+
+        self.assertEqual([b'first\nresult'], [record.data for record in run_journal.claim(select)])
+        run_journal.close()
+
+
+class ReconcileTest(MockServerTestCase):
+
+    def test_tests_of_crashed_workers_are_reported(self):
+        handle = Tauk.get_run_handle()
+        context = multiprocessing.get_context('spawn')
+        for target in [_crash_before_upload, _crash_during_test]:
+            process = context.Process(target=target, args=(handle,))
+            process.start()
+            process.join()
+            self.assertEqual(1, process.exitcode)
+        self.assertEqual(0, len(self.server.uploads))
+
+        self.assertEqual(2, Tauk.reconcile())
+        self.assertEqual(0, Tauk.reconcile())
+        self.assertEqual([], os.listdir(os.path.join(handle.exec_dir, 'journal')))
+
+        test_cases = [upload['test_suites'][0]['test_cases'][0] for upload in self.server.uploads]
+        test_cases = {test_case['method_name']: test_case for test_case in test_cases}
+        self.assertEqual({'crashed': 'before upload'}, test_cases['_synthetic_test']['user_data'])
+        self.assertEqual('passed', test_cases['_synthetic_test']['status'])
+        self.assertEqual('failed', test_cases['_crashing_test']['status'])
+        self.assertEqual('ProcessExited', test_cases['_crashing_test']['error']['error_type'])
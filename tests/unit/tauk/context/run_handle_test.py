@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+from tauk.tauk_webdriver import Tauk
+from tests.utils import MockServerTestCase
+
+
+def _synthetic_test(index):
+    Tauk.add_user_data('index', str(index))
+
+
+def _run_in_worker(index):
+    Tauk.observe()(_synthetic_test)(index)
+    return os.getpid()
+
+
+class RunHandleTest(MockServerTestCase):
+
+    def test_handle_is_picklable(self):
+        handle = pickle.loads(pickle.dumps(Tauk.get_run_handle()))
+        self.assertEqual(self.server.run_id, handle.run_id)
+        self.assertEqual(self.server.api_url, handle.api_url)
+        self.assertEqual(self.exec_dir.name, handle.exec_dir)
+        self.assertNotIn('api-token', repr(handle))
+        # Attaching to the run this process already reports into is a no-op
+        self.assertIs(Tauk.instance, Tauk.attach(handle))
+
+    def test_workers_attach_to_parent_run(self):
+        handle = Tauk.get_run_handle()
+        # The workers don't inherit the environment the run was configured with
+        with mock.patch.dict(os.environ, {'TAUK_API_URL': 'http://127.0.0.1:1/api/v1', 'TAUK_EXEC_DIR': ''}):
+            for method in ['spawn', 'fork']:
+                with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context(method),
+                                         initializer=Tauk.attach, initargs=(handle,)) as executor:
+                    pids = set(executor.map(_run_in_worker, range(10)))
+                self.assertNotIn(os.getpid(), pids)
+
+        self.assertEqual(1, self.server.stats['initialize'][0])
+        self.assertNotIn('finish', self.server.stats)
+        self.assertEqual(20, len(self.server.uploads))
+        self.assertEqual(sorted([str(i) for i in range(10)] * 2),
+                         sorted(upload['test_suites'][0]['test_cases'][0]['user_data']['index']
+                                for upload in self.server.uploads))
+        # Workers leave the execution dir to the parent
+        self.assertTrue(os.path.isdir(self.exec_dir.name))
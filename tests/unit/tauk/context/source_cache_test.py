@@ -0,0 +1,69 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+
+from tauk.context import source_cache
+from tauk.context.test_case import TestCase as TaukTestCase
+
+
+def _load_module(path):
+    spec = importlib.util.spec_from_file_location(f'source_cache_sample_{os.path.basename(path)[:-3]}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SourceCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        source_cache.cache_clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'sample_test.py')
+        body = ''.join(f'    step_{i} = {i}\n' for i in range(100))
+        with open(self.path, 'w') as file:
+            file.write(f'def test_long():\n{body}    assert False\n\n\ndef test_short():\n    assert False\n')
+        self.module = _load_module(self.path)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_window_around_error(self):
+        lines = [line['line_number'] for line in source_cache.get_code_context(self.module.test_long, 102)]
+        self.assertEqual(list(range(73, 103)), lines)
+
+        lines = [line['line_number'] for line in source_cache.get_code_context(self.module.test_long, 50)]
+        self.assertEqual(list(range(21, 80)), lines)
+
+        # Errors outside the function only report its first lines
+        self.assertEqual(59, len(source_cache.get_code_context(self.module.test_long)))
+        context = source_cache.get_code_context(self.module.test_short, 106)
+        self.assertEqual([{'line_number': 105, 'line_code': 'def test_short():\n'},
+                          {'line_number': 106, 'line_code': '    assert False\n'}], context)
+
+    def test_source_is_read_once(self):
+        for _ in range(10):
+            source_cache.get_code_context(self.module.test_long, 102)
+            source_cache.get_source_line(self.path, 102)
+        self.assertEqual(1, source_cache._read_source_lines.cache_info().misses)
+        self.assertEqual(1, source_cache._get_window.cache_info().misses)
+
+        # Edited files are read again
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        source_cache.get_code_context(self.module.test_long, 102)
+        self.assertEqual(2, source_cache._read_source_lines.cache_info().misses)
+
+    def test_capture_failure_data(self):
+        test_case = TaukTestCase()
+        try:
+            self.module.test_long()
+        except AssertionError:
+            test_case.capture_failure_data('sample_test.py', sys.exc_info(), self.module.test_long)
+
+        self.assertEqual(102, test_case.error.line_number)
+        self.assertEqual('test_long', test_case.error.invoked_func)
+        self.assertEqual('assert False', test_case.error.code_executed)
+        self.assertEqual(102, test_case.code_context[-1]['line_number'])
+        self.assertEqual(30, len(test_case.code_context))
@@ -0,0 +1,94 @@
+import threading
+import unittest
+
+import responses
+
+from tauk.api import TaukApi
+from tauk.deadline import Deadline, MIN_TIMEOUT, clamp_timeout, deadline_scope, is_budget_spent
+from tauk.retry import RetryPolicy
+from tauk.uploader import BackgroundUploader
+
+UPLOAD_URL = 'https://www.tauk.com/api/v1/execution/project-id/run-id/report/upload'
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_countdown_starts_with_reporting(self):
+        clock = _Clock()
+        deadline = Deadline(5, clock=clock)
+        clock.now = 100
+        self.assertFalse(deadline.expired)
+        self.assertEqual((3, 10), deadline.clamp((3, 10)))
+
+        deadline.start()
+        clock.now = 102
+        self.assertEqual(3, deadline.remaining())
+        self.assertEqual((3, 3), deadline.clamp((3, 10)))
+        self.assertEqual(3, deadline.clamp(None))
+
+        clock.now = 110
+        self.assertTrue(deadline.expired)
+        self.assertEqual(MIN_TIMEOUT, deadline.clamp(10))
+
+    def test_scope(self):
+        clock = _Clock()
+        self.assertFalse(is_budget_spent())
+        self.assertEqual(10, clamp_timeout(10))
+
+        with deadline_scope(Deadline(1, clock=clock).start()):
+            self.assertFalse(is_budget_spent())
+            clock.now = 1
+            self.assertTrue(is_budget_spent('view hierarchy capture'))
+            self.assertEqual(MIN_TIMEOUT, clamp_timeout(10))
+        self.assertFalse(is_budget_spent())
+
+    def test_unlimited(self):
+        with deadline_scope(Deadline().start()):
+            self.assertFalse(is_budget_spent())
+            self.assertEqual((3, 10), clamp_timeout((3, 10)))
+
+    @responses.activate
+    def test_no_retries_past_deadline(self):
+        responses.add(responses.POST, UPLOAD_URL, status=503)
+        api = TaukApi('api-token', 'project-id', retry_policy=RetryPolicy(base_delay=1, max_delay=1))
+        api.run_id = 'run-id'
+        try:
+            with deadline_scope(Deadline(0.5).start()):
+                self.assertEqual(503, api.request('POST', UPLOAD_URL).status_code)
+        finally:
+            api.close()
+        # The retry delay can be shorter than the budget thanks to the jitter
+        self.assertLessEqual(len(responses.calls), 3)
+
+
+class BackgroundUploaderTest(unittest.TestCase):
+
+    def test_drain(self):
+        uploader = BackgroundUploader()
+        done = []
+        release = threading.Event()
+
+        def upload(value):
+            release.wait(5)
+            done.append(value)
+
+        def fail():
+            raise RuntimeError('upload failed')
+
+        uploader.submit(upload, 1)
+        uploader.submit(fail)
+        uploader.submit(upload, value=2)
+        self.assertFalse(uploader.drain(timeout=0.05))
+
+        release.set()
+        self.assertTrue(uploader.drain(timeout=5))
+        self.assertEqual([1, 2], done)
+        self.assertEqual(0, uploader.pending)
@@ -0,0 +1,96 @@
+import sys
+import unittest
+from unittest import mock
+
+from tauk import metrics
+from tauk.capture_policy import CapturePolicy
+from tauk.context.test_case import TestCase as TaukTestCase
+from tests.utils import upload_with_policy
+
+
+def _broken_fixture():
+    raise ConnectionError('backend is down')
+
+
+def _fail(test_case, policy, driver):
+    test_case.driver_instance = driver
+    try:
+        _broken_fixture()
+    except ConnectionError:
+        test_case.capture_failure_data('failure_dedup_test.py', sys.exc_info(), _fail, policy)
+
+
+class FailureDedupTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        metrics.registry.enabled = True
+        metrics.registry.reset()
+        self.driver = mock.Mock()
+        self.driver.get_screenshot_as_base64.return_value = 'S' * 1000
+        self.page_source = mock.PropertyMock(return_value='<hierarchy/>')
+        type(self.driver).page_source = self.page_source
+        del self.driver.contexts
+
+    def tearDown(self) -> None:
+        metrics.registry.enabled = False
+        metrics.registry.reset()
+
+    def test_identical_failures_reference_first_occurrence(self):
+        policy = CapturePolicy().dedup_failures(skip_view_after=2)
+        tests = [TaukTestCase() for _ in range(4)]
+        for test_case in tests:
+            _fail(test_case, policy, self.driver)
+            upload_with_policy(policy, test_case)
+
+        first, second, third, fourth = [test_case.to_json() for test_case in tests]
+        self.assertEqual(len({test['fingerprint'] for test in [first, second, third, fourth]}), 1)
+        self.assertIn('screenshot', first)
+        self.assertIn('view', first)
+        self.assertNotIn('artifact_refs', first)
+
+        for test in [second, third, fourth]:
+            self.assertNotIn('screenshot', test)
+            self.assertNotIn('view', test)
+            self.assertEqual({'screenshot', 'view'}, set(test['artifact_refs']))
+            self.assertEqual('ConnectionError', test['error'].error_type)
+
+        # The view hierarchy isn't requested once the failure happened twice
+        self.assertEqual(2, self.page_source.call_count)
+        counters = metrics.registry.snapshot()['counters']
+        self.assertEqual(2, counters['failure_dedup.views_skipped'])
+        self.assertEqual(3, counters['failure_dedup.duplicates'])
+
+    def test_different_screenshots_are_kept(self):
+        policy = CapturePolicy().dedup_failures()
+        first, second = TaukTestCase(), TaukTestCase()
+        _fail(first, policy, self.driver)
+        self.driver.get_screenshot_as_base64.return_value = 'T' * 1000
+        _fail(second, policy, self.driver)
+        upload_with_policy(policy, first)
+        upload_with_policy(policy, second)
+
+        self.assertEqual('T' * 1000, second.screenshot)
+        self.assertEqual({'view'}, set(second.artifact_refs))
+        self.assertIsNone(second.view)
+
+    def test_artifacts_of_tests_which_were_not_uploaded_are_not_referenced(self):
+        policy = CapturePolicy().dedup_failures()
+        first, second = TaukTestCase(), TaukTestCase()
+        _fail(first, policy, self.driver)
+        policy.apply(first)
+        # The upload failed or the results were spooled, so there is no test id
+        policy.remember_uploaded(first)
+        _fail(second, policy, self.driver)
+        upload_with_policy(policy, second)
+
+        self.assertIsNone(second.artifact_refs)
+        self.assertEqual('S' * 1000, second.screenshot)
+        self.assertEqual('<hierarchy/>', second.view)
+
+    def test_disabled_by_default(self):
+        policy = CapturePolicy()
+        test_case = TaukTestCase()
+        _fail(test_case, policy, self.driver)
+        policy.apply(test_case)
+        self.assertIsNone(test_case.fingerprint)
+        self.assertIsNotNone(test_case.view)
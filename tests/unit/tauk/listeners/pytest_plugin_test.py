@@ -0,0 +1,136 @@
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from unittest import mock
+
+from tests.benchmark.mock_server import MockTaukServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+
+TESTS = textwrap.dedent('''
+    import pytest
+    from tauk.enums import AttachmentTypes
+
+    def test_pass(tauk, tmp_path):
+        tauk.add_user_data('key', 'value')
+        har = tmp_path / 'network.har'
+        har.write_text('{"log": {}}')
+        tauk.add_attachment(str(har), AttachmentTypes.NETWORK_HAR)
+
+    def test_fail():
+        assert 1 == 2
+
+    @pytest.mark.skip(reason='not today')
+    def test_skip():
+        pass
+
+    @pytest.mark.tauk(custom_name='Custom name')
+    def test_custom_name():
+        pass
+
+    class TestGroup:
+        def test_in_class(self):
+            pass
+''')
+
+TEARDOWN_ERROR_TESTS = textwrap.dedent('''
+    import pytest
+
+    @pytest.fixture
+    def broken_teardown():
+        yield
+        raise RuntimeError('teardown failed')
+
+    def test_teardown_error(broken_teardown):
+        pass
+''')
+
+REPEATED_FAILURE_TESTS = textwrap.dedent('''
+    import pytest
+    from tests.benchmark.fake_webdriver import FakeWebDriver
+
+    @pytest.mark.parametrize('attempt', [1, 2])
+    def test_repeat(tauk, attempt):
+        tauk.register_driver(FakeWebDriver(1024, 1024, seed=1))
+        assert False
+''')
+
+
+class PytestPluginTest(unittest.TestCase):
+
+    def _run_pytest(self, server, *args, tests=TESTS, summary='1 failed, 3 passed, 1 skipped'):
+        with tempfile.TemporaryDirectory() as project_dir:
+            with open(os.path.join(project_dir, 'test_sample.py'), 'w') as file:
+                file.write(tests)
+
+            env = dict(os.environ, PYTHONPATH=ROOT_DIR, TAUK_API_URL=server.api_url, TAUK_API_TOKEN='api-token',
+                       TAUK_PROJECT_ID='project-id', TAUK_LOG_LEVEL='WARNING')
+            env.pop('TAUK_EXEC_DIR', None)
+            result = subprocess.run([sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+                                     '-p', 'tauk.listeners.pytest_plugin', '--tauk', *args],
+                                    cwd=project_dir, env=env, capture_output=True, text=True, timeout=120)
+            self.assertIn(summary, result.stdout, result.stdout + result.stderr)
+
+        test_cases = {}
+        for upload in server.uploads:
+            for suite in upload.get('test_suites', []):
+                for test_case in suite['test_cases']:
+                    test_cases[test_case['method_name']] = (suite, test_case)
+        return test_cases
+
+    def _assert_results(self, test_cases):
+        self.assertEqual({'test_pass', 'test_fail', 'test_skip', 'test_custom_name', 'test_in_class'},
+                         set(test_cases.keys()))
+        suite, test_pass = test_cases['test_pass']
+        self.assertEqual('test_sample.py', suite['filename'])
+        self.assertEqual('passed', test_pass['status'])
+        self.assertEqual({'key': 'value'}, test_pass['user_data'])
+        self.assertEqual('failed', test_cases['test_fail'][1]['status'])
+        self.assertEqual('AssertionError', test_cases['test_fail'][1]['error']['error_type'])
+        self.assertEqual('excluded', test_cases['test_skip'][1]['status'])
+        self.assertEqual('Custom name', test_cases['test_custom_name'][1]['custom_name'])
+        self.assertEqual('TestGroup', test_cases['test_in_class'][0]['class_name'])
+
+    def test_reports_from_single_process(self):
+        with MockTaukServer(record_uploads=True) as server:
+            test_cases = self._run_pytest(server, '--tauk-batch-size', '2')
+            self.assertEqual(3, server.stats['upload'][0])
+            self.assertEqual([('Network.har', b'{"log": {}}')], server.attachments)
+        self._assert_results(test_cases)
+
+    @unittest.skipIf(subprocess.run([sys.executable, '-c', 'import xdist'], capture_output=True).returncode != 0,
+                     'pytest-xdist is not installed')
+    def test_reports_from_xdist_controller(self):
+        with MockTaukServer(record_uploads=True) as server:
+            test_cases = self._run_pytest(server, '-n', '2')
+            # Workers never talk to Tauk, the controller initializes a single run and uploads once
+            self.assertEqual(1, server.stats['initialize'][0])
+            self.assertEqual(1, server.stats['upload'][0])
+            self.assertEqual([('Network.har', b'{"log": {}}')], server.attachments)
+        self._assert_results(test_cases)
+
+    def test_reports_teardown_errors_as_failures(self):
+        with MockTaukServer(record_uploads=True) as server:
+            test_cases = self._run_pytest(server, tests=TEARDOWN_ERROR_TESTS, summary='1 error')
+        test_case = test_cases['test_teardown_error'][1]
+        self.assertEqual('failed', test_case['status'])
+        self.assertEqual('RuntimeError', test_case['error']['error_type'])
+
+    @mock.patch.dict(os.environ, {'TAUK_DEDUP_FAILURES': 'true'})
+    def test_repeated_failures_reference_uploaded_artifacts(self):
+        with MockTaukServer(record_uploads=True) as server:
+            test_cases = self._run_pytest(server, '--tauk-batch-size', '1', tests=REPEATED_FAILURE_TESTS,
+                                          summary='2 failed')
+        self.assertIn('screenshot', test_cases['test_repeat[1]'][1])
+        self.assertNotIn('screenshot', test_cases['test_repeat[2]'][1])
+        self.assertEqual({'screenshot', 'view'}, set(test_cases['test_repeat[2]'][1]['artifact_refs']))
+
+        # Within a batch the first failure isn't uploaded yet, so the second one can't reference it
+        with MockTaukServer(record_uploads=True) as server:
+            test_cases = self._run_pytest(server, '--tauk-batch-size', '2', tests=REPEATED_FAILURE_TESTS,
+                                          summary='2 failed')
+        self.assertIn('screenshot', test_cases['test_repeat[2]'][1])
+        self.assertNotIn('artifact_refs', test_cases['test_repeat[2]'][1])
@@ -0,0 +1,46 @@
+import unittest
+
+from tauk.metrics import MetricsRegistry, timed, registry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        registry.enabled = False
+        registry.reset()
+
+    def test_disabled_registry_records_nothing(self):
+        metrics = MetricsRegistry()
+        metrics.record('upload', 1_000_000)
+        metrics.increment('bytes')
+        self.assertEqual({'actions': {}, 'counters': {}}, metrics.snapshot())
+
+    def test_histogram(self):
+        metrics = MetricsRegistry()
+        metrics.enabled = True
+        for elapsed_ms in [1, 3, 3, 40, 2000]:
+            metrics.record('upload', elapsed_ms * 1_000_000)
+
+        stats = metrics.snapshot()['actions']['upload']
+        self.assertEqual(5, stats['count'])
+        self.assertEqual(1, stats['min_ms'])
+        self.assertEqual(2000, stats['max_ms'])
+        self.assertEqual(5, stats['p50_ms'])
+        self.assertEqual(2500, stats['p99_ms'])
+        self.assertEqual({'<=1ms': 1, '<=5ms': 2, '<=50ms': 1, '<=2500ms': 1}, stats['histogram'])
+
+    def test_timed_decorator(self):
+        @timed(action_name='Capture Screenshot')
+        def capture():
+            return 'screenshot'
+
+        self.assertEqual('screenshot', capture())
+        self.assertEqual({}, registry.snapshot()['actions'])
+
+        registry.enabled = True
+        capture()
+        self.assertEqual(1, registry.snapshot()['actions']['Capture Screenshot']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
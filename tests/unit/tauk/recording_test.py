@@ -0,0 +1,150 @@
+import os
+import struct
+import tempfile
+import time
+import unittest
+
+from tauk.capture_policy import CapturePolicy
+from tauk.config import TaukConfig
+from tauk.enums import AttachmentTypes
+from tauk.recording import ApngWriter, ScreenRecorder, read_png_chunks
+from tauk.tauk_webdriver import Tauk
+from tests.benchmark.fake_webdriver import FakeWebDriver, make_png
+from tests.utils import MockServerTestCase
+
+
+def read_apng(path):
+    with open(path, 'rb') as file:
+        chunks = list(read_png_chunks(file.read()))
+    frames, = struct.unpack('>I', chunks[1][1][:4])
+    delays = [struct.unpack_from('>H', data, 20)[0] for chunk_type, data in chunks if chunk_type == b'fcTL']
+    return [chunk_type for chunk_type, _ in chunks], frames, delays
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedDriver:
+    def __init__(self, frames) -> None:
+        self.frames = list(frames)
+
+    def get_screenshot_as_png(self):
+        return self.frames.pop(0)
+
+
+def _passing_test():
+    Tauk.register_driver(FakeWebDriver(1024, 1024))
+    time.sleep(0.25)
+
+
+def _failing_test():
+    Tauk.register_driver(FakeWebDriver(1024, 1024))
+    time.sleep(0.25)
+    raise AssertionError('failed')
+
+
+class ApngWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'recording.png')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_frames_are_written_as_animation(self):
+        writer = ApngWriter(self.path)
+        for i in range(3):
+            self.assertTrue(writer.add_frame(make_png([i, i, i])))
+            writer.set_last_frame_duration(0.5 * (i + 1))
+        writer.close()
+
+        chunk_types, frames, delays = read_apng(self.path)
+        self.assertEqual(3, frames)
+        self.assertEqual([b'IHDR', b'acTL', b'fcTL', b'IDAT', b'fcTL', b'fdAT', b'fcTL', b'fdAT', b'IEND'], chunk_types)
+        self.assertEqual([500, 1000, 1500], delays)
+
+        try:
+            from PIL import Image
+        except ImportError:
+            return
+        with Image.open(self.path) as image:
+            self.assertEqual(3, image.n_frames)
+            image.seek(2)
+            self.assertEqual((2, 2, 2), image.convert('RGB').getpixel((0, 0)))
+
+    def test_frames_of_another_size_are_rejected(self):
+        writer = ApngWriter(self.path)
+        writer.add_frame(make_png([0, 0, 0]))
+        self.assertFalse(writer.add_frame(make_png([0, 0, 0], width=8)))
+        writer.close()
+        self.assertEqual(1, read_apng(self.path)[1])
+
+
+class ScreenRecorderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def _record(self, frames, frames_per_segment=300):
+        recorder = ScreenRecorder(ScriptedDriver(frames), self.tmp_dir.name, 'test', fps=1,
+                                  frames_per_segment=frames_per_segment, clock=self.clock)
+        for _ in frames:
+            recorder.capture_frame()
+            self.clock.now += 1
+        return recorder, recorder.stop()
+
+    def test_identical_frames_extend_the_previous_frame(self):
+        a, b = make_png([1, 1, 1]), make_png([2, 2, 2])
+        recorder, segments = self._record([a, a, a, b, a])
+
+        self.assertEqual((3, 2), (recorder.frames, recorder.skipped_frames))
+        self.assertEqual(1, len(segments))
+        _, frames, delays = read_apng(segments[0])
+        self.assertEqual(3, frames)
+        self.assertEqual([3000, 1000, 1000], delays)
+
+    def test_only_the_last_segments_are_kept(self):
+        recorder, segments = self._record([make_png([i, 0, 0]) for i in range(5)], frames_per_segment=2)
+
+        self.assertEqual(['test-2.png', 'test-3.png'], [os.path.basename(segment) for segment in segments])
+        self.assertEqual([2, 1], [read_apng(segment)[1] for segment in segments])
+        self.assertEqual(sorted(['test-2.png', 'test-3.png']), sorted(os.listdir(self.tmp_dir.name)))
+
+    def test_recording_samples_on_a_background_thread(self):
+        driver = FakeWebDriver(1024, 1024)
+        recorder = ScreenRecorder(driver, self.tmp_dir.name, 'test', fps=10).start()
+        time.sleep(0.35)
+        segments = recorder.stop()
+
+        self.assertGreaterEqual(recorder.frames, 2)
+        self.assertEqual(recorder.frames, read_apng(segments[0])[1])
+
+
+class ScreenRecordingReportTest(MockServerTestCase):
+
+    def tauk_config(self) -> TaukConfig:
+        config = super().tauk_config()
+        config.screen_recording_fps = 10
+        config.capture_policy = CapturePolicy.lean()
+        return config
+
+    def test_recording_is_uploaded_for_failures(self):
+        Tauk.observe()(_passing_test)()
+        with self.assertRaises(AssertionError):
+            Tauk.observe()(_failing_test)()
+
+        self.assertEqual([AttachmentTypes.SCREEN_RECORDING.value],
+                         [attachment_type for attachment_type, _ in self.server.attachments])
+        self.assertTrue(self.server.attachments[0][1].startswith(b'\x89PNG'))
+        # Uploaded and discarded recordings are both deleted
+        self.assertEqual([], os.listdir(Tauk.get_context().recordings_dir))
@@ -0,0 +1,145 @@
+import gzip
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+import responses
+
+from tauk.api import TaukApi
+from tauk.exceptions import TaukCircuitOpenException
+from tauk.retry import RetryPolicy, RetryBudget, CircuitBreaker, ResultSpool, parse_retry_after
+
+API_URL = 'https://www.tauk.com/api/v1'
+UPLOAD_URL = f'{API_URL}/execution/project-id/run-id/report/upload'
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_full_jitter_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, rand=random.Random(1))
+        for attempt, cap in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+            delay = policy.get_delay(attempt)
+            self.assertTrue(0 <= delay <= cap, f'{delay} is not within [0, {cap}] for attempt {attempt}')
+
+    def test_retry_after(self):
+        policy = RetryPolicy(max_delay=10, max_elapsed=30)
+        self.assertEqual(3, policy.get_delay(1, retry_after=3))
+        self.assertIsNone(policy.get_delay(1, retry_after=11))
+        self.assertIsNone(policy.get_delay(1, retry_after=3, elapsed=28))
+
+        self.assertEqual(120, parse_retry_after('120'))
+        self.assertEqual(30, parse_retry_after('Thu, 01 Jan 2026 00:00:30 GMT', now=1767225600))
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_budget(self):
+        budget = RetryBudget(min_retries=1, ratio=0.5)
+        self.assertTrue(budget.try_withdraw())
+        self.assertFalse(budget.try_withdraw())
+        budget.on_request()
+        budget.on_request()
+        self.assertTrue(budget.try_withdraw())
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_open_half_open_close(self):
+        clock = _Clock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        self.assertFalse(breaker.allow_request())
+
+        clock.now = 10
+        self.assertTrue(breaker.allow_request())
+        # A single trial request is let through while half open
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+
+        clock.now = 20
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+
+class TaukApiRetryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = _Clock()
+        self.api = TaukApi('api-token', 'project-id', retry_policy=RetryPolicy(base_delay=0.001),
+                           circuit_breaker=CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=self.clock))
+        self.api.run_id = 'run-id'
+
+    def tearDown(self) -> None:
+        self.api.close()
+
+    @responses.activate
+    def test_retries_server_errors(self):
+        responses.add(responses.POST, UPLOAD_URL, status=503)
+        responses.add(responses.POST, UPLOAD_URL, json={'result': {'file.py': {'test': 'test-id'}}})
+
+        self.assertEqual({'file.py': {'test': 'test-id'}}, self.api.upload('{}'))
+        self.assertEqual(2, len(responses.calls))
+
+    @responses.activate
+    def test_does_not_retry_client_errors_or_long_retry_after(self):
+        responses.add(responses.POST, UPLOAD_URL, status=400)
+        responses.add(responses.POST, UPLOAD_URL, status=429, headers={'Retry-After': '3600'})
+
+        self.assertEqual(400, self.api.request('POST', UPLOAD_URL).status_code)
+        self.assertEqual(429, self.api.request('POST', UPLOAD_URL).status_code)
+        self.assertEqual(2, len(responses.calls))
+
+    @responses.activate
+    def test_breaker_spools_and_replays(self):
+        responses.add(responses.POST, UPLOAD_URL, body=requests.ConnectionError('refused'))
+        with tempfile.TemporaryDirectory() as spool_dir:
+            self.api.spool = ResultSpool(spool_dir)
+            run_dir = os.path.join(spool_dir, 'run-id')
+
+            # 3 attempts of the first upload open the breaker, the second upload doesn't hit the network
+            self.assertEqual({}, self.api.upload('{"test_suites": [1]}'))
+            self.assertEqual(3, len(responses.calls))
+            self.assertEqual({}, self.api.upload('{"test_suites": [2]}'))
+            self.assertEqual(3, len(responses.calls))
+            self.assertEqual(2, len(os.listdir(run_dir)))
+            with self.assertRaises(TaukCircuitOpenException):
+                self.api.request('POST', UPLOAD_URL)
+
+            responses.replace(responses.POST, UPLOAD_URL, json={'result': {}})
+            self.clock.now = 30
+            self.assertEqual(2, self.api.flush_spool())
+            self.assertEqual([], os.listdir(run_dir))
+            self.assertEqual([b'{"test_suites": [1]}', b'{"test_suites": [2]}'],
+                             [gzip.decompress(call.request.body) for call in responses.calls[3:]])
+
+    @responses.activate
+    def test_only_the_spool_of_the_run_is_flushed(self):
+        responses.add(responses.POST, UPLOAD_URL, json={'result': {}})
+        with tempfile.TemporaryDirectory() as spool_dir:
+            ResultSpool(spool_dir).write('run-id', gzip.compress(b'{"test_suites": [1]}'))
+            ResultSpool(spool_dir).write('other-run-id', gzip.compress(b'{"test_suites": [2]}'))
+            self.api.spool = ResultSpool(spool_dir)
+
+            with mock.patch('os.listdir', wraps=os.listdir) as listdir:
+                self.api.upload('{}')
+                listed = listdir.call_count
+                self.api.upload('{}')
+            # Nothing was spooled since the last flush, so the spool isn't listed again
+            self.assertEqual(listed, listdir.call_count)
+            self.assertEqual([b'{"test_suites": [1]}', b'{}', b'{}'],
+                             [gzip.decompress(call.request.body) for call in responses.calls])
+            self.assertEqual(1, len(os.listdir(os.path.join(spool_dir, 'other-run-id'))))
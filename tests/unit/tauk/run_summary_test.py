@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+
+from tauk.config import TaukConfig
+from tauk.run_summary import RunSummarySink, aggregate, find_summaries, read_summary, summary_row
+from tauk.tauk_webdriver import Tauk
+from tests.benchmark.fake_webdriver import FakeWebDriver
+from tests.utils import MockServerTestCase
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _row(status, duration, platform='Android', **steps):
+    test_json = {'method_name': f'test_{status}_{duration}', 'status': status, 'platform_name': platform,
+                 'start_timestamp': 1_700_000_000_000 + duration, 'end_timestamp': 1_700_000_000_000 + 2 * duration}
+    return summary_row(test_json, 'tests/test_app.py', 'run-1', payload_size=duration * 10, step_durations=steps)
+
+
+def _observed_test():
+    Tauk.register_driver(FakeWebDriver(1024, 1024))
+
+
+class RunSummaryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'summaries', 'run.trs')
+        self.clock = FakeClock()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_rows_are_written_in_batches(self):
+        sink = RunSummarySink(self.path, batch_size=2, flush_interval=60, clock=self.clock)
+        sink.record(_row('passed', 100, upload=5.0))
+        self.assertFalse(os.path.exists(self.path))
+        sink.record(_row('failed', 200))
+        sink.record(_row('passed', 300, view=1.5))
+        self.clock.now = 61
+        sink.record(_row('passed', 400))
+
+        blocks = list(read_summary(self.path))
+        self.assertEqual([2, 2], [len(block['status']) for block in blocks])
+        self.assertEqual(['passed', 'failed'], blocks[0]['status'])
+        self.assertEqual([100, 200], blocks[0]['duration_ms'])
+        self.assertEqual([5.0, None], blocks[0]['step.upload_ms'])
+        self.assertEqual([1.5, None], blocks[1]['step.view_ms'])
+        self.assertNotIn('step.upload_ms', blocks[1])
+
+    def test_only_requested_columns_are_read(self):
+        sink = RunSummarySink(self.path)
+        sink.record(_row('passed', 100))
+        sink.close()
+
+        block, = read_summary(self.path, columns={'status', 'step.upload_ms'})
+        self.assertEqual({'status': ['passed'], 'step.upload_ms': [None]}, block)
+
+    def test_truncated_block_is_ignored(self):
+        sink = RunSummarySink(self.path)
+        sink.record(_row('passed', 100))
+        sink.flush()
+        sink.record(_row('failed', 200))
+        sink.close()
+        with open(self.path, 'r+b') as file:
+            file.truncate(os.path.getsize(self.path) - 10)
+
+        self.assertEqual([['passed']], [block['status'] for block in read_summary(self.path)])
+
+    def test_aggregate_across_runs(self):
+        for name, rows in [('a.trs', [_row('passed', 100, upload=10.0), _row('passed', 300, upload=30.0)]),
+                           ('b.trs', [_row('failed', 200, platform='iOS'), _row('passed', 200, platform='iOS')])]:
+            sink = RunSummarySink(os.path.join(self.tmp_dir.name, name))
+            for row in rows:
+                sink.record(row)
+            sink.close()
+        paths = find_summaries(self.tmp_dir.name)
+
+        report = aggregate(paths).to_json()
+        self.assertEqual((2, 1, 4), (report['files'], report['runs'], report['tests']))
+        self.assertEqual(['failed', 'passed'], list(report['groups']))
+        passed = report['groups']['passed']
+        self.assertEqual(3, passed['tests'])
+        self.assertEqual({'mean': 200, 'p50': 200, 'p90': 300, 'max': 300}, passed['duration_ms'])
+        self.assertEqual(20.0, passed['step.upload_ms']['mean'])
+
+        report = aggregate(paths, group_by='platform_name', since=1_700_000_000_000 + 150).to_json()
+        self.assertEqual({'Android': 1, 'iOS': 2}, {group: value['tests'] for group, value in report['groups'].items()})
+
+
+class RunSummaryReportTest(MockServerTestCase):
+
+    def tauk_config(self) -> TaukConfig:
+        config = super().tauk_config()
+        config.run_summary_dir = os.path.join(self.exec_dir.name, 'summaries')
+        return config
+
+    def test_reported_tests_are_summarized(self):
+        Tauk.observe()(_observed_test)()
+        Tauk.destroy()
+
+        path, = find_summaries(os.path.join(self.exec_dir.name, 'summaries'))
+        block, = read_summary(path)
+        self.assertEqual(['_observed_test'], block['method_name'])
+        self.assertEqual(['passed'], block['status'])
+        self.assertEqual([self.server.run_id], block['run_id'])
+        self.assertGreater(block['payload_bytes'][0], block['screenshot_bytes'][0])
+        for step in ['screenshot', 'view', 'serialize', 'upload', 'attachments']:
+            self.assertGreaterEqual(block[f'step.{step}_ms'][0], 0)
@@ -0,0 +1,179 @@
+import base64
+import builtins
+import io
+import os
+import unittest
+from unittest import mock
+
+from tauk import metrics
+from tauk.capture_policy import CapturePolicy
+from tauk.context.test_case import TestCase as TaukTestCase
+from tauk.enums import TestStatus as Status
+from tauk.failure_dedup import hash_artifact
+from tauk.screenshot_diff import ScreenshotDiffer
+from tests.utils import upload_with_policy
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+
+class FakeDriver:
+    def __init__(self, session_id) -> None:
+        self.session_id = session_id
+
+
+_BACKGROUND = os.urandom(256 * 192 * 3)
+
+
+def _screenshot(changed_boxes=(), size=(256, 192)):
+    # Noise, so the full screenshot doesn't compress better than a few of its tiles
+    image = Image.frombytes('RGB', size, _BACKGROUND[:size[0] * size[1] * 3])
+    draw = ImageDraw.Draw(image)
+    for box in changed_boxes:
+        draw.rectangle(box, fill=(255, 0, 0))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return base64.b64encode(output.getvalue()).decode()
+
+
+def _test_case(screenshot, session_id='session-1'):
+    test_case = TaukTestCase()
+    test_case.method_name = 'test_method'
+    test_case.status = Status.PASSED
+    test_case.driver_instance = FakeDriver(session_id)
+    test_case.screenshot = screenshot
+    return test_case
+
+
+def _diff(differ, test_case):
+    # Like the capture policy, which only remembers screenshots which are uploaded in full
+    keyframe = differ.diff(test_case)
+    if keyframe:
+        differ.remember(keyframe)
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class ScreenshotDifferTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        metrics.registry.enabled = True
+        metrics.registry.reset()
+        self.differ = ScreenshotDiffer(tile_size=64)
+        self.keyframe = _screenshot()
+        _diff(self.differ, _test_case(self.keyframe))
+
+    def tearDown(self) -> None:
+        metrics.registry.enabled = False
+        metrics.registry.reset()
+
+    def test_identical_screenshot_references_the_last_one(self):
+        test_case = _test_case(self.keyframe)
+        _diff(self.differ, test_case)
+
+        self.assertIsNone(test_case.screenshot)
+        self.assertIsNone(test_case.screenshot_delta)
+        self.assertEqual({'screenshot': hash_artifact(self.keyframe)}, test_case.artifact_refs)
+        self.assertEqual(1, metrics.registry.snapshot()['counters']['screenshot_diff.unchanged'])
+
+    def _assert_delta_of_changed_tiles(self):
+        # Covers the tiles in columns 1 and 2 of the first row, and column 3 of the last row
+        test_case = _test_case(_screenshot([(70, 10, 140, 20), (200, 150, 210, 160)]))
+        _diff(self.differ, test_case)
+
+        self.assertIsNone(test_case.screenshot)
+        self.assertEqual({'screenshot': hash_artifact(self.keyframe)}, test_case.artifact_refs)
+        delta = test_case.screenshot_delta
+        self.assertEqual((256, 192), (delta['width'], delta['height']))
+        self.assertEqual([(64, 0), (192, 128)], [(tile['x'], tile['y']) for tile in delta['tiles']])
+        with Image.open(io.BytesIO(base64.b64decode(delta['tiles'][0]['image']))) as tile:
+            self.assertEqual((128, 64), tile.size)
+            self.assertEqual((255, 0, 0), tile.convert('RGB').getpixel((10, 15)))
+        self.assertEqual(1, metrics.registry.snapshot()['counters']['screenshot_diff.deltas'])
+
+    def test_changed_tiles_are_sent_as_delta(self):
+        self._assert_delta_of_changed_tiles()
+
+    def test_changed_tiles_are_found_without_numpy(self):
+        real_import = builtins.__import__
+
+        def import_without_numpy(name, *args, **kwargs):
+            if name == 'numpy':
+                raise ImportError(name)
+            return real_import(name, *args, **kwargs)
+
+        with mock.patch('builtins.__import__', import_without_numpy):
+            self.differ = ScreenshotDiffer(tile_size=64)
+            _diff(self.differ, _test_case(self.keyframe))
+            self._assert_delta_of_changed_tiles()
+
+    def test_mostly_changed_screenshot_becomes_the_new_keyframe(self):
+        screenshot = _screenshot([(0, 0, 200, 192)])
+        test_case = _test_case(screenshot)
+        _diff(self.differ, test_case)
+        self.assertEqual(screenshot, test_case.screenshot)
+        self.assertIsNone(test_case.artifact_refs)
+
+        test_case = _test_case(screenshot)
+        _diff(self.differ, test_case)
+        self.assertEqual({'screenshot': hash_artifact(screenshot)}, test_case.artifact_refs)
+
+    def test_sessions_are_compared_separately(self):
+        test_case = _test_case(self.keyframe, session_id='session-2')
+        _diff(self.differ, test_case)
+        self.assertEqual(self.keyframe, test_case.screenshot)
+
+        test_case = _test_case(_screenshot(size=(128, 128)))
+        _diff(self.differ, test_case)
+        self.assertIsNotNone(test_case.screenshot)
+
+    def test_policy_diffs_full_screenshots_only(self):
+        policy = CapturePolicy.lean().diff_screenshots()
+        # Passing tests only upload a thumbnail, which doesn't become the keyframe
+        test_case = _test_case(self.keyframe)
+        policy.apply(test_case)
+        self.assertIsNotNone(test_case.screenshot)
+
+        for _ in range(2):
+            test_case = _test_case(self.keyframe)
+            test_case.status = Status.FAILED
+            saved = upload_with_policy(policy, test_case)
+
+        self.assertIsNone(test_case.screenshot)
+        self.assertEqual(len(self.keyframe) + 2, saved)
+        self.assertIn('DiffScreenshots=True', str(policy))
+
+    def test_screenshots_dropped_for_max_payload_are_not_keyframes(self):
+        policy = CapturePolicy().diff_screenshots()
+        policy.max_payload_size = 1000
+        screenshot = _screenshot([(0, 0, 10, 10)])
+        upload_with_policy(policy, _test_case(screenshot))
+
+        policy.max_payload_size = None
+        test_case = _test_case(screenshot)
+        policy.apply(test_case)
+        self.assertEqual(screenshot, test_case.screenshot)
+
+    def test_dropping_the_delta_for_max_payload_drops_the_keyframe_ref(self):
+        policy = CapturePolicy().diff_screenshots()
+        upload_with_policy(policy, _test_case(self.keyframe))
+
+        policy.max_payload_size = 2000
+        test_case = _test_case(_screenshot([(70, 10, 140, 20)]))
+        policy.apply(test_case)
+        self.assertIsNone(test_case.screenshot_delta)
+        # On its own the keyframe would show the screen of the previous test
+        self.assertIsNone(test_case.artifact_refs)
+
+    def test_screenshots_of_tests_which_were_not_uploaded_are_not_keyframes(self):
+        policy = CapturePolicy().diff_screenshots()
+        test_case = _test_case(self.keyframe)
+        policy.apply(test_case)
+        # The upload failed or the results were spooled, so there is no test id
+        policy.remember_uploaded(test_case)
+
+        test_case = _test_case(self.keyframe)
+        upload_with_policy(policy, test_case)
+        self.assertEqual(self.keyframe, test_case.screenshot)
+        self.assertIsNone(test_case.artifact_refs)
@@ -0,0 +1,96 @@
+import os
+import socket
+import tempfile
+import unittest
+from contextlib import closing
+from unittest import mock
+
+from tauk.context.test_case import TestCase as TaukTestCase
+from tauk.enums import AttachmentTypes
+from tauk.utils import is_port_free, reserve_open_port, release_port, get_open_port, upload_attachment, \
+    upload_attachments
+
+
+class PortAllocationTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tauk_home = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {'TAUK_HOME': self.tauk_home.name})
+        self.env.start()
+
+    def tearDown(self) -> None:
+        self.env.stop()
+        self.tauk_home.cleanup()
+
+    def test_bound_port_is_not_free(self):
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+            sock.bind(('', 0))
+            sock.listen()
+            port = sock.getsockname()[1]
+            self.assertFalse(is_port_free(port))
+            self.assertIsNone(get_open_port(range(port, port + 1)))
+
+    def test_reserved_port_is_skipped_until_released(self):
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+            sock.bind(('', 0))
+            port = sock.getsockname()[1]
+        port_range = range(port, port + 1)
+
+        self.assertEqual(port, reserve_open_port(port_range))
+        self.assertIsNone(reserve_open_port(port_range))
+        release_port(port)
+        self.assertEqual(port, reserve_open_port(port_range))
+
+    def test_expired_reservation_is_ignored(self):
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+            sock.bind(('', 0))
+            port = sock.getsockname()[1]
+        port_range = range(port, port + 1)
+
+        self.assertEqual(port, reserve_open_port(port_range))
+        self.assertEqual(port, reserve_open_port(port_range, ttl=0))
+
+
+class UploadAttachmentsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.api = mock.Mock()
+        self.test_case = TaukTestCase()
+        self.test_case.id = 'test-id'
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def _file(self, name):
+        file_path = os.path.join(self._tmp_dir.name, name)
+        with open(file_path, 'w') as file:
+            file.write('{}')
+        return file_path
+
+    def test_only_generated_attachments_are_deleted(self):
+        console_logs = self._file('console_logs.json')
+        har = self._file('network.har')
+        self.test_case.add_attachment(console_logs, AttachmentTypes.ASSISTANT_CONSOLE_LOGS)
+        self.test_case.add_attachment(har, AttachmentTypes.NETWORK_HAR)
+
+        upload_attachments(self.api, self.test_case)
+        self.assertEqual(2, self.api.upload_attachment.call_count)
+        self.assertFalse(os.path.exists(console_logs))
+        self.assertTrue(os.path.exists(har))
+
+    def test_streamed_attachments_are_not_uploaded_again(self):
+        streamed = self._file('console_logs.json')
+        self.test_case.add_attachment(streamed, AttachmentTypes.ASSISTANT_CONSOLE_LOGS, streamed=True)
+        self.assertTrue(upload_attachment(self.api, self.test_case, streamed, AttachmentTypes.ASSISTANT_CONSOLE_LOGS))
+        other = self._file('browser_logs.json')
+        self.test_case.add_attachment(other, AttachmentTypes.ASSISTANT_BROWSER_LOGS)
+
+        upload_attachments(self.api, self.test_case)
+        self.assertEqual([mock.call(streamed, AttachmentTypes.ASSISTANT_CONSOLE_LOGS, 'test-id'),
+                          mock.call(other, AttachmentTypes.ASSISTANT_BROWSER_LOGS, 'test-id')],
+                         self.api.upload_attachment.call_args_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,18 +2,50 @@ import inspect
 import logging
 import os
 import re
+import tempfile
 import typing
+import unittest
 from functools import wraps
+from unittest.mock import patch
 
 import responses
 
 from tauk.config import TaukConfig
 from tauk.exceptions import TaukException
 from tauk.tauk_webdriver import Tauk
+from tests.benchmark.mock_server import MockTaukServer
 
 logger = logging.getLogger('tauk')
 
 
+def upload_with_policy(policy, test_case):
+    """Applies the capture policy and remembers the artifacts of the test like a successful upload does"""
+    saved = policy.apply(test_case)
+    test_case.id = f'test-{id(test_case)}'
+    policy.remember_uploaded(test_case)
+    return saved
+
+
+class MockServerTestCase(unittest.TestCase):
+    """Runs every test with Tauk initialized against a local mock Tauk server, in a temporary execution dir"""
+
+    def tauk_config(self) -> TaukConfig:
+        return TaukConfig('api-token', 'project-id')
+
+    def setUp(self) -> None:
+        self.server = MockTaukServer(record_uploads=True).__enter__()
+        self.exec_dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {'TAUK_API_URL': self.server.api_url, 'TAUK_EXEC_DIR': self.exec_dir.name})
+        self.env.start()
+        Tauk(self.tauk_config())
+
+    def tearDown(self) -> None:
+        Tauk.destroy()
+        self.env.stop()
+        self.exec_dir.cleanup()
+        self.server.__exit__(None, None, None)
+
+
 def enable_mocking():
     responses.RequestsMock()
     responses.start()